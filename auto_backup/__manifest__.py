@@ -22,6 +22,7 @@
         "data/mail_message_subtype.xml",
         "security/ir.model.access.csv",
         "view/db_backup_view.xml",
+        "view/db_backup_run_view.xml",
     ],
     "installable": True,
     "external_dependencies": {"python": ["pysftp", "cryptography"]},
@@ -3,23 +3,75 @@
 # Copyright 2016 Grupo ESOC Ingenieria de Servicios, S.L.U. - Jairo Llopis
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
+import hashlib
+import json
 import logging
 import os
+import re
 import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
 import traceback
-from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, closing, contextmanager
 from datetime import datetime, timedelta
-from glob import iglob
+from itertools import chain
 
-from odoo import _, api, exceptions, fields, models, tools
+from markupsafe import Markup
+
+from odoo import _, api, exceptions, fields, models, sql_db, tools
 from odoo.exceptions import UserError
+from odoo.modules.neutralize import neutralize_database
 from odoo.service import db
+from odoo.tools import SQL
+
+from ..tools import (
+    BackupTee,
+    LocalStorage,
+    S3Storage,
+    SftpStorage,
+    TokenBucket,
+    compress_stream,
+    decompress_stream,
+    runner,
+    zstandard,
+)
 
 _logger = logging.getLogger(__name__)
+
+# extension of the backup files of each format, when it differs from its name
+EXTENSIONS = {
+    "zip": "dump.zip",
+    "directory": "dump.tar",
+    "incremental": "incremental.dump",
+    "zstd": "dump.zst",
+    "gzip": "dump.gz",
+}
+# formats compressing a pg_dump custom format archive while it is streamed
+COMPRESSED_FORMATS = ("zstd", "gzip")
+# slow backups are detected against the average of the last successful runs
+ALERT_RUNS = 10
+ALERT_MIN_RUNS = 3
+# default number of databases dumped at the same time by the backups of
+# several databases, set by the auto_backup.max_parallel_dumps parameter
+MAX_PARALLEL_DUMPS = 2
+# tables counted in the databases restored to verify the backups
+VERIFY_TABLES = ("res_users", "res_partner", "res_company", "ir_attachment")
+# files listing the filestore blobs needed by each incremental backup
+MANIFEST_EXTENSION = "incremental.json"
+# content-addressed store of the filestore blobs, in the backup folder
+FILESTORE_FOLDER = "filestore"
 try:
     import pysftp
 except ImportError:  # pragma: no cover
     _logger.debug("Cannot import pysftp")
+try:
+    import boto3
+except ImportError:  # pragma: no cover
+    boto3 = None
 
 
 class DbBackup(models.Model):
@@ -43,7 +95,8 @@ class DbBackup(models.Model):
     )
     folder = fields.Char(
         default=lambda self: self._default_folder(),
-        help="Absolute path for storing the backups",
+        help="Absolute path for storing the backups, or prefix of their keys "
+        "in the S3 bucket",
         required=True,
     )
     days_to_keep = fields.Integer(
@@ -53,7 +106,11 @@ class DbBackup(models.Model):
         "Set 0 to disable autodeletion.",
     )
     method = fields.Selection(
-        [("local", "Local disk"), ("sftp", "Remote SFTP server")],
+        [
+            ("local", "Local disk"),
+            ("sftp", "Remote SFTP server"),
+            ("s3", "S3 compatible object storage"),
+        ],
         default="local",
         help="Choose the storage method for this backup.",
     )
@@ -86,22 +143,124 @@ class DbBackup(models.Model):
         help="Path to the private key file. Only the Odoo user should have "
         "read permissions for that file.",
     )
+    s3_endpoint_url = fields.Char(
+        "S3 endpoint URL",
+        help="URL of the S3 compatible service, empty for Amazon S3",
+    )
+    s3_region = fields.Char("S3 region")
+    s3_bucket = fields.Char("S3 bucket")
+    s3_access_key = fields.Char("S3 access key")
+    s3_secret_key = fields.Char("S3 secret key")
+    upload_resumable = fields.Boolean(
+        "Resumable upload",
+        help="Write the backup in a local spool file, then upload it by "
+        "chunks over several channels. An interrupted upload resumes from "
+        "the last confirmed chunk on the next backup. Always enabled for "
+        "S3.",
+    )
+    upload_channels = fields.Integer(
+        default=4,
+        help="Number of chunks uploaded at the same time",
+    )
+    upload_chunk_size = fields.Integer(
+        "Upload chunk size (MiB)",
+        default=32,
+        help="S3 requires chunks of at least 5 MiB",
+    )
 
     backup_format = fields.Selection(
         [
             ("zip", "zip (includes filestore)"),
             ("dump", "pg_dump custom format (without filestore)"),
+            (
+                "directory",
+                "pg_dump directory format, parallel (without filestore)",
+            ),
+            (
+                "incremental",
+                "pg_dump custom format with incremental filestore",
+            ),
+            ("zstd", "pg_dump custom format, zstd compressed (without filestore)"),
+            ("gzip", "pg_dump custom format, gzip compressed (without filestore)"),
         ],
         default="zip",
         help="Choose the format for this backup.",
     )
+    dump_jobs = fields.Integer(
+        "Parallel jobs",
+        default=4,
+        help="Number of tables dumped or restored at the same time by the "
+        "directory format, each one uses a database connection. Number of "
+        "compression threads of the compressed formats.",
+    )
+    alert_factor = fields.Float(
+        default=2.0,
+        help="Warn the followers when a backup lasts more than this factor "
+        "times the average of the previous ones. Set 0 to disable.",
+    )
+    run_ids = fields.One2many(
+        comodel_name="db.backup.run",
+        inverse_name="backup_id",
+        string="Runs",
+    )
+    compression_level = fields.Integer(
+        default=3,
+        help="Compression level of the compressed formats: from 1 to 19 for "
+        "zstd, from 1 to 9 for gzip.",
+    )
+    db_filter = fields.Char(
+        "Databases",
+        help="Regular expression matching the names of the databases to back "
+        "up, each one in its own subfolder. Empty to back up the current "
+        "database only.",
+    )
+    destination_concurrency = fields.Integer(
+        default=1,
+        help="Maximum number of databases written at the same time to the "
+        "server of this destination, when backing up several databases",
+    )
+    verify_restore = fields.Boolean(
+        "Verify by restoring",
+        help="After each backup, restore it in a scratch database, check it "
+        "and drop it. The time to restore is recorded on the run.",
+    )
+    run_detached = fields.Boolean(
+        "Run in a separate process",
+        help="Run the backup in a low priority process, detached from the "
+        "Odoo workers, so it does not block them nor hit their time limits.",
+    )
+    nice = fields.Integer(
+        "CPU niceness",
+        default=10,
+        help="Niceness added to the separate process, from 0 to 19",
+    )
+    ionice_idle = fields.Boolean(
+        "Idle I/O priority",
+        default=True,
+        help="Only give disk time to the separate process when no other "
+        "process needs it",
+    )
+    bandwidth_limit = fields.Integer(
+        "Bandwidth limit (MiB/s)",
+        help="Maximum throughput of the dump written to the destinations. "
+        "Set 0 for no limit.",
+    )
+    runner_pid = fields.Integer("Runner PID", readonly=True, copy=False)
+    runner_state = fields.Selection(
+        [("running", "Running"), ("done", "Done"), ("failed", "Failed")],
+        readonly=True,
+        copy=False,
+    )
+    runner_started_at = fields.Datetime(readonly=True, copy=False)
+    runner_process_start = fields.Char(readonly=True, copy=False)
+    runner_finished_at = fields.Datetime(readonly=True, copy=False)
 
     @api.model
     def _default_folder(self):
         """Default to ``backups`` folder inside current server datadir."""
         return os.path.join(tools.config["data_dir"], "backups", self.env.cr.dbname)
 
-    @api.depends("folder", "method", "sftp_host", "sftp_port", "sftp_user")
+    @api.depends("folder", "method", "sftp_host", "sftp_port", "sftp_user", "s3_bucket")
     def _compute_name(self):
         """Get the right summary for this job."""
         for rec in self:
@@ -109,6 +268,53 @@ class DbBackup(models.Model):
                 rec.name = f"{rec.folder} @ localhost"
             elif rec.method == "sftp":
                 rec.name = f"sftp://{rec.sftp_user}@{rec.sftp_host}:{rec.sftp_port}{rec.folder}"
+            elif rec.method == "s3":
+                rec.name = f"s3://{rec.s3_bucket}/{rec.folder.strip('/')}"
+
+    @api.constrains("backup_format", "compression_level")
+    def _check_compression(self):
+        for record in self:
+            if record.backup_format == "zstd" and zstandard is None:
+                raise exceptions.ValidationError(
+                    self.env._("The zstandard python library is not installed.")
+                )
+            maximum = {"zstd": 19, "gzip": 9}.get(record.backup_format)
+            if maximum and not 1 <= record.compression_level <= maximum:
+                raise exceptions.ValidationError(
+                    self.env._(
+                        "The compression level must be between 1 and %(maximum)s.",
+                        maximum=maximum,
+                    )
+                )
+
+    @api.constrains("method")
+    def _check_s3(self):
+        if boto3 is None and any(record.method == "s3" for record in self):
+            raise exceptions.ValidationError(
+                self.env._("The boto3 python library is not installed.")
+            )
+
+    @api.constrains("db_filter")
+    def _check_db_filter(self):
+        for record in self.filtered("db_filter"):
+            try:
+                re.compile(record.db_filter)
+            except re.error as exc:
+                raise exceptions.ValidationError(
+                    self.env._("Invalid databases expression: %(error)s", error=exc)
+                ) from exc
+
+    @api.constrains("nice", "bandwidth_limit")
+    def _check_runner(self):
+        for record in self:
+            if not 0 <= record.nice <= 19:
+                raise exceptions.ValidationError(
+                    self.env._("The CPU niceness must be between 0 and 19.")
+                )
+            if record.bandwidth_limit < 0:
+                raise exceptions.ValidationError(
+                    self.env._("The bandwidth limit cannot be negative.")
+                )
 
     @api.constrains("folder", "method")
     def _check_folder(self):
@@ -138,60 +344,934 @@ class DbBackup(models.Model):
             _logger.info("Connection Test Failed!", exc_info=True)
             raise UserError(self.env._("Connection Test Failed!")) from exc
 
+    def action_s3_test_connection(self):
+        """Check if the S3 settings are correct."""
+        try:
+            self._s3_client().head_bucket(Bucket=self.s3_bucket)
+        except Exception as exc:
+            _logger.info("Connection Test Failed!", exc_info=True)
+            raise UserError(self.env._("Connection Test Failed!")) from exc
+        raise UserError(self.env._("Connection Test Succeeded!"))
+
     def action_backup(self):
-        """Run selected backups."""
-        backup = None
+        """Run selected backups.
+
+        The database is dumped once per backup format and streamed to all
+        the destinations of that format at the same time. The backups set to
+        run detached are handed to a separate process, the backups of
+        several databases to ``_backup_databases``.
+        """
+        self._run_backups({})
+
+    def _run_backups(self, runs):
+        """Run the backups, see ``action_backup``.
+
+        :param dict runs: receives the ids of the ``db.backup.run`` created,
+            by id of their record
+        """
         successful = self.browse()
+        records = self
+        if not self.env.context.get("auto_backup_runner"):
+            detached = self.browse([rec.id for rec in self if rec.run_detached])
+            if detached:
+                detached._launch_runner()
+                records -= detached
+        if not self.env.context.get("auto_backup_db"):
+            several = records.browse([rec.id for rec in records if rec.db_filter])
+            if several:
+                several._backup_databases(runs)
+                records -= several
+        local = records.filtered(lambda r: r.method == "local")
+        remote = records.filtered(lambda r: r.method != "local")
+        by_format = {}
+        for rec in chain(local, remote):
+            by_format.setdefault(rec.backup_format, self.browse())
+            by_format[rec.backup_format] |= rec
+        for backup_format, records in by_format.items():
+            successful |= records._backup_dump(backup_format, runs)
 
-        # Start with local storage
-        for rec in self.filtered(lambda r: r.method == "local"):
-            filename = self.filename(datetime.now(), ext=rec.backup_format)
-            with rec.backup_log():
-                # Directory must exist
+        # Remove old files for successful backups
+        successful.cleanup(runs)
+
+    def _backup_db_name(self):
+        """Name of the database backed up, the current one by default."""
+        return self.env.context.get("auto_backup_db") or self.env.cr.dbname
+
+    def _backup_folder(self):
+        """Folder of the backups of the database backed up."""
+        self.ensure_one()
+        db_name = self._backup_db_name()
+        if db_name == self.env.cr.dbname:
+            return self.folder
+        return os.path.join(self.folder, db_name)
+
+    def _destination_key(self):
+        """Identify the server written to, shared by several records."""
+        self.ensure_one()
+        if self.method == "sftp":
+            return f"sftp://{self.sftp_host}:{self.sftp_port}"
+        if self.method == "s3":
+            return f"s3://{self.s3_endpoint_url or ''}/{self.s3_bucket}"
+        return "local"
+
+    def _backup_databases(self, runs=None):
+        """Back up all the databases matched by the filters of the records.
+
+        Each database is backed up with its own cursor in a worker thread,
+        at most ``auto_backup.max_parallel_dumps`` at the same time, and at
+        most ``destination_concurrency`` per destination server. A report
+        of all the backups is posted on the records.
+
+        :param dict runs: receives the ids of the ``db.backup.run`` created,
+            by id of their record
+        :return: the report, a list of dictionaries
+        """
+        max_dumps = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("auto_backup.max_parallel_dumps", MAX_PARALLEL_DUMPS)
+        )
+        max_dumps = max(max_dumps, 1)
+        slots = {}
+        for rec in self:
+            key = rec._destination_key()
+            slots[key] = min(
+                slots.get(key, rec.destination_concurrency),
+                rec.destination_concurrency,
+            )
+        semaphores = {
+            key: threading.BoundedSemaphore(max(size, 1)) for key, size in slots.items()
+        }
+        tasks = []
+        for db_name in db.list_dbs(True):
+            by_format = {}
+            for rec in self:
+                if re.fullmatch(rec.db_filter, db_name):
+                    by_format.setdefault(rec.backup_format, self.browse())
+                    by_format[rec.backup_format] |= rec
+            tasks.extend((db_name, records) for records in by_format.values())
+        _logger.info(
+            "Backing up %d databases, %d at the same time",
+            len({db_name for db_name, _records in tasks}),
+            max_dumps,
+        )
+        futures = []
+        with ThreadPoolExecutor(max_dumps, thread_name_prefix="backup-db") as pool:
+            for db_name, records in tasks:
+                # always taken in the same order, not to deadlock
+                keys = sorted({rec._destination_key() for rec in records})
+                futures.append(
+                    pool.submit(
+                        self._backup_database,
+                        db_name,
+                        records.ids,
+                        [semaphores[key] for key in keys],
+                        runs,
+                    )
+                )
+        report = []
+        for (db_name, records), future in zip(tasks, futures, strict=True):
+            try:
+                report.extend(future.result())
+            except Exception as exc:
+                _logger.exception("Backup of the database %s failed", db_name)
+                report.extend(
+                    {
+                        "database": db_name,
+                        "backup": rec.name,
+                        "state": "failed",
+                        "duration": 0.0,
+                        "error": str(exc),
+                    }
+                    for rec in records
+                )
+        self._post_backup_report(report)
+        return report
+
+    def _backup_database(self, db_name, ids, semaphores, runs=None):
+        """Back up ``db_name`` to the records ``ids``, in a worker thread.
+
+        The records are only read with the cursor of the thread, once the
+        ``semaphores`` of their destinations are acquired.
+
+        :return: the lines of the report of these backups
+        """
+        with ExitStack() as stack:
+            for semaphore in semaphores:
+                stack.enter_context(semaphore)
+            with self.env.registry.cursor() as cr:
+                env = api.Environment(
+                    cr, self.env.uid, dict(self.env.context, auto_backup_db=db_name)
+                )
+                records = self.with_env(env).browse(ids)
+                db_runs = {}
+                successful = records._backup_dump(records[:1].backup_format, db_runs)
+                successful.cleanup(db_runs)
+                if runs is not None:
+                    for id_, run_ids in db_runs.items():
+                        runs.setdefault(id_, []).extend(run_ids)
+                return [
+                    {
+                        "database": db_name,
+                        "backup": run.backup_id.name,
+                        "state": run.state,
+                        "duration": run.duration,
+                        "error": run.error or "",
+                    }
+                    for run in env["db.backup.run"].browse(
+                        list(chain.from_iterable(db_runs.values()))
+                    )
+                ]
+
+    def _post_backup_report(self, report):
+        """Post the report of the backups of several databases."""
+        failed = [line for line in report if line["state"] != "success"]
+        _logger.info(
+            "Backups of several databases: %d succeeded, %d failed",
+            len(report) - len(failed),
+            len(failed),
+        )
+        rows = Markup("").join(
+            Markup(
+                "<tr><td>%s</td><td>%s</td><td>%s</td><td>%.1fs</td><td>%s</td></tr>"
+            )
+            % (
+                line["database"],
+                line["backup"],
+                line["state"],
+                line["duration"],
+                line["error"],
+            )
+            for line in report
+        )
+        body = Markup(
+            "<p>%s</p><table class='table table-sm'><tr><th>%s</th><th>%s</th>"
+            "<th>%s</th><th>%s</th><th>%s</th></tr>%s</table>"
+        ) % (
+            self.env._(
+                "Backups of %(count)s databases: %(failed)s failed.",
+                count=len({line["database"] for line in report}),
+                failed=len(failed),
+            ),
+            self.env._("Database"),
+            self.env._("Backup"),
+            self.env._("State"),
+            self.env._("Duration"),
+            self.env._("Error"),
+            rows,
+        )
+        subtype = "auto_backup.mail_message_subtype_failure" if failed else None
+        for rec in self:
+            rec.message_post(body=body, subtype_id=subtype and self.env.ref(subtype).id)
+
+    def _backup_dump(self, backup_format, runs=None):
+        """Dump the database to the destinations of all the records.
+
+        A ``db.backup.run`` recording the metrics of the backup is created
+        for each record, its id is added to ``runs`` when given.
+
+        :return: the records whose backup succeeded
+        """
+        filename = self.filename(datetime.now(), ext=backup_format)
+        errors = {}
+        transfer = dict.fromkeys(self, 0.0)
+        stats = self._backup_stream(filename, backup_format, errors, transfer)
+        if backup_format == "incremental":
+            for rec in self:
+                if rec in errors:
+                    continue
+                start = time.monotonic()
                 try:
-                    os.makedirs(rec.folder, exist_ok=True)
-                except OSError as exc:
-                    _logger.exception(f"Action backup - OSError: {exc}")
-
-                with open(os.path.join(rec.folder, filename), "wb") as destiny:
-                    # Copy the cached backup
-                    if backup:
-                        with open(backup) as cached:
-                            shutil.copyfileobj(cached, destiny)
-                    # Generate new backup
-                    else:
-                        db.dump_db(
-                            self.env.cr.dbname, destiny, backup_format=rec.backup_format
-                        )
-                        backup = backup or destiny.name
+                    rec._backup_filestore(filename)
+                except Exception as exc:
+                    errors[rec] = exc
+                transfer[rec] += time.monotonic() - start
+        successful = self.browse()
+        for rec in self:
+            run = rec._create_run(stats, transfer[rec], errors.get(rec))
+            if runs is not None:
+                runs.setdefault(rec.id, []).append(run.id)
+            with rec.backup_log():
+                if rec in errors:
+                    raise errors[rec]
                 successful |= rec
+                rec._check_run_duration(run)
+            if rec in successful and rec.verify_restore:
+                rec._verify_restore(filename, run)
+        return successful
 
-        # Ensure a local backup exists if we are going to write it remotely
-        sftp = self.filtered(lambda r: r.method == "sftp")
-        if sftp:
-            for rec in sftp:
-                filename = self.filename(datetime.now(), ext=rec.backup_format)
-                with rec.backup_log():
-                    cached = db.dump_db(
-                        self.env.cr.dbname, None, backup_format=rec.backup_format
+    def _backup_stream(self, filename, backup_format, errors, transfer):
+        """Stream a single dump to the destinations of all the records.
+
+        The failures of the records are added to ``errors``, the time spent
+        to finish writing on their destination to ``transfer``.
+
+        :return: the statistics of the dump
+        """
+        stacks = {}
+        for rec in self:
+            stack = ExitStack()
+            try:
+                stacks[rec] = (
+                    stack,
+                    stack.enter_context(rec._backup_destination(filename)),
+                )
+            except Exception as exc:
+                stack.close()
+                errors[rec] = exc
+        if not stacks:
+            return {}
+        stats = {}
+        records = list(stacks)
+        limits = [rec.bandwidth_limit for rec in records if rec.bandwidth_limit]
+        throttle = TokenBucket(min(limits) * 2**20) if limits else None
+        tee = BackupTee(
+            (stream for stack, stream in stacks.values()), throttle=throttle
+        )
+        dumped = None
+        try:
+            with tee:
+                start = time.monotonic()
+                size = self._dump_db(self._backup_db_name(), tee, backup_format)
+                dumped = time.monotonic()
+            stats = self._log_dump_stats(size, tee.bytes_written, dumped - start)
+        except Exception as exc:
+            errors.update(dict.fromkeys(records, exc))
+        for index, exc in tee.errors.items():
+            errors.setdefault(records[index], exc)
+        # the destinations are written while dumping, what remains is the
+        # time to flush them
+        waited = time.monotonic() - dumped if dumped else 0.0
+        for rec, (stack, _stream) in stacks.items():
+            start = time.monotonic()
+            error = errors.get(rec)
+            try:
+                if error:
+                    # let the destination know the backup is incomplete
+                    stack.__exit__(type(error), error, error.__traceback__)
+                else:
+                    stack.close()
+            except Exception as exc:
+                errors.setdefault(rec, exc)
+            transfer[rec] += waited + time.monotonic() - start
+        return stats
+
+    def _create_run(self, stats, transfer_duration, error=None):
+        """Record the metrics of a backup of this record."""
+        self.ensure_one()
+        return self.env["db.backup.run"].create(
+            {
+                "backup_id": self.id,
+                "database": self._backup_db_name(),
+                "backup_format": self.backup_format,
+                "state": "failed" if error else "success",
+                "error": str(error) if error else False,
+                "dump_duration": stats.get("duration", 0.0),
+                "transfer_duration": transfer_duration,
+                "written_mb": stats.get("written", 0.0),
+                "uncompressed_mb": stats.get("size", 0.0),
+                "compression_ratio": stats.get("ratio", 0.0),
+            }
+        )
+
+    def _check_run_duration(self, run):
+        """Warn the followers when a backup is much longer than usual."""
+        self.ensure_one()
+        if not self.alert_factor:
+            return
+        previous = self.env["db.backup.run"].search(
+            [
+                ("backup_id", "=", self.id),
+                ("database", "=", run.database),
+                ("state", "=", "success"),
+                ("id", "!=", run.id),
+            ],
+            limit=ALERT_RUNS,
+        )
+        if len(previous) < ALERT_MIN_RUNS:
+            return
+        average = sum(previous.mapped("duration")) / len(previous)
+        if average and run.duration > self.alert_factor * average:
+            run.slow = True
+            self.message_post(
+                body=self.env._(
+                    "Database backup took %(duration)ds, %(factor).1f times the "
+                    "average of the previous backups.",
+                    duration=run.duration,
+                    factor=run.duration / average,
+                ),
+                subtype_id=self.env.ref("auto_backup.mail_message_subtype_failure").id,
+            )
+
+    def _dump_db(self, db_name, stream, backup_format):
+        """Write the dump of the database in the given format to ``stream``.
+
+        :return: the size of the uncompressed dump, when it is known
+        """
+        if backup_format == "incremental":
+            # the filestore is synchronized apart
+            backup_format = "dump"
+        jobs = max(max(self.mapped("dump_jobs") or [1]), 1)
+        if backup_format in COMPRESSED_FORMATS:
+            return self._dump_compressed(db_name, stream, backup_format, jobs)
+        if backup_format != "directory":
+            db.dump_db(db_name, stream, backup_format=backup_format)
+            return None
+        # the uncompressed dump can be large: it is written next to the
+        # backups, not in the system temporary folder
+        local = self.filtered(lambda r: r.method == "local")[:1]
+        scratch = local._backup_folder() if local else self[:1]._spool_folder()
+        os.makedirs(scratch, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=scratch, prefix=".dump-") as dump_dir:
+            path = os.path.join(dump_dir, "dump")
+            cmd = [
+                tools.find_pg_tool("pg_dump"),
+                "--no-owner",
+                "--format=directory",
+                f"--jobs={jobs}",
+                f"--file={path}",
+                db_name,
+            ]
+            _logger.info("Dumping database %s with %d jobs", db_name, jobs)
+            subprocess.run(
+                cmd,
+                env=tools.exec_pg_environ(),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                check=True,
+            )
+            # the dump files are streamed, the archive is never stored
+            with tarfile.open(fileobj=stream, mode="w|") as archive:
+                archive.add(path, arcname="dump")
+
+    def _dump_compressed(self, db_name, stream, backup_format, jobs):
+        """Pipe an uncompressed pg_dump archive through the compressor.
+
+        :return: the size of the uncompressed dump
+        """
+        cmd = [
+            tools.find_pg_tool("pg_dump"),
+            "--no-owner",
+            "--format=custom",
+            "--compress=0",
+            db_name,
+        ]
+        level = max(self.mapped("compression_level") or [3])
+        with subprocess.Popen(
+            cmd,
+            env=tools.exec_pg_environ(),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+        ) as dump:
+            size = compress_stream(
+                dump.stdout, stream, backup_format, level=level, threads=jobs
+            )
+        if dump.returncode:
+            raise subprocess.CalledProcessError(dump.returncode, cmd)
+        return size
+
+    def _log_dump_stats(self, size, written, duration):
+        """Log the compression ratio and the throughput of a dump."""
+        stats = {
+            "written": written / 2**20,
+            "duration": duration,
+            "throughput": written / 2**20 / duration if duration else 0.0,
+        }
+        if size:
+            stats.update(size=size / 2**20, ratio=size / written if written else 0)
+            _logger.info(
+                "Database dump of %(size).1f MiB compressed to %(written).1f MiB "
+                "(ratio %(ratio).2f) in %(duration).1fs, %(throughput).1f MiB/s",
+                stats,
+            )
+        else:
+            _logger.info(
+                "Database dump of %(written).1f MiB written in %(duration).1fs, "
+                "%(throughput).1f MiB/s",
+                stats,
+            )
+        return stats
+
+    def _restore_dump(self, path, db_name, neutralize=False):
+        """Restore the backup file at ``path`` in a new database ``db_name``.
+
+        Dumps of the custom, directory and compressed formats are restored
+        by ``dump_jobs`` parallel jobs.
+        """
+        self.ensure_one()
+        if self.backup_format == "zip":
+            return db.restore_db(db_name, path, neutralize_database=neutralize)
+        db._create_empty_database(db_name)
+        with tempfile.TemporaryDirectory() as restore_dir:
+            source = path
+            if self.backup_format == "directory":
+                with tarfile.open(path) as archive:
+                    archive.extractall(restore_dir, filter="data")
+                source = os.path.join(restore_dir, "dump")
+            elif self.backup_format in COMPRESSED_FORMATS:
+                # pg_restore only runs parallel jobs on a seekable file
+                source = os.path.join(restore_dir, "dump")
+                with open(path, "rb") as compressed, open(source, "wb") as dump:
+                    decompress_stream(compressed, dump, self.backup_format)
+            cmd = [
+                tools.find_pg_tool("pg_restore"),
+                "--no-owner",
+                f"--jobs={max(self.dump_jobs, 1)}",
+                f"--dbname={db_name}",
+                source,
+            ]
+            _logger.info("Restoring database %s from %s", db_name, path)
+            subprocess.run(
+                cmd,
+                env=tools.exec_pg_environ(),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                check=True,
+            )
+        if neutralize:
+            with closing(sql_db.db_connect(db_name).cursor()) as cr:
+                neutralize_database(cr)
+                cr.commit()
+        if self.backup_format == "incremental":
+            self._restore_filestore(path, db_name)
+
+    def _verify_restore(self, filename, run):
+        """Restore the backup ``filename`` in a scratch database to check it.
+
+        The time to restore and the result of the checks are recorded on
+        ``run``. The scratch database is dropped at the end.
+        """
+        self.ensure_one()
+        db_name = f"{self._backup_db_name()}_verify_{self.id}"
+        # a database left by an interrupted verification
+        db.exp_drop(db_name)
+        try:
+            with tempfile.TemporaryDirectory() as fetch_dir:
+                path = self._fetch_backup(filename, fetch_dir)
+                start = time.monotonic()
+                self._restore_dump(path, db_name, neutralize=True)
+                run.restore_duration = time.monotonic() - start
+            report = self._check_restored(db_name)
+        except Exception as exc:
+            _logger.exception("Verification of the backup %s failed", filename)
+            run.write({"verify_state": "failed", "verify_report": str(exc)})
+            self.message_post(
+                body=self.env._(
+                    "Restoring the backup %(filename)s failed: %(error)s",
+                    filename=filename,
+                    error=exc,
+                ),
+                subtype_id=self.env.ref("auto_backup.mail_message_subtype_failure").id,
+            )
+        else:
+            _logger.info("Backup %s verified: %s", filename, report)
+            run.write(
+                {
+                    "verify_state": "verified",
+                    "verify_report": json.dumps(report, indent=2),
+                }
+            )
+        finally:
+            try:
+                db.exp_drop(db_name)
+            except Exception:
+                _logger.exception("Dropping the database %s failed", db_name)
+
+    def _fetch_backup(self, filename, fetch_dir):
+        """Return the local path of the backup ``filename``.
+
+        Remote backups are downloaded in ``fetch_dir``, with the manifest
+        and the stored files of incremental backups.
+        """
+        self.ensure_one()
+        folder = self._backup_folder()
+        if self.method == "local":
+            return os.path.join(folder, filename)
+        with self._storage() as storage:
+            names = [filename]
+            if self.backup_format == "incremental":
+                names.append(self._manifest_name(filename))
+            for name in names:
+                storage.get(os.path.join(folder, name), os.path.join(fetch_dir, name))
+            if self.backup_format == "incremental":
+                with open(os.path.join(fetch_dir, names[1])) as manifest:
+                    files = json.load(manifest)["files"]
+                for relpath in files:
+                    target = os.path.join(fetch_dir, FILESTORE_FOLDER, relpath)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    storage.get(os.path.join(folder, FILESTORE_FOLDER, relpath), target)
+        return os.path.join(fetch_dir, filename)
+
+    def _check_restored(self, db_name):
+        """Run sanity checks on the restored database ``db_name``.
+
+        :return: the row counts of the ``VERIFY_TABLES``, the number of
+            installed modules and of checked filestore files
+        """
+        self.ensure_one()
+        installed = SQL(
+            "SELECT count(*) FROM ir_module_module WHERE state = 'installed'"
+        )
+        report = {}
+        with closing(sql_db.db_connect(db_name).cursor()) as cr:
+            for table in VERIFY_TABLES:
+                cr.execute(SQL("SELECT count(*) FROM %s", SQL.identifier(table)))
+                report[table] = cr.fetchone()[0]
+            cr.execute(installed)
+            report["installed_modules"] = cr.fetchone()[0]
+        sql_db.close_db(db_name)
+        with closing(sql_db.db_connect(self._backup_db_name()).cursor()) as cr:
+            cr.execute(installed)
+            expected = cr.fetchone()[0]
+        if report["installed_modules"] != expected:
+            raise UserError(
+                self.env._("The restored database has other installed modules.")
+            )
+        if not report["res_users"]:
+            raise UserError(self.env._("The restored database has no users."))
+        report["filestore_files"] = self._check_filestore(db_name)
+        return report
+
+    def _check_filestore(self, db_name):
+        """Check the files of the filestore match their checksum.
+
+        Attachments are stored under the SHA-1 of their content, in folders
+        named after its first two characters. The other folders, such as
+        ``checklist``, do not hold attachments.
+
+        :return: the number of checked files
+        """
+        filestore = tools.config.filestore(db_name)
+        if not os.path.isdir(filestore):
+            return 0
+        checked = 0
+        for prefix in os.listdir(filestore):
+            folder = os.path.join(filestore, prefix)
+            if not re.fullmatch(r"[0-9a-f]{2}", prefix) or not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                digest = hashlib.sha1()
+                with open(os.path.join(folder, name), "rb") as stored:
+                    while chunk := stored.read(2**20):
+                        digest.update(chunk)
+                if digest.hexdigest() != name:
+                    raise UserError(
+                        self.env._(
+                            "The filestore file %(name)s is corrupted.", name=name
+                        )
                     )
+                checked += 1
+        return checked
 
-                    with cached:
-                        with rec.sftp_connection() as remote:
-                            try:
-                                remote.makedirs(rec.folder)
-                            except pysftp.ConnectionException as exc:
-                                _logger.exception(f"pysftp ConnectionException: {exc}")
+    @staticmethod
+    def _manifest_name(filename):
+        """Name of the manifest of the incremental backup ``filename``."""
+        return filename[: -len(EXTENSIONS["incremental"])] + MANIFEST_EXTENSION
 
-                            # Copy cached backup to remote server
-                            with remote.open(
-                                os.path.join(rec.folder, filename), "wb"
-                            ) as destiny:
-                                shutil.copyfileobj(cached, destiny)
-                        successful |= rec
+    def _filestore_files(self):
+        """Return the paths of the filestore files, relative to the filestore.
 
-        # Remove old files for successful backups
-        successful.cleanup()
+        Attachments are stored under their checksum, their paths identify
+        their content.
+        """
+        filestore = tools.config.filestore(self._backup_db_name())
+        if not os.path.isdir(filestore):
+            return []
+        files = []
+        for prefix in sorted(os.listdir(filestore)):
+            folder = os.path.join(filestore, prefix)
+            if len(prefix) != 2 or not os.path.isdir(folder):
+                continue
+            files.extend(f"{prefix}/{name}" for name in sorted(os.listdir(folder)))
+        return files
+
+    def _backup_filestore(self, filename):
+        """Synchronize the filestore for the incremental backup ``filename``.
+
+        Only the files missing from the store of the destination are sent,
+        then the manifest listing the files of the backup is written.
+        """
+        self.ensure_one()
+        filestore = tools.config.filestore(self._backup_db_name())
+        files = self._filestore_files()
+        folder = self._backup_folder()
+        store = os.path.join(folder, FILESTORE_FOLDER)
+        manifest = json.dumps(
+            {
+                "database": self._backup_db_name(),
+                "dump": filename,
+                "files": files,
+            }
+        )
+        sent = 0
+        with self._storage() as storage:
+            existing = set(self._store_files(storage, store))
+            for relpath in files:
+                if relpath in existing:
+                    continue
+                target = os.path.join(store, relpath)
+                storage.makedirs(os.path.dirname(target))
+                storage.put(os.path.join(filestore, relpath), target)
+                sent += 1
+            with storage.open(
+                os.path.join(folder, self._manifest_name(filename)), "w"
+            ) as destiny:
+                destiny.write(manifest)
+        _logger.info(
+            "Filestore synchronized: %d files sent, %d already stored",
+            sent,
+            len(files) - sent,
+        )
+
+    @staticmethod
+    def _store_files(storage, store):
+        """Return the paths of the files of a store, relative to it."""
+        return [
+            f"{prefix}/{name}"
+            for prefix in storage.listdir(store)
+            for name in storage.listdir(os.path.join(store, prefix))
+            if not name.endswith(".part")
+        ]
+
+    def _restore_filestore(self, path, db_name):
+        """Copy the files listed by the manifest of ``path`` to ``db_name``."""
+        self.ensure_one()
+        folder = os.path.dirname(path)
+        with open(
+            os.path.join(folder, self._manifest_name(os.path.basename(path)))
+        ) as manifest:
+            files = json.load(manifest)["files"]
+        filestore = tools.config.filestore(db_name)
+        for relpath in files:
+            target = os.path.join(filestore, relpath)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(os.path.join(folder, FILESTORE_FOLDER, relpath), target)
+
+    def _gc_filestore(self):
+        """Remove the stored files no manifest references anymore."""
+        self.ensure_one()
+        folder = self._backup_folder()
+        store = os.path.join(folder, FILESTORE_FOLDER)
+        referenced = set()
+        removed = 0
+        with self._storage() as storage:
+            for name in storage.listdir(folder):
+                if name.endswith(f".{MANIFEST_EXTENSION}"):
+                    with storage.open(os.path.join(folder, name)) as manifest:
+                        referenced.update(json.load(manifest)["files"])
+            for relpath in self._store_files(storage, store):
+                if relpath not in referenced:
+                    storage.remove(os.path.join(store, relpath))
+                    removed += 1
+        _logger.info("Filestore garbage collected: %d files removed", removed)
+
+    @contextmanager
+    def _backup_destination(self, filename):
+        """Open the file where the backup named ``filename`` is written.
+
+        Resumable uploads write the backup in a local spool file first,
+        uploaded by chunks once complete.
+        """
+        self.ensure_one()
+        path = os.path.join(self._backup_folder(), filename)
+        if self.method == "s3" or self.method == "sftp" and self.upload_resumable:
+            self._resume_uploads()
+            spool = os.path.join(self._spool_folder(), filename)
+            try:
+                with open(spool, "wb") as destiny:
+                    yield destiny
+            except BaseException:
+                os.unlink(spool)
+                raise
+            self._upload_spool(spool, path)
+            return
+        with self._storage() as storage:
+            self._makedirs(storage)
+            with storage.open(path, "wb") as destiny:
+                yield destiny
+
+    def _storage(self):
+        """Return the storage of the backups, to use as context manager."""
+        self.ensure_one()
+        if self.method == "sftp":
+            return SftpStorage(self.sftp_connection)
+        if self.method == "s3":
+            return S3Storage(self._s3_client(), self.s3_bucket)
+        return LocalStorage()
+
+    def _makedirs(self, storage):
+        """Create the backup folder, a failure is reported when writing."""
+        try:
+            storage.makedirs(self._backup_folder())
+        except Exception as exc:
+            _logger.exception(f"Action backup - cannot create the folder: {exc}")
+
+    def _spool_folder(self):
+        """Local folder of the backups waiting to be uploaded."""
+        self.ensure_one()
+        folder = os.path.join(
+            tools.config["data_dir"],
+            "backups",
+            ".spool",
+            self._backup_db_name(),
+            str(self.id),
+        )
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def _upload_spool(self, spool, path):
+        """Upload a spooled backup by chunks, then remove it."""
+        self.ensure_one()
+        with self._storage() as storage:
+            self._makedirs(storage)
+            storage.upload(
+                spool,
+                path,
+                chunk_size=max(self.upload_chunk_size, 1) * 2**20,
+                channels=self.upload_channels,
+                state_path=f"{spool}.state.json",
+            )
+        os.unlink(spool)
+
+    def _resume_uploads(self):
+        """Upload the backups whose upload was interrupted."""
+        self.ensure_one()
+        folder = self._spool_folder()
+        for name in sorted(os.listdir(folder)):
+            if name.endswith((".state.json", ".state.json.tmp")):
+                continue
+            spool = os.path.join(folder, name)
+            try:
+                self._upload_spool(spool, os.path.join(self._backup_folder(), name))
+            except Exception:
+                _logger.exception("Resuming the upload of %s failed", spool)
+
+    def _launch_runner(self):
+        """Start a separate process running the backups of the records.
+
+        The process is niced, gets an idle I/O priority if asked, and
+        outlives the worker starting it. The settings of the first record
+        apply to all of them.
+        """
+        running = self.filtered(lambda rec: rec.runner_state == "running")
+        for rec in running:
+            _logger.warning(
+                "Backup %s not started: its runner %d is still running",
+                rec.name,
+                rec.runner_pid,
+            )
+        self -= running
+        if not self:
+            return
+        # marked before the process starts, so that a concurrent launch
+        # waits for this transaction and then finds the runner running
+        self.write(
+            {
+                "runner_pid": 0,
+                "runner_state": "running",
+                "runner_process_start": False,
+                "runner_started_at": fields.Datetime.now(),
+                "runner_finished_at": False,
+            }
+        )
+        self.flush_recordset()
+        settings = self[:1]
+        log_folder = os.path.join(tools.config["data_dir"], "backups")
+        os.makedirs(log_folder, exist_ok=True)
+        config = {
+            "odoo_args": runner.odoo_args(tools.config),
+            "dbname": self.env.cr.dbname,
+            "ids": self.ids,
+        }
+        try:
+            runner.launch(
+                config,
+                niceness=settings.nice,
+                idle_io=settings.ionice_idle,
+                log_path=os.path.join(log_folder, "runner.log"),
+            )
+        except Exception:
+            self.write(
+                {"runner_state": "failed", "runner_finished_at": fields.Datetime.now()}
+            )
+            for rec in self:
+                with rec.backup_log():
+                    raise
+        else:
+            _logger.info("Backups %s handed to a separate process", self.ids)
+
+    def _run_detached(self):
+        """Run the backups in the separate process and record its state."""
+        self.write(
+            {
+                "runner_pid": os.getpid(),
+                "runner_process_start": runner.process_start(os.getpid()),
+                "runner_state": "running",
+                "runner_started_at": fields.Datetime.now(),
+                "runner_finished_at": False,
+            }
+        )
+        self.env.cr.commit()
+        runs = {}
+        try:
+            self._run_backups(runs)
+        except Exception:
+            _logger.exception("Detached backups %s failed", self.ids)
+            self.env.cr.rollback()
+            self.env.invalidate_all()
+            failed = self
+        else:
+            Run = self.env["db.backup.run"]
+            failed = self.browse(
+                [
+                    rec.id
+                    for rec in self
+                    if set(Run.browse(runs.get(rec.id, [])).mapped("state"))
+                    != {"success"}
+                ]
+            )
+        (self - failed).write(
+            {"runner_state": "done", "runner_finished_at": fields.Datetime.now()}
+        )
+        failed.write(
+            {"runner_state": "failed", "runner_finished_at": fields.Datetime.now()}
+        )
+        self.env.cr.commit()
+
+    @api.model
+    def _cron_check_runners(self):
+        """Mark as failed the runners that died before finishing."""
+        # time left to a launched runner to record its process
+        limit = fields.Datetime.now() - timedelta(hours=1)
+        for rec in self.search([("runner_state", "=", "running")]):
+            if rec.runner_pid:
+                if rec._runner_alive():
+                    continue
+            elif rec.runner_started_at and rec.runner_started_at > limit:
+                continue
+            _logger.warning("Backup runner %d of %s died", rec.runner_pid, rec.name)
+            rec.write(
+                {
+                    "runner_state": "failed",
+                    "runner_finished_at": fields.Datetime.now(),
+                }
+            )
+
+    def _runner_alive(self):
+        """Tell whether the process recorded by the runner still runs."""
+        self.ensure_one()
+        try:
+            os.kill(self.runner_pid, 0)
+        except (ProcessLookupError, PermissionError):
+            # a process of another user got the pid of the runner
+            return False
+        if not self.runner_process_start:
+            return True
+        start = runner.process_start(self.runner_pid)
+        # a process started later got the pid of the runner
+        return start is None or start == self.runner_process_start
 
     @api.model
     def action_backup_all(self):
@@ -215,30 +1295,39 @@ class DbBackup(models.Model):
             _logger.info(f"Database backup succeeded: {self.name}")
             self.message_post(body=_("Database backup succeeded."))
 
-    def cleanup(self):
-        """Clean up old backups."""
+    def cleanup(self, runs=None):
+        """Clean up old backups.
+
+        :param dict runs: ids of the ``db.backup.run`` of the backups just
+            made, by id of their record, which record the cleanup duration
+        """
         now = datetime.now()
         for rec in self.filtered("days_to_keep"):
+            start = time.monotonic()
             with rec.cleanup_log():
-                bu_format = rec.backup_format
-                file_extension = "dump.zip" if bu_format == "zip" else bu_format
-                oldest = self.filename(
-                    now - timedelta(days=rec.days_to_keep), bu_format
+                with rec._storage() as storage:
+                    names = storage.listdir(rec._backup_folder())
+                    for file_extension in rec._backup_extensions():
+                        oldest = self.filename(
+                            now - timedelta(days=rec.days_to_keep), file_extension
+                        )
+                        for name in names:
+                            if name.endswith(f".{file_extension}") and name < oldest:
+                                storage.remove(os.path.join(rec._backup_folder(), name))
+                if rec.backup_format == "incremental":
+                    rec._gc_filestore()
+            if runs:
+                self.env["db.backup.run"].browse(runs.get(rec.id, [])).write(
+                    {"cleanup_duration": time.monotonic() - start}
                 )
 
-                if rec.method == "local":
-                    for name in iglob(os.path.join(rec.folder, f"*.{file_extension}")):
-                        if os.path.basename(name) < oldest:
-                            os.unlink(name)
-
-                elif rec.method == "sftp":
-                    with rec.sftp_connection() as remote:
-                        for name in remote.listdir(rec.folder):
-                            if (
-                                name.endswith(f".{file_extension}")
-                                and os.path.basename(name) < oldest
-                            ):
-                                remote.unlink(f"{rec.folder}/{name}")
+    def _backup_extensions(self):
+        """Extensions of the files written by the backups of this record."""
+        self.ensure_one()
+        extensions = [EXTENSIONS.get(self.backup_format, self.backup_format)]
+        if self.backup_format == "incremental":
+            extensions.append(MANIFEST_EXTENSION)
+        return extensions
 
     @contextmanager
     def cleanup_log(self):
@@ -266,11 +1355,10 @@ class DbBackup(models.Model):
 
         :param datetime.datetime when:
             Use this datetime instead of :meth:`datetime.datetime.now`.
-        :param str ext: Extension of the file. Default: dump.zip
+        :param str ext: Backup format, giving the extension of the file.
+            Default: dump.zip
         """
-        return "{:%Y_%m_%d_%H_%M_%S}.{ext}".format(
-            when, ext="dump.zip" if ext == "zip" else ext
-        )
+        return f"{when:%Y_%m_%d_%H_%M_%S}.{EXTENSIONS.get(ext, ext)}"
 
     def sftp_connection(self):
         """Return a new SFTP connection with found parameters."""
@@ -291,3 +1379,14 @@ class DbBackup(models.Model):
             params["password"] = self.sftp_password
 
         return pysftp.Connection(**params)
+
+    def _s3_client(self):
+        """Return a new S3 client with found parameters."""
+        self.ensure_one()
+        return boto3.client(
+            "s3",
+            endpoint_url=self.s3_endpoint_url or None,
+            region_name=self.s3_region or None,
+            aws_access_key_id=self.s3_access_key or None,
+            aws_secret_access_key=self.s3_secret_key or None,
+        )
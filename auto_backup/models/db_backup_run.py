@@ -0,0 +1,84 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo import api, fields, models
+
+
+class DbBackupRun(models.Model):
+    """Metrics of a run of a backup."""
+
+    _description = "Database Backup Run"
+    _name = "db.backup.run"
+    _order = "id desc"
+    _rec_name = "create_date"
+
+    backup_id = fields.Many2one(
+        comodel_name="db.backup",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    database = fields.Char(readonly=True, index=True)
+    backup_format = fields.Char(readonly=True)
+    state = fields.Selection(
+        [("success", "Succeeded"), ("failed", "Failed")],
+        required=True,
+        readonly=True,
+    )
+    error = fields.Text(readonly=True)
+    dump_duration = fields.Float(
+        "Dump duration (s)",
+        readonly=True,
+        help="Time spent dumping the database, the destinations are written "
+        "at the same time",
+    )
+    transfer_duration = fields.Float(
+        "Transfer duration (s)",
+        readonly=True,
+        help="Time spent after the dump to finish writing on the destination, "
+        "including the filestore synchronization of incremental backups",
+    )
+    cleanup_duration = fields.Float("Cleanup duration (s)", readonly=True)
+    duration = fields.Float(
+        "Duration (s)",
+        compute="_compute_duration",
+        store=True,
+        aggregator="avg",
+    )
+    written_mb = fields.Float("Written (MiB)", readonly=True, aggregator="avg")
+    uncompressed_mb = fields.Float(
+        "Uncompressed (MiB)",
+        readonly=True,
+        aggregator="avg",
+        help="Size of the dump before compression, for the compressed formats",
+    )
+    throughput = fields.Float(
+        "Throughput (MiB/s)",
+        compute="_compute_duration",
+        store=True,
+        aggregator="avg",
+    )
+    compression_ratio = fields.Float(readonly=True, aggregator="avg")
+    slow = fields.Boolean(
+        readonly=True,
+        help="The backup lasted much longer than the previous ones",
+    )
+    restore_duration = fields.Float(
+        "Restore duration (s)",
+        readonly=True,
+        aggregator="avg",
+        help="Time spent restoring the backup to verify it",
+    )
+    verify_state = fields.Selection(
+        [("verified", "Verified"), ("failed", "Verification failed")],
+        readonly=True,
+    )
+    verify_report = fields.Text(
+        readonly=True,
+        help="Row counts of the restored database, or the verification error",
+    )
+
+    @api.depends("dump_duration", "transfer_duration", "written_mb")
+    def _compute_duration(self):
+        for run in self:
+            run.duration = run.dump_duration + run.transfer_duration
+            run.throughput = run.written_mb / run.duration if run.duration else 0.0
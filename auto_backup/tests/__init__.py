@@ -1,3 +1,5 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
 from . import test_db_backup
+from . import test_s3_storage
+from . import test_sftp_upload
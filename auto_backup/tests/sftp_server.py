@@ -0,0 +1,118 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""In-process SFTP server serving a local folder, for the tests."""
+
+import os
+import socket
+import threading
+
+import paramiko
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface
+
+HOST_KEY = paramiko.RSAKey.generate(2048)
+
+
+class StubServer(paramiko.ServerInterface):
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+
+class StubSFTPHandle(SFTPHandle):
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as error:
+            return SFTPServer.convert_errno(error.errno)
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+
+
+class StubSFTPServer(SFTPServerInterface):
+    def __init__(self, server, root, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = root
+
+    def _realpath(self, path):
+        return self.root + self.canonicalize(path)
+
+    def list_folder(self, path):
+        path = self._realpath(path)
+        try:
+            return [
+                SFTPAttributes.from_stat(os.stat(os.path.join(path, name)), name)
+                for name in os.listdir(path)
+            ]
+        except OSError as error:
+            return SFTPServer.convert_errno(error.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self._realpath(path)))
+        except OSError as error:
+            return SFTPServer.convert_errno(error.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        path = self._realpath(path)
+        try:
+            fd = os.open(path, flags, 0o666)
+        except OSError as error:
+            return SFTPServer.convert_errno(error.errno)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        handle = StubSFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self._realpath(path))
+        except OSError as error:
+            return SFTPServer.convert_errno(error.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(self._realpath(oldpath), self._realpath(newpath))
+        except OSError as error:
+            return SFTPServer.convert_errno(error.errno)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self._realpath(path))
+        except OSError as error:
+            return SFTPServer.convert_errno(error.errno)
+        return paramiko.SFTP_OK
+
+
+class StubSFTPClient(paramiko.SFTPClient):
+    def close(self):
+        # closing the client transport stops the server one
+        transport = self.get_channel().get_transport()
+        super().close()
+        transport.close()
+
+
+def connect(root):
+    """Return an SFTP client connected to a new server serving ``root``."""
+    server_socket, client_socket = socket.socketpair()
+    server = paramiko.Transport(server_socket)
+    server.add_server_key(HOST_KEY)
+    server.set_subsystem_handler("sftp", SFTPServer, StubSFTPServer, root)
+    server.start_server(event=threading.Event(), server=StubServer())
+    client = paramiko.Transport(client_socket)
+    client.connect(username="backup", password="backup")
+    return StubSFTPClient.from_transport(client)
@@ -4,15 +4,25 @@
 # Copyright 2016 LasLabs Inc.
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
+import gzip
+import hashlib
+import io
+import json
 import logging
 import os
+import tarfile
+import tempfile
 from contextlib import contextmanager
 from datetime import datetime, timedelta
 from unittest.mock import PropertyMock, patch
 
 from odoo import tools
 from odoo.exceptions import UserError
+from odoo.service import db
 from odoo.tests import common
+from odoo.tools import mute_logger
+
+from ..tools import BackupTee, TokenBucket, runner
 
 _logger = logging.getLogger(__name__)
 try:
@@ -41,13 +51,11 @@ class TestDbBackup(common.TransactionCase):
         self.path_join_val = "/this/is/a/path"
         with patch(f"{model}.db") as db:
             with patch(f"{model}.os") as os:
-                with patch(f"{model}.shutil") as shutil:
-                    os.path.join.return_value = self.path_join_val
-                    yield {
-                        "db": db,
-                        "os": os,
-                        "shutil": shutil,
-                    }
+                os.path.join.return_value = self.path_join_val
+                yield {
+                    "db": db,
+                    "os": os,
+                }
 
     @contextmanager
     def patch_filtered_sftp(self, record):
@@ -137,6 +145,332 @@ class TestDbBackup(common.TransactionCase):
         generated_backup = [f for f in os.listdir(rec_id.folder) if f >= filename]
         self.assertEqual(1, len(generated_backup))
 
+    def test_action_backup_single_dump(self):
+        """It should dump once for all the destinations of a format"""
+        rec_1 = self.new_record("local")
+        rec_2 = self.Model.create(
+            {"method": "local", "folder": tempfile.mkdtemp(), "days_to_keep": 1}
+        )
+
+        def dump_db(db_name, stream, backup_format="zip"):
+            stream.write(b"dump")
+
+        filename = rec_1.filename(datetime.now())
+        with patch(f"{model}.db") as db:
+            db.dump_db.side_effect = dump_db
+            (rec_1 | rec_2).action_backup()
+        db.dump_db.assert_called_once()
+        for rec in rec_1 | rec_2:
+            backups = [f for f in os.listdir(rec.folder) if f >= filename]
+            self.assertEqual(1, len(backups))
+            with open(os.path.join(rec.folder, backups[0]), "rb") as backup:
+                self.assertEqual(backup.read(), b"dump")
+            self.assertEqual(rec.run_ids.mapped("state"), ["success"])
+            self.assertAlmostEqual(rec.run_ids.written_mb, 4 / 2**20)
+
+    def test_cleanup_duration_run(self):
+        """The cleanup duration should be recorded on the run cleaned up after"""
+        rec_id = self.new_record("local")
+        Run = self.env["db.backup.run"]
+        create_run = type(rec_id)._create_run
+        created = []
+
+        def create_run_concurrent(rec, *args, **kwargs):
+            run = create_run(rec, *args, **kwargs)
+            created.append(run)
+            # a run of another backup of the record, e.g. a concurrent one
+            Run.create({"backup_id": rec.id, "state": "failed"})
+            return run
+
+        def dump_db(db_name, stream, backup_format="zip"):
+            stream.write(b"dump")
+
+        with (
+            patch.object(type(rec_id), "_create_run", create_run_concurrent),
+            patch(f"{model}.db") as db,
+        ):
+            db.dump_db.side_effect = dump_db
+            rec_id.action_backup()
+        self.assertNotEqual(rec_id.run_ids[:1], created[0])
+        self.assertGreater(created[0].cleanup_duration, 0)
+        self.assertFalse(rec_id.run_ids[:1].cleanup_duration)
+
+    def test_verify_restore(self):
+        """It should restore the backup in a scratch database and drop it"""
+        rec_id = self.new_record("local")
+        rec_id.write({"backup_format": "dump", "verify_restore": True})
+        rec_id.action_backup()
+        run = rec_id.run_ids
+        self.assertEqual(run.verify_state, "verified", run.verify_report)
+        self.assertGreater(run.restore_duration, 0)
+        report = json.loads(run.verify_report)
+        self.assertGreater(report["res_users"], 0)
+        scratch = f"{self.env.cr.dbname}_verify_{rec_id.id}"
+        self.assertNotIn(scratch, db.list_dbs(True))
+
+    def test_verify_restore_failure(self):
+        """A failed verification should be recorded and reported"""
+        rec_id = self.new_record("local")
+        rec_id.write({"backup_format": "dump", "verify_restore": True})
+        messages = rec_id.message_ids
+        with patch(f"{class_name}._check_restored") as check_restored:
+            check_restored.side_effect = UserError("No users")
+            with mute_logger(model):
+                rec_id.action_backup()
+        run = rec_id.run_ids
+        self.assertEqual(run.state, "success")
+        self.assertEqual(run.verify_state, "failed")
+        self.assertEqual(run.verify_report, "No users")
+        bodies = (rec_id.message_ids - messages).mapped("body")
+        self.assertIn("No users", "".join(bodies))
+
+    def test_check_filestore(self):
+        """Only the attachments should be checked against their checksum"""
+        rec_id = self.new_record("local")
+        filestore = tempfile.mkdtemp()
+        digest = hashlib.sha1(b"content").hexdigest()
+        for folder, name in ((digest[:2], digest), ("checklist", "pending")):
+            os.makedirs(os.path.join(filestore, folder))
+            with open(os.path.join(filestore, folder, name), "wb") as stored:
+                stored.write(b"content")
+        with patch.object(tools.config, "filestore", return_value=filestore):
+            self.assertEqual(rec_id._check_filestore("test"), 1)
+            with open(os.path.join(filestore, digest[:2], digest), "wb") as stored:
+                stored.write(b"changed")
+            with self.assertRaises(UserError):
+                rec_id._check_filestore("test")
+
+    def test_backup_databases(self):
+        """It should back up each matched database in its own subfolder"""
+        rec_id = self.new_record("local")
+        rec_id.write({"db_filter": f"{self.env.cr.dbname}|tenant_.*"})
+        databases = [self.env.cr.dbname, "tenant_a", "other"]
+
+        def dump_db(db_name, stream, backup_format="zip"):
+            stream.write(db_name.encode())
+
+        filename = rec_id.filename(datetime.now())
+        messages = rec_id.message_ids
+        with patch(f"{model}.db") as db_mock:
+            db_mock.list_dbs.return_value = databases
+            db_mock.dump_db.side_effect = dump_db
+            rec_id.action_backup()
+        self.assertEqual(db_mock.dump_db.call_count, 2)
+        for folder, db_name in (
+            (rec_id.folder, self.env.cr.dbname),
+            (os.path.join(rec_id.folder, "tenant_a"), "tenant_a"),
+        ):
+            backups = [
+                f for f in os.listdir(folder) if f >= filename and f.endswith(".zip")
+            ]
+            self.assertEqual(len(backups), 1)
+            with open(os.path.join(folder, backups[0]), "rb") as backup:
+                self.assertEqual(backup.read(), db_name.encode())
+        self.env.invalidate_all()
+        self.assertEqual(
+            sorted(rec_id.run_ids.mapped("database")),
+            sorted(databases[:2]),
+        )
+        report = "".join((rec_id.message_ids - messages).mapped("body"))
+        self.assertIn("Backups of 2 databases: 0 failed.", report)
+        self.assertIn("tenant_a", report)
+
+    def test_check_run_duration(self):
+        """It should flag and warn about a backup slower than usual"""
+        rec_id = self.new_record("local")
+        runs = self.env["db.backup.run"].create(
+            [
+                {"backup_id": rec_id.id, "state": "success", "dump_duration": 10}
+                for _i in range(4)
+            ]
+        )
+        rec_id._check_run_duration(runs[-1])
+        self.assertFalse(runs[-1].slow)
+        run = self.env["db.backup.run"].create(
+            {"backup_id": rec_id.id, "state": "success", "dump_duration": 25}
+        )
+        messages = rec_id.message_ids
+        rec_id._check_run_duration(run)
+        self.assertTrue(run.slow)
+        self.assertIn("2.5 times", (rec_id.message_ids - messages).body)
+
+    def test_action_backup_local_directory(self):
+        """It should backup in parallel to a tar of the dump directory"""
+        rec_id = self.new_record("local")
+        rec_id.write({"backup_format": "directory", "dump_jobs": 2})
+        filename = rec_id.filename(datetime.now(), ext="directory")
+        with patch(
+            "tempfile.TemporaryDirectory", wraps=tempfile.TemporaryDirectory
+        ) as temporary_directory:
+            rec_id.action_backup()
+        # the uncompressed dump is written in the backup folder, then removed
+        self.assertIn(
+            rec_id.folder,
+            [call.kwargs.get("dir") for call in temporary_directory.call_args_list],
+        )
+        self.assertFalse([f for f in os.listdir(rec_id.folder) if f[0] == "."])
+        generated_backup = [
+            f
+            for f in os.listdir(rec_id.folder)
+            if f >= filename and f.endswith(".dump.tar")
+        ]
+        self.assertEqual(1, len(generated_backup))
+        with tarfile.open(os.path.join(rec_id.folder, generated_backup[0])) as tar:
+            self.assertIn("dump/toc.dat", tar.getnames())
+
+    def test_action_backup_local_gzip(self):
+        """It should stream a gzip compressed custom format dump"""
+        rec_id = self.new_record("local")
+        rec_id.write({"backup_format": "gzip", "compression_level": 1})
+        filename = rec_id.filename(datetime.now(), ext="gzip")
+        rec_id.action_backup()
+        generated_backup = [
+            f
+            for f in os.listdir(rec_id.folder)
+            if f >= filename and f.endswith(".dump.gz")
+        ]
+        self.assertEqual(1, len(generated_backup))
+        with gzip.open(os.path.join(rec_id.folder, generated_backup[0])) as dump:
+            self.assertEqual(dump.read(5), b"PGDMP")
+
+    def test_check_compression_level(self):
+        """It should not allow out of range compression levels"""
+        rec_id = self.new_record("local")
+        with self.assertRaises(UserError):
+            rec_id.write({"backup_format": "gzip", "compression_level": 12})
+
+    def test_action_backup_local_incremental(self):
+        """It should only copy the new filestore files"""
+        rec_id = self.Model.create(
+            {
+                "method": "local",
+                "folder": tempfile.mkdtemp(),
+                "backup_format": "incremental",
+            }
+        )
+        attachment = self.env["ir.attachment"].create(
+            {"name": "backup.txt", "raw": b"incremental backup test"}
+        )
+        store = os.path.join(rec_id.folder, "filestore")
+        with patch(f"{model}.db"):
+            rec_id.action_backup()
+        manifests = [f for f in os.listdir(rec_id.folder) if f.endswith(".json")]
+        self.assertEqual(1, len(manifests))
+        with open(os.path.join(rec_id.folder, manifests[0])) as manifest:
+            manifest = json.load(manifest)
+        self.assertIn(attachment.store_fname, manifest["files"])
+        stored = os.path.join(store, attachment.store_fname)
+        with open(stored, "rb") as blob:
+            self.assertEqual(blob.read(), b"incremental backup test")
+        # stored files are not copied again
+        with patch(f"{model}.shutil") as shutil:
+            rec_id._backup_filestore(rec_id.filename(datetime.now(), "incremental"))
+        shutil.copyfile.assert_not_called()
+        # unreferenced files are garbage collected
+        os.makedirs(os.path.join(store, "zz"))
+        with open(os.path.join(store, "zz", "orphan"), "wb") as orphan:
+            orphan.write(b"orphan")
+        rec_id._gc_filestore()
+        self.assertFalse(os.path.exists(os.path.join(store, "zz", "orphan")))
+        self.assertTrue(os.path.exists(stored))
+
+    def test_backup_tee_failing_stream(self):
+        """A failing destination should not stop the other ones"""
+
+        class FailingStream:
+            def write(self, data):
+                raise OSError("disk full")
+
+        stream = io.BytesIO()
+        with BackupTee([FailingStream(), stream]) as tee:
+            for _i in range(100):
+                tee.write(b"data")
+        self.assertEqual(stream.getvalue(), b"data" * 100)
+        self.assertEqual(list(tee.errors), [0])
+        self.assertEqual(tee.tell(), 400)
+
+    def test_backup_tee_throttle(self):
+        """The writes should be slowed down to the rate of the throttle"""
+        throttle = TokenBucket(1024)
+        with patch("odoo.addons.auto_backup.tools.throttle.time") as mock_time:
+            mock_time.monotonic.return_value = throttle.updated
+            with BackupTee([io.BytesIO()], throttle=throttle) as tee:
+                # the first second of traffic is allowed at once
+                tee.write(b"x" * 1024)
+                mock_time.sleep.assert_not_called()
+                tee.write(b"x" * 512)
+        mock_time.sleep.assert_called_once_with(0.5)
+
+    def test_action_backup_detached(self):
+        """Detached backups should be handed to a separate process"""
+        rec_1 = self.new_record("local")
+        rec_2 = self.Model.create(
+            {
+                "method": "local",
+                "folder": tempfile.mkdtemp(),
+                "run_detached": True,
+                "nice": 5,
+            }
+        )
+        with patch(f"{model}.runner") as runner:
+            runner.odoo_args.return_value = ["--db_host=localhost"]
+            with patch(f"{class_name}._backup_dump") as backup_dump:
+                backup_dump.return_value = rec_1
+                (rec_1 | rec_2).action_backup()
+        backup_dump.assert_called_once()
+        config = runner.launch.call_args.args[0]
+        self.assertEqual(config["dbname"], self.env.cr.dbname)
+        self.assertEqual(config["ids"], rec_2.ids)
+        self.assertEqual(config["odoo_args"], ["--db_host=localhost"])
+        self.assertEqual(runner.launch.call_args.kwargs["niceness"], 5)
+        self.assertTrue(runner.launch.call_args.kwargs["idle_io"])
+
+    def test_cron_check_runners(self):
+        """A runner whose process is gone should be marked as failed"""
+        rec_id = self.new_record("local")
+        rec_id.write({"runner_state": "running", "runner_pid": os.getpid()})
+        self.Model._cron_check_runners()
+        self.assertEqual(rec_id.runner_state, "running")
+        with patch(f"{model}.os") as mock_os:
+            mock_os.kill.side_effect = ProcessLookupError
+            self.Model._cron_check_runners()
+        self.assertEqual(rec_id.runner_state, "failed")
+        self.assertTrue(rec_id.runner_finished_at)
+
+    def test_cron_check_runners_reused_pid(self):
+        """A runner whose pid went to another process should be failed"""
+        rec_id = self.new_record("local")
+        rec_id.write(
+            {
+                "runner_state": "running",
+                "runner_pid": os.getpid(),
+                "runner_process_start": runner.process_start(os.getpid()),
+            }
+        )
+        self.Model._cron_check_runners()
+        self.assertEqual(rec_id.runner_state, "running")
+        with patch(f"{model}.os") as mock_os:
+            mock_os.kill.side_effect = PermissionError
+            self.Model._cron_check_runners()
+        self.assertEqual(rec_id.runner_state, "failed")
+        rec_id.write({"runner_state": "running", "runner_process_start": "1"})
+        self.Model._cron_check_runners()
+        self.assertEqual(rec_id.runner_state, "failed")
+
+    def test_launch_runner_running(self):
+        """A backup whose runner still runs should not be launched again"""
+        rec_id = self.new_record("local")
+        rec_id.run_detached = True
+        with patch(f"{model}.runner") as mock_runner:
+            mock_runner.odoo_args.return_value = []
+            rec_id.action_backup()
+            self.assertEqual(rec_id.runner_state, "running")
+            rec_id.action_backup()
+        mock_runner.launch.assert_called_once()
+        # the runner is given time to record its process
+        self.Model._cron_check_runners()
+        self.assertEqual(rec_id.runner_state, "running")
+
     def _test_action_backup_sftp_mkdirs(self):
         """It should create remote dirs"""
         rec_id = self.new_record()
@@ -236,3 +570,15 @@ class TestDbBackup(common.TransactionCase):
         now = datetime.now()
         res = self.Model.filename(now, ext="dump")
         self.assertTrue(res.endswith(".dump"))
+
+    def test_filename_incremental(self):
+        """It should return an incremental.dump filename and manifest name"""
+        res = self.Model.filename(datetime.now(), ext="incremental")
+        self.assertTrue(res.endswith(".incremental.dump"))
+        self.assertTrue(self.Model._manifest_name(res).endswith(".incremental.json"))
+
+    def test_filename_directory(self):
+        """It should return a dump.tar filename"""
+        now = datetime.now()
+        res = self.Model.filename(now, ext="directory")
+        self.assertTrue(res.endswith(".dump.tar"))
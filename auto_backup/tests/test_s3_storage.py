@@ -0,0 +1,135 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from odoo.tests import common
+
+from ..tools import MultipartUploader
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:  # pragma: no cover
+    mock_aws = None
+
+model = "odoo.addons.auto_backup.models.db_backup"
+
+
+@unittest.skipIf(mock_aws is None, "boto3 and moto are not installed")
+class TestS3Storage(common.TransactionCase):
+    def setUp(self):
+        super().setUp()
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        self.client = boto3.client(
+            "s3",
+            region_name="us-east-1",
+            aws_access_key_id="test",
+            aws_secret_access_key="test",
+        )
+        self.client.create_bucket(Bucket="backups")
+        self.backup = self.env["db.backup"].create(
+            {
+                "method": "s3",
+                "folder": "/odoo/test",
+                "days_to_keep": 1,
+                "s3_bucket": "backups",
+                "s3_region": "us-east-1",
+                "s3_access_key": "test",
+                "s3_secret_key": "test",
+            }
+        )
+
+    def _keys(self):
+        listed = self.client.list_objects_v2(Bucket="backups", Prefix="odoo/test/")
+        return [item["Key"] for item in listed.get("Contents", [])]
+
+    def _read(self, key):
+        return self.client.get_object(Bucket="backups", Key=key)["Body"].read()
+
+    def test_action_backup_s3(self):
+        """It should upload the backup to the bucket"""
+
+        def dump_db(db_name, stream, backup_format="zip"):
+            stream.write(b"dump")
+
+        filename = self.backup.filename(datetime.now())
+        with patch(f"{model}.db") as db:
+            db.dump_db.side_effect = dump_db
+            self.backup.action_backup()
+        keys = [key for key in self._keys() if key >= f"odoo/test/{filename}"]
+        self.assertEqual(len(keys), 1)
+        self.assertEqual(self._read(keys[0]), b"dump")
+        self.assertEqual(self.backup.run_ids.mapped("state"), ["success"])
+        self.assertFalse(os.listdir(self.backup._spool_folder()))
+
+    def test_cleanup_s3(self):
+        """It should remove the old backups listed by the server"""
+        old = self.backup.filename(datetime.now() - timedelta(days=3))
+        recent = self.backup.filename(datetime.now())
+        for name in (old, recent, "notes.txt"):
+            self.client.put_object(Bucket="backups", Key=f"odoo/test/{name}", Body=b"")
+        self.backup.cleanup()
+        self.assertEqual(
+            sorted(self._keys()), ["odoo/test/notes.txt", f"odoo/test/{recent}"]
+        )
+
+    def test_multipart_resume(self):
+        """It should resume a multipart upload after the parts received"""
+        local = os.path.join(tempfile.mkdtemp(), "backup.dump")
+        data = os.urandom(11 * 2**20)
+        with open(local, "wb") as local_file:
+            local_file.write(data)
+        upload_part = self.client.upload_part
+
+        def failing_upload_part(**kwargs):
+            if kwargs["PartNumber"] == 2:
+                raise OSError("Connection lost")
+            return upload_part(**kwargs)
+
+        uploader = MultipartUploader(
+            self.client,
+            "backups",
+            "odoo/test/backup.dump",
+            local,
+            chunk_size=5 * 2**20,
+            channels=1,
+        )
+        self.assertEqual(uploader.parts, 3)
+        with patch.object(self.client, "upload_part", failing_upload_part):
+            with self.assertRaises(OSError):
+                uploader.upload()
+        self.assertTrue(os.path.exists(uploader.state_path))
+        uploader = MultipartUploader(
+            self.client,
+            "backups",
+            "odoo/test/backup.dump",
+            local,
+            chunk_size=5 * 2**20,
+            channels=2,
+        )
+        self.assertEqual(uploader.upload(), 1)
+        self.assertEqual(self._read("odoo/test/backup.dump"), data)
+        self.assertFalse(os.path.exists(uploader.state_path))
+
+    def test_multipart_part_count(self):
+        """The parts of a large file should grow to stay under the limit"""
+        local = os.path.join(tempfile.mkdtemp(), "backup.dump")
+        with open(local, "wb") as local_file:
+            # sparse file of 100 GiB and a byte
+            local_file.truncate(100 * 2**30 + 1)
+        uploader = MultipartUploader(
+            self.client,
+            "backups",
+            "odoo/test/backup.dump",
+            local,
+            chunk_size=5 * 2**20,
+        )
+        # 10.24 MiB at least, rounded up to whole MiB
+        self.assertEqual(uploader.chunk_size, 11 * 2**20)
+        self.assertLessEqual(uploader.parts, 10000)
@@ -0,0 +1,133 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import os
+import tempfile
+
+from odoo.tests import BaseCase
+
+from ..tools import ChunkedUploader
+from . import sftp_server
+
+
+class FailingFile:
+    """Remote file whose writes fail after a given number of chunks."""
+
+    def __init__(self, remote, counter):
+        self.remote = remote
+        self.counter = counter
+
+    def write(self, data):
+        self.counter["writes"] += 1
+        if self.counter["writes"] == self.counter["fail_at"]:
+            raise OSError("Connection lost")
+        return self.remote.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.remote, name)
+
+
+class FailingClient:
+    def __init__(self, client, counter):
+        self.client = client
+        self.counter = counter
+
+    def open(self, path, mode="r"):
+        return FailingFile(self.client.open(path, mode), self.counter)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class TestSftpUpload(BaseCase):
+    def setUp(self):
+        super().setUp()
+        self.root = tempfile.mkdtemp()
+        self.local = os.path.join(tempfile.mkdtemp(), "backup.dump")
+        self.data = os.urandom(10 * 1024 + 123)
+        with open(self.local, "wb") as local:
+            local.write(self.data)
+
+    def _remote_data(self):
+        with open(os.path.join(self.root, "backup.dump"), "rb") as remote:
+            return remote.read()
+
+    def test_parallel_upload(self):
+        """It should write the chunks over several channels"""
+        uploader = ChunkedUploader(
+            lambda: sftp_server.connect(self.root),
+            self.local,
+            "/backup.dump",
+            chunk_size=1024,
+            channels=3,
+        )
+        self.assertEqual(uploader.upload(), 11)
+        self.assertEqual(self._remote_data(), self.data)
+        self.assertFalse(os.path.exists(uploader.state_path))
+        self.assertFalse(os.path.exists(os.path.join(self.root, "backup.dump.part")))
+
+    def test_resume_upload(self):
+        """It should resume after the chunks confirmed before a failure"""
+        counter = {"writes": 0, "fail_at": 5}
+
+        def connect():
+            return FailingClient(sftp_server.connect(self.root), counter)
+
+        uploader = ChunkedUploader(
+            connect, self.local, "/backup.dump", chunk_size=1024, channels=1, retries=0
+        )
+        with self.assertRaises(OSError):
+            uploader.upload()
+        self.assertEqual(uploader.sent, 4)
+        self.assertTrue(os.path.exists(uploader.state_path))
+        counter.update(writes=0, fail_at=0)
+        uploader = ChunkedUploader(
+            connect, self.local, "/backup.dump", chunk_size=1024, channels=2
+        )
+        # only the chunks not confirmed are sent again
+        self.assertEqual(uploader.upload(), 7)
+        self.assertEqual(self._remote_data(), self.data)
+
+    def test_resume_part_missing(self):
+        """It should start over when the remote partial file is gone"""
+        counter = {"writes": 0, "fail_at": 5}
+
+        def connect():
+            return FailingClient(sftp_server.connect(self.root), counter)
+
+        uploader = ChunkedUploader(
+            connect, self.local, "/backup.dump", chunk_size=1024, channels=1, retries=0
+        )
+        with self.assertRaises(OSError):
+            uploader.upload()
+        os.unlink(os.path.join(self.root, "backup.dump.part"))
+        counter.update(writes=0, fail_at=0)
+        uploader = ChunkedUploader(
+            connect, self.local, "/backup.dump", chunk_size=1024, channels=2
+        )
+        self.assertEqual(uploader.upload(), 11)
+        self.assertEqual(self._remote_data(), self.data)
+
+    def test_resume_chunk_corrupted(self):
+        """It should send again the chunks whose remote data differs"""
+        counter = {"writes": 0, "fail_at": 5}
+
+        def connect():
+            return FailingClient(sftp_server.connect(self.root), counter)
+
+        uploader = ChunkedUploader(
+            connect, self.local, "/backup.dump", chunk_size=1024, channels=1, retries=0
+        )
+        with self.assertRaises(OSError):
+            uploader.upload()
+        # one line per chunk written, after the header
+        with open(uploader.state_path) as state_file:
+            self.assertEqual(len(state_file.read().splitlines()), 5)
+        with open(os.path.join(self.root, "backup.dump.part"), "r+b") as part:
+            part.seek(1024 + 10)
+            part.write(b"corrupted")
+        counter.update(writes=0, fail_at=0)
+        uploader = ChunkedUploader(
+            connect, self.local, "/backup.dump", chunk_size=1024, channels=2
+        )
+        self.assertEqual(uploader.upload(), 8)
+        self.assertEqual(self._remote_data(), self.data)
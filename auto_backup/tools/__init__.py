@@ -0,0 +1,9 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from . import runner
+from .compress import compress_stream, decompress_stream, zstandard
+from .s3_upload import MultipartUploader
+from .sftp_upload import ChunkedUploader
+from .storage import LocalStorage, S3Storage, SftpStorage, Storage
+from .tee import BackupTee
+from .throttle import TokenBucket
@@ -0,0 +1,88 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import gzip
+import logging
+import shutil
+import subprocess
+import threading
+
+_logger = logging.getLogger(__name__)
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+    _logger.debug("Cannot import zstandard")
+
+CHUNK_SIZE = 1 << 20
+
+
+def _copy(source, destination):
+    """Copy ``source`` to ``destination``, return the number of bytes."""
+    size = 0
+    while chunk := source.read(CHUNK_SIZE):
+        destination.write(chunk)
+        size += len(chunk)
+    return size
+
+
+def compress_stream(source, destination, method, level=3, threads=1):
+    """Compress what is read from ``source`` and write it to ``destination``.
+
+    :param str method: ``zstd`` (needs the zstandard library) or ``gzip``
+        (done by pigz when it is installed, by the gzip module otherwise)
+    :param int threads: number of compression threads, when supported
+    :return: the number of uncompressed bytes
+    """
+    if method == "zstd":
+        if zstandard is None:
+            raise RuntimeError("The zstandard library is not installed")
+        compressor = zstandard.ZstdCompressor(level=level, threads=threads)
+        read, _written = compressor.copy_stream(
+            source, destination, read_size=CHUNK_SIZE, write_size=CHUNK_SIZE
+        )
+        return read
+    if method != "gzip":
+        raise ValueError(f"Unknown compression method {method}")
+    pigz = shutil.which("pigz")
+    if not pigz:
+        with gzip.GzipFile(
+            fileobj=destination, mode="wb", compresslevel=level
+        ) as compressed:
+            return _copy(source, compressed)
+    with subprocess.Popen(
+        [pigz, f"-{level}", f"--processes={max(threads, 1)}", "--stdout"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    ) as process:
+        read = []
+
+        def feed():
+            try:
+                read.append(_copy(source, process.stdin))
+            finally:
+                process.stdin.close()
+
+        feeder = threading.Thread(target=feed, name="backup-pigz", daemon=True)
+        feeder.start()
+        _copy(process.stdout, destination)
+        feeder.join()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, pigz)
+    if not read:
+        raise OSError("Compression input could not be read")
+    return read[0]
+
+
+def decompress_stream(source, destination, method):
+    """Decompress what is read from ``source`` to ``destination``."""
+    if method == "zstd":
+        if zstandard is None:
+            raise RuntimeError("The zstandard library is not installed")
+        zstandard.ZstdDecompressor().copy_stream(
+            source, destination, read_size=CHUNK_SIZE, write_size=CHUNK_SIZE
+        )
+    elif method == "gzip":
+        with gzip.GzipFile(fileobj=source, mode="rb") as compressed:
+            _copy(compressed, destination)
+    else:
+        raise ValueError(f"Unknown compression method {method}")
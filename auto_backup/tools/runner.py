@@ -0,0 +1,104 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Run backups in a detached process, out of the Odoo workers."""
+
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+
+_logger = logging.getLogger(__name__)
+
+# the configuration, with the database credentials, is read on stdin to
+# keep it out of the process list
+BOOTSTRAP = """\
+import json, sys
+config = json.load(sys.stdin)
+import odoo
+odoo.tools.config.parse_config(config["odoo_args"])
+odoo.modules.module.initialize_sys_path()
+from odoo.addons.auto_backup.tools.runner import main
+main(config)
+"""
+
+# server options needed by the runner to reach the database and the addons
+ODOO_OPTIONS = (
+    "addons_path",
+    "data_dir",
+    "db_host",
+    "db_port",
+    "db_user",
+    "db_password",
+    "db_sslmode",
+)
+
+
+def odoo_args(config):
+    """Return the command line arguments reproducing the server options."""
+    args = []
+    if config.rcfile and os.path.exists(config.rcfile):
+        args += ["--config", config.rcfile]
+    for option in ODOO_OPTIONS:
+        value = config.get(option)
+        if value not in (None, False, ""):
+            args.append(f"--{option.replace('_', '-')}={value}")
+    return args
+
+
+def launch(config, niceness=0, idle_io=False, log_path=os.devnull):
+    """Start the runner process, detached from the current one.
+
+    :param dict config: ``dbname`` and ``ids`` of the ``db.backup`` records
+        to run, ``odoo_args`` to initialize the server configuration
+    :param int niceness: added to the CPU niceness of the runner
+    :param bool idle_io: only give disk time to the runner when no other
+        process needs it (``ionice -c 3``, when available)
+    """
+    cmd = [sys.executable, "-c", BOOTSTRAP]
+    if niceness and shutil.which("nice"):
+        cmd = ["nice", "-n", str(niceness)] + cmd
+    if idle_io and shutil.which("ionice"):
+        cmd = ["ionice", "-c", "3"] + cmd
+    with open(log_path, "ab") as log:
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+    process.communicate(json.dumps(config).encode())
+    # the runner forks and its parent exits at once: nothing is left for
+    # this process to reap
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+
+
+def process_start(pid):
+    """Return the start time of the process ``pid``, in clock ticks since boot.
+
+    It tells a process from a later one reusing its pid. ``None`` when it
+    cannot be read, e.g. on systems without ``/proc``.
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as stat:
+            data = stat.read()
+    except OSError:
+        return None
+    # the command name, in parentheses, may contain spaces: the fields are
+    # counted from its end, the start time being the 22nd one
+    return data.rsplit(b")", 1)[1].split()[19].decode()
+
+
+def main(config):
+    """Entry point of the runner process."""
+    if os.fork():
+        os._exit(0)
+    import odoo
+    from odoo.modules.registry import Registry
+
+    registry = Registry(config["dbname"])
+    with registry.cursor() as cr:
+        env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {"auto_backup_runner": True})
+        env["db.backup"].browse(config["ids"])._run_detached()
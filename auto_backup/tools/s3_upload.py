@@ -0,0 +1,170 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import base64
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+_logger = logging.getLogger(__name__)
+
+# S3 rejects the parts smaller than this, except the last one
+MIN_PART_SIZE = 5 * 2**20
+# S3 rejects the uploads of more parts than this
+MAX_PARTS = 10000
+
+
+class MultipartUploader:
+    """Upload a local file to S3 by parts, sent in parallel.
+
+    The MD5 of each part is checked by the server. The upload id and the
+    parts already sent are saved in a local state file: an interrupted
+    upload of the same file resumes with the parts the server lists as
+    received, as long as their local data did not change.
+
+    :param client: a boto3 S3 client, which can be shared between threads
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket,
+        key,
+        local_path,
+        chunk_size=32 * 2**20,
+        channels=4,
+        state_path=None,
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.local_path = local_path
+        self.size = os.path.getsize(local_path)
+        # parts grow with the file to stay under the limit, by whole MiB
+        chunk_size = max(chunk_size, MIN_PART_SIZE, -(-self.size // MAX_PARTS))
+        self.chunk_size = -(-chunk_size // 2**20) * 2**20
+        self.channels = max(channels, 1)
+        self.state_path = state_path or f"{local_path}.state.json"
+        self.parts = max(-(-self.size // self.chunk_size), 1)
+        self.sent = 0
+
+    def _read_part(self, number):
+        with open(self.local_path, "rb") as local:
+            local.seek((number - 1) * self.chunk_size)
+            return local.read(self.chunk_size)
+
+    def _load_state(self):
+        """Return the upload id and the parts sent by a previous upload."""
+        try:
+            with open(self.state_path) as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return None, {}
+        if (
+            state.get("bucket") != self.bucket
+            or state.get("key") != self.key
+            or state.get("size") != self.size
+            or state.get("chunk_size") != self.chunk_size
+        ):
+            self._abort(state.get("bucket"), state.get("key"), state.get("upload_id"))
+            return None, {}
+        upload_id = state["upload_id"]
+        try:
+            listed = self._list_parts(upload_id)
+        except Exception:
+            _logger.info("Upload %s of %s expired, restarting it", upload_id, self.key)
+            return None, {}
+        done = {}
+        for number, etag in listed.items():
+            digest = hashlib.md5(self._read_part(number)).hexdigest()
+            # the etag of a part is the MD5 of its data
+            if etag.strip('"') == digest:
+                done[number] = etag
+        return upload_id, done
+
+    def _list_parts(self, upload_id):
+        parts = {}
+        paginator = self.client.get_paginator("list_parts")
+        pages = paginator.paginate(Bucket=self.bucket, Key=self.key, UploadId=upload_id)
+        for page in pages:
+            for part in page.get("Parts", []):
+                parts[part["PartNumber"]] = part["ETag"]
+        return parts
+
+    def _save_state(self, upload_id):
+        state = {
+            "bucket": self.bucket,
+            "key": self.key,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "upload_id": upload_id,
+        }
+        with open(f"{self.state_path}.tmp", "w") as state_file:
+            json.dump(state, state_file)
+        os.replace(f"{self.state_path}.tmp", self.state_path)
+
+    def _abort(self, bucket, key, upload_id):
+        if not upload_id:
+            return
+        try:
+            self.client.abort_multipart_upload(
+                Bucket=bucket, Key=key, UploadId=upload_id
+            )
+        except Exception:
+            _logger.debug("Aborting upload %s failed", upload_id, exc_info=True)
+
+    def upload(self):
+        """Upload the missing parts, then complete the upload."""
+        upload_id, done = self._load_state()
+        if upload_id is None:
+            upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key
+            )["UploadId"]
+            self._save_state(upload_id)
+        else:
+            _logger.info(
+                "Resuming upload of %s: %d/%d parts already sent",
+                self.key,
+                len(done),
+                self.parts,
+            )
+        pending = [number for number in range(1, self.parts + 1) if number not in done]
+
+        def upload_part(number):
+            return self._upload_part(upload_id, number)
+
+        # boto3 clients are thread safe, the parts share the client
+        with ThreadPoolExecutor(self.channels, thread_name_prefix="backup-s3") as pool:
+            etags = pool.map(upload_part, pending)
+            for number, etag in zip(pending, etags, strict=True):
+                done[number] = etag
+                self.sent += 1
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": number, "ETag": done[number]}
+                    for number in sorted(done)
+                ]
+            },
+        )
+        try:
+            os.unlink(self.state_path)
+        except FileNotFoundError:
+            pass
+        return self.sent
+
+    def _upload_part(self, upload_id, number):
+        data = self._read_part(number)
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=upload_id,
+            PartNumber=number,
+            Body=data,
+            ContentMD5=base64.b64encode(hashlib.md5(data).digest()).decode(),
+        )
+        return response["ETag"]
@@ -0,0 +1,249 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+
+_logger = logging.getLogger(__name__)
+
+PART_SUFFIX = ".part"
+
+
+class ChunkedUploader:
+    """Upload a local file over several SFTP channels, by chunks.
+
+    Each channel writes chunks at their offset in a ``.part`` remote file,
+    renamed once all the chunks are written. The SHA-256 of the local data
+    of every written chunk is appended to a local state file: an
+    interrupted upload of the same file resumes with the chunks not written
+    yet, or whose local or remote data differs from the recorded one, the
+    chunks already written being read back to be checked. The upload
+    starts over when the remote ``.part`` file is missing.
+
+    :param connect: callable returning a new SFTP client, with the ``open``,
+        ``rename``, ``remove``, ``stat`` and ``close`` methods of
+        ``paramiko.SFTPClient``
+    """
+
+    def __init__(
+        self,
+        connect,
+        local_path,
+        remote_path,
+        chunk_size=32 * 2**20,
+        channels=4,
+        retries=3,
+        state_path=None,
+    ):
+        self.connect = connect
+        self.local_path = local_path
+        self.remote_path = remote_path
+        self.chunk_size = chunk_size
+        self.channels = max(channels, 1)
+        self.retries = retries
+        self.state_path = state_path or f"{local_path}.state.json"
+        self.size = os.path.getsize(local_path)
+        self.chunks = max(-(-self.size // chunk_size), 1)
+        self.done = {}
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def _read_chunk(self, index):
+        with open(self.local_path, "rb") as local:
+            local.seek(index * self.chunk_size)
+            return local.read(self.chunk_size)
+
+    def _state_header(self):
+        return {
+            "remote_path": self.remote_path,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+        }
+
+    def _load_state(self):
+        """Return the chunks confirmed by a previous upload of the file.
+
+        The state file holds a JSON header, then the index and digest of a
+        written chunk per line.
+        """
+        try:
+            with open(self.state_path) as state_file:
+                lines = state_file.read().splitlines()
+        except OSError:
+            return {}
+        try:
+            if not lines or json.loads(lines[0]) != self._state_header():
+                return {}
+        except ValueError:
+            return {}
+        recorded = {}
+        for line in lines[1:]:
+            try:
+                index, digest = json.loads(line)
+            except ValueError:
+                # line cut by the interruption
+                continue
+            recorded[index] = digest
+        done = {}
+        for index, digest in recorded.items():
+            # only keep the chunks whose local data did not change
+            if hashlib.sha256(self._read_chunk(index)).hexdigest() == digest:
+                done[index] = digest
+        return done
+
+    def _check_done(self, client, part_path):
+        """Return the chunks done whose remote data matches their digest.
+
+        Raise OSError when the remote part cannot be read.
+        """
+        done = {}
+        remote = client.open(part_path, "rb")
+        try:
+            for index, digest in sorted(self.done.items()):
+                remote.seek(index * self.chunk_size)
+                digest_remote = hashlib.sha256()
+                left = min(self.chunk_size, self.size - index * self.chunk_size)
+                while left > 0:
+                    data = remote.read(min(left, 2**20))
+                    if not data:
+                        break
+                    digest_remote.update(data)
+                    left -= len(data)
+                if digest_remote.hexdigest() == digest:
+                    done[index] = digest
+                else:
+                    _logger.warning(
+                        "Chunk %d of %s differs from the local one, sending it again",
+                        index,
+                        part_path,
+                    )
+        finally:
+            remote.close()
+        return done
+
+    def _save_state(self):
+        """Write the state file with the chunks done, appended to afterwards."""
+        with open(f"{self.state_path}.tmp", "w") as state_file:
+            state_file.write(json.dumps(self._state_header()) + "\n")
+            for index, digest in sorted(self.done.items()):
+                state_file.write(json.dumps([index, digest]) + "\n")
+        os.replace(f"{self.state_path}.tmp", self.state_path)
+
+    def upload(self):
+        """Upload the missing chunks, then move the file to its final path."""
+        part_path = self.remote_path + PART_SUFFIX
+        self.done = self._load_state()
+        client = self.connect()
+        try:
+            if self.done:
+                try:
+                    self.done = self._check_done(client, part_path)
+                except OSError:
+                    _logger.warning(
+                        "Partial upload %s is missing, restarting it", part_path
+                    )
+                    self.done = {}
+            if not self.done:
+                # create or truncate the partial file
+                client.open(part_path, "wb").close()
+        finally:
+            client.close()
+        self._save_state()
+        if self.done:
+            _logger.info(
+                "Resuming upload of %s: %d/%d chunks already sent",
+                self.remote_path,
+                len(self.done),
+                self.chunks,
+            )
+        pending = queue.Queue()
+        for index in range(self.chunks):
+            if index not in self.done:
+                pending.put(index)
+        errors = []
+        # the chunks written are appended to the state file, instead of
+        # rewriting it whole after each one
+        with open(self.state_path, "a") as state_file:
+            workers = [
+                threading.Thread(
+                    target=self._worker,
+                    args=(pending, part_path, errors, state_file),
+                    name=f"backup-sftp-{number}",
+                    daemon=True,
+                )
+                for number in range(min(self.channels, pending.qsize()))
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        if errors:
+            raise errors[0]
+        client = self.connect()
+        try:
+            try:
+                client.remove(self.remote_path)
+            except OSError:
+                pass
+            client.rename(part_path, self.remote_path)
+        finally:
+            client.close()
+        try:
+            os.unlink(self.state_path)
+        except FileNotFoundError:
+            pass
+        return self.sent
+
+    def _worker(self, pending, part_path, errors, state_file):
+        client = remote = None
+        failures = 0
+        try:
+            while not errors:
+                try:
+                    index = pending.get_nowait()
+                except queue.Empty:
+                    return
+                data = self._read_chunk(index)
+                while True:
+                    try:
+                        if remote is None:
+                            client = self.connect()
+                            remote = client.open(part_path, "r+")
+                        remote.seek(index * self.chunk_size)
+                        remote.write(data)
+                        remote.flush()
+                        break
+                    except Exception as error:
+                        failures += 1
+                        _logger.warning(
+                            "Upload of chunk %d of %s failed (%d/%d)",
+                            index,
+                            self.remote_path,
+                            failures,
+                            self.retries + 1,
+                        )
+                        self._close(client, remote)
+                        client = remote = None
+                        if failures > self.retries:
+                            errors.append(error)
+                            return
+                with self._lock:
+                    self.done[index] = hashlib.sha256(data).hexdigest()
+                    self.sent += 1
+                    state_file.write(json.dumps([index, self.done[index]]) + "\n")
+                    state_file.flush()
+        finally:
+            self._close(client, remote)
+
+    @staticmethod
+    def _close(client, remote):
+        for resource in (remote, client):
+            if resource is None:
+                continue
+            try:
+                resource.close()
+            except Exception:
+                _logger.debug("Closing an SFTP channel failed", exc_info=True)
@@ -0,0 +1,222 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Destinations of the backups.
+
+All the storages are used as context managers and take absolute, ``/``
+separated paths.
+"""
+
+import io
+import os
+import shutil
+from contextlib import ExitStack, contextmanager
+
+from .s3_upload import MultipartUploader
+from .sftp_upload import ChunkedUploader
+
+PART_SUFFIX = ".part"
+
+
+class Storage:
+    """Interface of a backup destination."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Release the connection to the storage."""
+
+    def open(self, path, mode="rb"):
+        """Return a file object on ``path``, to be used as context manager."""
+        raise NotImplementedError
+
+    def listdir(self, folder):
+        """Return the names of the files and folders in ``folder``.
+
+        A missing folder is empty.
+        """
+        raise NotImplementedError
+
+    def makedirs(self, folder):
+        """Create ``folder`` and its parents if they are missing."""
+        raise NotImplementedError
+
+    def remove(self, path):
+        raise NotImplementedError
+
+    def rename(self, path, new_path):
+        """Move ``path`` to ``new_path``, replacing it if it exists."""
+        raise NotImplementedError
+
+    def put(self, local_path, path):
+        """Copy a local file to ``path``, which only appears once complete."""
+        with open(local_path, "rb") as source:
+            with self.open(path + PART_SUFFIX, "wb") as destiny:
+                shutil.copyfileobj(source, destiny, 2**20)
+        self.rename(path + PART_SUFFIX, path)
+
+    def get(self, path, local_path):
+        """Copy the file at ``path`` to a local file."""
+        with self.open(path, "rb") as source, open(local_path, "wb") as destiny:
+            shutil.copyfileobj(source, destiny, 2**20)
+
+    def upload(self, local_path, path, chunk_size, channels, state_path):
+        """Upload a large local file to ``path``, as fast as the storage can.
+
+        The storages supporting it send the file by chunks over several
+        channels, and resume an interrupted upload from the chunks
+        confirmed in ``state_path``.
+        """
+        self.put(local_path, path)
+
+
+class LocalStorage(Storage):
+    """Folder of the server."""
+
+    def open(self, path, mode="rb"):
+        return open(path, mode)
+
+    def listdir(self, folder):
+        if not os.path.isdir(folder):
+            return []
+        return os.listdir(folder)
+
+    def makedirs(self, folder):
+        os.makedirs(folder, exist_ok=True)
+
+    def remove(self, path):
+        os.unlink(path)
+
+    def rename(self, path, new_path):
+        os.replace(path, new_path)
+
+
+class SftpStorage(Storage):
+    """Folder of a SFTP server.
+
+    :param connect: callable returning a new ``pysftp.Connection``
+    """
+
+    def __init__(self, connect):
+        self.connect = connect
+        self._stack = ExitStack()
+        self.remote = self._stack.enter_context(connect())
+
+    def close(self):
+        self._stack.close()
+
+    def open(self, path, mode="rb"):
+        return self.remote.open(path, mode)
+
+    def listdir(self, folder):
+        if not self.remote.isdir(folder):
+            return []
+        return self.remote.listdir(folder)
+
+    def makedirs(self, folder):
+        self.remote.makedirs(folder)
+
+    def remove(self, path):
+        self.remote.unlink(path)
+
+    def rename(self, path, new_path):
+        if self.remote.exists(new_path):
+            self.remote.unlink(new_path)
+        self.remote.rename(path, new_path)
+
+    def upload(self, local_path, path, chunk_size, channels, state_path):
+        ChunkedUploader(
+            self.connect,
+            local_path,
+            path,
+            chunk_size=chunk_size,
+            channels=channels,
+            state_path=state_path,
+        ).upload()
+
+
+class S3Storage(Storage):
+    """Prefix of a bucket of an S3 compatible object storage.
+
+    The paths are the keys of the objects, without their leading ``/``.
+    Folders only exist through the keys of their objects.
+
+    :param client: a boto3 S3 client
+    """
+
+    def __init__(self, client, bucket):
+        self.client = client
+        self.bucket = bucket
+
+    @staticmethod
+    def _key(path):
+        return path.strip("/")
+
+    @contextmanager
+    def open(self, path, mode="rb"):
+        if "w" in mode:
+            buffer = io.BytesIO()
+            stream = buffer if "b" in mode else io.TextIOWrapper(buffer)
+            yield stream
+            stream.flush()
+            self.client.put_object(
+                Bucket=self.bucket, Key=self._key(path), Body=buffer.getvalue()
+            )
+            return
+        body = self.client.get_object(Bucket=self.bucket, Key=self._key(path))
+        buffer = io.BytesIO(body["Body"].read())
+        yield buffer if "b" in mode else io.TextIOWrapper(buffer)
+
+    def listdir(self, folder):
+        prefix = self._key(folder)
+        prefix = f"{prefix}/" if prefix else ""
+        names = []
+        # the objects are listed by the server, a page at a time
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(
+            Bucket=self.bucket, Prefix=prefix, Delimiter="/"
+        ):
+            names.extend(
+                common["Prefix"][len(prefix) :].rstrip("/")
+                for common in page.get("CommonPrefixes", [])
+            )
+            names.extend(
+                item["Key"][len(prefix) :] for item in page.get("Contents", [])
+            )
+        return names
+
+    def makedirs(self, folder):
+        pass
+
+    def remove(self, path):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(path))
+
+    def rename(self, path, new_path):
+        self.client.copy_object(
+            Bucket=self.bucket,
+            Key=self._key(new_path),
+            CopySource={"Bucket": self.bucket, "Key": self._key(path)},
+        )
+        self.remove(path)
+
+    def put(self, local_path, path):
+        # objects only appear once complete, no need for a partial file
+        with open(local_path, "rb") as source:
+            self.client.put_object(Bucket=self.bucket, Key=self._key(path), Body=source)
+
+    def get(self, path, local_path):
+        # ranges of large objects are downloaded in parallel
+        self.client.download_file(self.bucket, self._key(path), local_path)
+
+    def upload(self, local_path, path, chunk_size, channels, state_path):
+        MultipartUploader(
+            self.client,
+            self.bucket,
+            self._key(path),
+            local_path,
+            chunk_size=chunk_size,
+            channels=channels,
+            state_path=state_path,
+        ).upload()
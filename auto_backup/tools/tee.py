@@ -0,0 +1,90 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import queue
+import threading
+
+
+class BackupTee:
+    """Write-only file object copying what it receives to several streams.
+
+    Each stream is written by its own thread through a bounded queue, so a
+    slow destination only delays the others once ``queue_size`` chunks are
+    pending. A stream failing is dropped and its error stored in
+    ``errors`` under its index, the other ones keep being written.
+    With a ``throttle``, the writes are slowed down to its rate.
+    """
+
+    def __init__(self, streams, queue_size=16, throttle=None):
+        self.streams = list(streams)
+        self.throttle = throttle
+        self.errors = {}
+        self.bytes_written = 0
+        self.closed = False
+        self._queues = [queue.Queue(queue_size) for stream in self.streams]
+        self._threads = [
+            threading.Thread(
+                target=self._writer,
+                args=(index,),
+                name=f"backup-tee-{index}",
+                daemon=True,
+            )
+            for index in range(len(self.streams))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _writer(self, index):
+        stream = self.streams[index]
+        chunks = self._queues[index]
+        while True:
+            data = chunks.get()
+            if data is None:
+                return
+            if index in self.errors:
+                # keep consuming so that the producer is never blocked
+                continue
+            try:
+                stream.write(data)
+            except Exception as error:
+                self.errors[index] = error
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed backup stream")
+        if self.streams and len(self.errors) == len(self.streams):
+            raise OSError("All the backup destinations failed")
+        data = bytes(data)
+        if self.throttle:
+            self.throttle.consume(len(data))
+        for chunks in self._queues:
+            chunks.put(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.bytes_written
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Wait until all the streams received the data written."""
+        if self.closed:
+            return
+        self.closed = True
+        for chunks in self._queues:
+            chunks.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,28 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import threading
+import time
+
+
+class TokenBucket:
+    """Limit the throughput of a stream to ``rate`` bytes per second.
+
+    Bursts of up to one second of traffic are allowed.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, size):
+        """Wait until ``size`` bytes can be sent."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= size
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
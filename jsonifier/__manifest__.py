@@ -15,7 +15,10 @@
     "depends": ["base"],
     "data": [
         "security/ir.model.access.csv",
+        "security/ir_exports_job_security.xml",
+        "data/ir_cron.xml",
         "views/ir_exports_view.xml",
+        "views/ir_exports_job_view.xml",
         "views/ir_exports_resolver_view.xml",
     ],
     "demo": [
@@ -0,0 +1,273 @@
+# License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl).
+"""Benchmark of ``jsonify``, to be run from an Odoo shell:
+
+    from odoo.addons.jsonifier.benchmark import report, run
+    print(report(run(env, sizes=(100, 1000), profile_dir="/tmp/jsonifier")))
+
+Synthetic data is generated in a savepoint, rolled back at the end.
+"""
+
+import cProfile
+import logging
+import os
+import time
+import tracemalloc
+
+from .models.utils import convert_simple_to_full_parser
+
+_logger = logging.getLogger(__name__)
+
+BENCHMARK_LANG = "fr_FR"
+
+FLAT_PARSER = [
+    "id",
+    "name",
+    "email",
+    "phone",
+    "ref",
+    "active",
+    "color",
+    "partner_latitude",
+    "comment",
+    "create_date",
+]
+
+NESTED_PARSER = [
+    "id",
+    "name",
+    ("category_id", ["id", "name"]),
+    ("country_id", ["name", "code"]),
+    (
+        "child_ids",
+        ["id", "name", "email", ("category_id", ["name"]), ("country_id", ["code"])],
+    ),
+    ("bank_ids", ["acc_number", ("bank_id", ["name", "bic"])]),
+]
+
+TRANSLATED_PARSER = [
+    "name:name_fr",
+    ("category_id:category_fr", ["name"]),
+    ("country_id:country_fr", ["name"]),
+]
+
+
+def _upper_name(record, field_name):
+    return (record[field_name] or "").upper()
+
+
+def _flat_parser(env):
+    return FLAT_PARSER
+
+
+def _nested_parser(env):
+    return NESTED_PARSER
+
+
+def _resolver_parser(env):
+    resolvers = env["ir.exports.resolver"].create(
+        [
+            {
+                "name": "Benchmark field",
+                "type": "field",
+                "python_code": "result = {'_value': value, '_json_key': name}",
+            },
+            {
+                "name": "Benchmark global",
+                "type": "global",
+                "python_code": "value['resolved'] = True\nresult = value",
+            },
+        ]
+    )
+    parser = convert_simple_to_full_parser(NESTED_PARSER)
+    for field_key in parser["fields"]:
+        if not isinstance(field_key, tuple):
+            field_key["resolver"] = resolvers[0].id
+    parser["resolver"] = resolvers[1].id
+    return parser
+
+
+def _function_parser(env):
+    parser = convert_simple_to_full_parser(FLAT_PARSER)
+    for field_key in parser["fields"]:
+        if field_key["name"] in ("name", "email", "ref"):
+            field_key["function"] = _upper_name
+    return parser
+
+
+def _multi_lang_parser(env):
+    return {
+        "langs": {
+            False: convert_simple_to_full_parser(FLAT_PARSER)["fields"],
+            BENCHMARK_LANG: convert_simple_to_full_parser(TRANSLATED_PARSER)["fields"],
+        }
+    }
+
+
+SCENARIOS = {
+    "flat": _flat_parser,
+    "nested": _nested_parser,
+    "resolver": _resolver_parser,
+    "function": _function_parser,
+    "multi_lang": _multi_lang_parser,
+}
+
+
+def generate_data(env, size, children=2):
+    """Create ``size`` companies with their contacts, tags and bank accounts.
+
+    Return the companies.
+    """
+    countries = env["res.country"].search([], limit=20)
+    categories = env["res.partner.category"].create(
+        [{"name": f"Benchmark tag {index}"} for index in range(max(size // 10, 1))]
+    )
+    banks = env["res.bank"].create(
+        [
+            {"name": f"Benchmark bank {index}", "bic": f"BENCH{index:03d}XX"}
+            for index in range(5)
+        ]
+    )
+    partners = env["res.partner"].create(
+        [
+            {
+                "name": f"Benchmark company {index}",
+                "is_company": True,
+                "email": f"company{index}@example.com",
+                "phone": f"+32 2 {index:06d}",
+                "ref": f"BENCH{index:06d}",
+                "color": index % 12,
+                "partner_latitude": index / size,
+                "comment": f"<p>Benchmark company {index}</p>",
+                "country_id": countries[index % len(countries)].id
+                if countries
+                else False,
+                "category_id": [
+                    (6, 0, categories[index % len(categories)].ids),
+                ],
+                "child_ids": [
+                    (
+                        0,
+                        0,
+                        {
+                            "name": f"Benchmark contact {index}.{child}",
+                            "email": f"contact{index}.{child}@example.com",
+                            "category_id": [
+                                (6, 0, categories[child % len(categories)].ids)
+                            ],
+                        },
+                    )
+                    for child in range(children)
+                ],
+                "bank_ids": [
+                    (
+                        0,
+                        0,
+                        {
+                            "acc_number": f"BE{index:014d}",
+                            "bank_id": banks[index % len(banks)].id,
+                        },
+                    )
+                ],
+            }
+            for index in range(size)
+        ]
+    )
+    env.flush_all()
+    return partners
+
+
+def measure(records, parser, profile_path=None):
+    """Serialize the records with a cold cache and return the measures.
+
+    The timed run is a clean one: the peak memory and the profile, which
+    slow Python down several times, are measured by separate runs.
+    """
+    env = records.env
+    env.invalidate_all()
+    queries = env.cr.sql_log_count
+    start = time.perf_counter()
+    records.jsonify(parser)
+    duration = time.perf_counter() - start
+    queries = env.cr.sql_log_count - queries
+    env.invalidate_all()
+    tracemalloc.start()
+    try:
+        records.jsonify(parser)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    if profile_path:
+        env.invalidate_all()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            records.jsonify(parser)
+        finally:
+            profiler.disable()
+        profiler.dump_stats(profile_path)
+    return {
+        "records": len(records),
+        "seconds": duration,
+        "records_per_second": len(records) / duration if duration else 0.0,
+        "queries_per_record": queries / len(records) if records else 0.0,
+        "peak_memory": peak,
+    }
+
+
+def run(env, sizes=(100, 1000), scenarios=None, children=2, profile_dir=None):
+    """Benchmark the scenarios for each size of generated data.
+
+    :param sizes: numbers of companies to generate, each with ``children``
+        contacts
+    :param scenarios: names of the ``SCENARIOS`` to run, all by default
+    :param profile_dir: if set, a cProfile dump is written in this
+        directory for each scenario and size
+    :return: a list of dictionaries with the measures of each run
+    """
+    scenarios = scenarios or list(SCENARIOS)
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+    results = []
+    env.flush_all()
+    env.cr.execute("SAVEPOINT jsonifier_benchmark")
+    try:
+        env["res.lang"]._activate_lang(BENCHMARK_LANG)
+        for size in sizes:
+            records = generate_data(env, size, children=children)
+            for name in scenarios:
+                parser = SCENARIOS[name](env)
+                profile_path = profile_dir and os.path.join(
+                    profile_dir, f"{name}-{size}.prof"
+                )
+                result = measure(records, parser, profile_path=profile_path)
+                result["scenario"] = name
+                _logger.info(
+                    "jsonify %(scenario)s: %(records)s records in %(seconds).3fs",
+                    result,
+                )
+                results.append(result)
+    finally:
+        env.cr.execute("ROLLBACK TO SAVEPOINT jsonifier_benchmark")
+        env.invalidate_all()
+        env.registry.clear_cache()
+    return results
+
+
+def report(results):
+    """Format the results of ``run`` as a text table."""
+    header = (
+        f"{'scenario':<12}{'records':>9}{'rec/s':>12}"
+        f"{'queries/rec':>13}{'peak MiB':>10}"
+    )
+    lines = [header, "-" * len(header)]
+    for result in results:
+        lines.append(
+            f"{result['scenario']:<12}{result['records']:>9}"
+            f"{result['records_per_second']:>12.1f}"
+            f"{result['queries_per_record']:>13.2f}"
+            f"{result['peak_memory'] / 1024 / 1024:>10.2f}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,115 @@
+# License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl).
+
+import base64
+import json
+import logging
+
+from werkzeug.exceptions import BadRequest, NotFound
+
+from odoo import api, http
+from odoo.http import request
+from odoo.tools import SQL
+
+_logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 10000
+
+
+def encode_token(export_id, last_id):
+    """Return the token resuming an export after the record ``last_id``."""
+    data = json.dumps([export_id, last_id]).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_token(token, export_id):
+    """Return the id of the last record exported before ``token``."""
+    try:
+        token_export_id, last_id = json.loads(base64.urlsafe_b64decode(token))
+    except (ValueError, TypeError) as error:
+        raise BadRequest("Invalid cursor") from error
+    if token_export_id != export_id or not isinstance(last_id, int):
+        raise BadRequest("Invalid cursor")
+    return last_id
+
+
+class JsonifierController(http.Controller):
+    @http.route(
+        "/jsonifier/export/<int:export_id>",
+        type="http",
+        auth="user",
+        methods=["GET", "POST"],
+        csrf=False,
+    )
+    def export(self, export_id, domain="[]", after=None, batch_size="1000", **kw):
+        """Stream the records of an export matching ``domain`` as NDJSON.
+
+        Records are sent by increasing id, each batch is followed by a
+        ``{"_cursor": token}`` line: passing the token as ``after`` resumes
+        the export after the last record of that batch.
+        """
+        export = request.env["ir.exports"].browse(export_id).exists()
+        if not export:
+            raise NotFound()
+        export.check_access("read")
+        request.env[export.resource].check_access("read")
+        try:
+            domain = json.loads(domain)
+            batch_size = min(max(int(batch_size), 1), MAX_BATCH_SIZE)
+            # validate the domain before the response status is sent
+            request.env[export.resource]._search(domain)
+        except (ValueError, TypeError) as error:
+            raise BadRequest("Invalid domain or batch size") from error
+        last_id = decode_token(after, export_id) if after else 0
+        # the body is sent once the request cursor is closed: the generator
+        # works with its own cursor
+        stream = self._stream_export(
+            request.env.registry,
+            request.env.uid,
+            dict(request.env.context),
+            export_id,
+            domain,
+            last_id,
+            batch_size,
+        )
+        return request.make_response(
+            stream,
+            headers=[
+                ("Content-Type", "application/x-ndjson"),
+                ("Cache-Control", "no-store"),
+                ("X-Accel-Buffering", "no"),
+            ],
+        )
+
+    def _stream_export(
+        self, registry, uid, context, export_id, domain, last_id, batch_size
+    ):
+        with registry.cursor() as cr:
+            env = api.Environment(cr, uid, context)
+            export = env["ir.exports"].browse(export_id)
+            model = env[export.resource]
+            try:
+                query = model._search(domain + [("id", ">", last_id)], order="id")
+                cr.execute(
+                    SQL(
+                        "DECLARE jsonifier_export NO SCROLL CURSOR FOR %s",
+                        query.select(),
+                    )
+                )
+                while True:
+                    cr.execute(
+                        SQL("FETCH FORWARD %s FROM jsonifier_export", batch_size)
+                    )
+                    ids = [row[0] for row in cr.fetchall()]
+                    if not ids:
+                        break
+                    records = model.browse(ids)
+                    yield export._jsonify_ndjson(records).encode()
+                    token = encode_token(export_id, ids[-1])
+                    yield (json.dumps({"_cursor": token}) + "\n").encode()
+                    env.invalidate_all()
+                cr.execute(SQL("CLOSE jsonifier_export"))
+            except Exception as error:
+                # the status is already sent, report the error in the stream
+                _logger.exception("Streaming of export %s failed", export_id)
+                cr.rollback()
+                yield (json.dumps({"_error": str(error)}) + "\n").encode()
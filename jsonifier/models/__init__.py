@@ -1,5 +1,9 @@
 from . import utils
 from . import models
 from . import ir_exports
+from . import ir_exports_checkpoint
+from . import ir_exports_job
 from . import ir_exports_line
 from . import ir_exports_resolver
+from . import ir_exports_tombstone
+from . import jsonifier_cache
@@ -2,10 +2,23 @@
 # Sébastien BEAU <sebastien.beau@akretion.com>
 # License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl.html).
 
+import json
 from collections import OrderedDict
 
-from odoo import fields, models
-from odoo.tools import ormcache
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+from odoo.osv import expression
+from odoo.tools import SQL, json_default, ormcache
+
+# compiled parsers of the current worker: {(dbname, export id): (version, parser)}
+parser_registry = {}
+
+PARSER_FIELDS = {
+    "export_fields",
+    "language_agnostic",
+    "global_resolver_id",
+    "cache_mode",
+}
 
 
 def partition(line, accessor):
@@ -87,17 +100,107 @@ class IrExports(models.Model):
         domain="[('type', '=', 'global')]",
         help="If set, will apply the global resolver to the result",
     )
-
-    @ormcache(
-        "self.language_agnostic",
-        "self.global_resolver_id.id",
-        "tuple(self.export_fields.mapped('write_date'))",
+    cache_mode = fields.Selection(
+        selection=[("memory", "Worker memory"), ("database", "Database")],
+        string="Cache",
+        help="If set, the JSON of the exported records is cached until they or "
+        "their exported sub-records are modified. The memory cache is local to "
+        "each worker, the database cache is shared by all of them.",
+    )
+    incremental = fields.Boolean(
+        help="If set, consumers can export only the records changed since "
+        "their last run and the deletions are recorded",
+    )
+    incremental_subrecords = fields.Boolean(
+        string="Propagate sub-records changes",
+        help="If set, incremental exports also include the records whose "
+        "sub-records exported by the parser changed",
     )
+    incremental_overlap = fields.Integer(
+        string="Overlap (seconds)",
+        help="Records modified up to this many seconds before the checkpoint "
+        "are exported again at the start of each run, to catch the "
+        "transactions committed after the previous run with an earlier "
+        "modification date. Consumers then receive some records twice.",
+    )
+    checkpoint_ids = fields.One2many(
+        comodel_name="ir.exports.checkpoint",
+        inverse_name="export_id",
+        string="Checkpoints",
+    )
+    parser_version = fields.Integer(
+        readonly=True,
+        copy=False,
+        help="Bumped each time the parser changes, compiled parsers are cached "
+        "by the workers under this version",
+    )
+
+    def init(self):
+        # a sequence is not transactional: a version bumped by a rolled back
+        # transaction is never reused for another parser
+        self.env.cr.execute(
+            "CREATE SEQUENCE IF NOT EXISTS ir_exports_parser_version_seq"
+        )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        if records.filtered("incremental"):
+            self.env.registry.clear_cache()
+        return records
+
+    def write(self, vals):
+        if "incremental" in vals or "resource" in vals:
+            self.env.registry.clear_cache()
+        res = super().write(vals)
+        if PARSER_FIELDS.intersection(vals):
+            self._bump_parser_version()
+        return res
+
+    def _bump_parser_version(self):
+        """Invalidate the parsers compiled by the workers."""
+        if not self.ids:
+            return
+        self.flush_recordset(["parser_version"])
+        self.env.cr.execute(
+            SQL(
+                "UPDATE ir_exports "
+                "SET parser_version = nextval('ir_exports_parser_version_seq') "
+                "WHERE id IN %s",
+                tuple(self.ids),
+            )
+        )
+        self.invalidate_recordset(["parser_version"])
+
+    def unlink(self):
+        if self.filtered("incremental"):
+            self.env.registry.clear_cache()
+        return super().unlink()
+
+    @api.model
+    @ormcache()
+    def _get_incremental_models(self):
+        """Return the models whose deletions must be recorded."""
+        exports = self.sudo().search([("incremental", "=", True)])
+        return frozenset(exports.mapped("resource"))
+
     def get_json_parser(self):
         """Creates a parser from ir.exports record and return it.
 
         The final parser can be used to "jsonify" records of ir.export's model.
+        It is compiled once per worker and version of the export.
         """
+        self.ensure_one()
+        key = (self.env.cr.dbname, self.id)
+        version = self.parser_version
+        cached = parser_registry.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+        parser = self._compile_json_parser()
+        parser_registry[key] = (version, parser)
+        return parser
+
+    def _compile_json_parser(self):
         self.ensure_one()
         parser = {}
         lang_to_lines = partition(self.export_fields, lambda _l: _l.lang_id.code)
@@ -121,4 +224,137 @@ class IrExports(models.Model):
             parser["resolver"] = self.global_resolver_id.id
         if self.language_agnostic:
             parser["language_agnostic"] = self.language_agnostic
+        if self.cache_mode:
+            parser["cache"] = self.cache_mode
         return parser
+
+    def _get_subrecord_paths(self):
+        """Return the paths of the sub-records exported by the parser."""
+        self.ensure_one()
+        parser = self.get_json_parser()
+        langs = {False: parser["fields"]} if "fields" in parser else parser["langs"]
+        paths = []
+        for lang_parser in langs.values():
+            paths += self._collect_subrecord_paths(self.env[self.resource], lang_parser)
+        return list(OrderedDict.fromkeys(paths))
+
+    @api.model
+    def _collect_subrecord_paths(self, model, parser, prefix=""):
+        paths = []
+        for field_key in parser:
+            if not isinstance(field_key, tuple):
+                continue
+            field_dict, subparser = field_key
+            field = model._fields.get(field_dict["name"])
+            if not field or field.type not in ("many2one", "one2many", "many2many"):
+                continue
+            path = prefix + field.name
+            comodel = self.env[field.comodel_name]
+            if comodel._log_access:
+                paths.append(path)
+            paths += self._collect_subrecord_paths(comodel, subparser, path + ".")
+        return paths
+
+    def _get_checkpoint(self, consumer):
+        self.ensure_one()
+        checkpoint = self.checkpoint_ids.sudo().filtered(
+            lambda c: c.consumer == consumer
+        )
+        if not checkpoint:
+            checkpoint = checkpoint.create({"export_id": self.id, "consumer": consumer})
+        return checkpoint
+
+    def jsonify_delta(self, consumer, domain=None, limit=None):
+        """JSON-ify the records changed since the last run of ``consumer``.
+
+        Records are exported by increasing modification date and id, so that
+        successive calls with a ``limit`` walk through all the changes. When
+        the export propagates sub-records changes, the records whose exported
+        sub-records were modified since the previous call are added.
+
+        Return a dictionary with the jsonified ``records``, the ids of the
+        ``deleted`` records and ``more``, true when other changes remain to
+        export. The checkpoint of the consumer is then moved forward.
+
+        The modification date of a record is the start of the transaction
+        modifying it: a transaction committed after a call, but started
+        before the last record it exported, is missed unless the export has
+        an overlap covering its duration.
+
+        Only the users allowed to write the checkpoints and to read the
+        exported model can call it, the checkpoints and the deletions being
+        read as superuser.
+        """
+        self.ensure_one()
+        if not self.incremental:
+            raise UserError(
+                _("The export %s is not incremental: its deletions are not recorded.")
+                % self.name
+            )
+        self.env["ir.exports.checkpoint"].check_access("write")
+        model = self.env[self.resource]
+        model.check_access("read")
+        checkpoint = self._get_checkpoint(consumer)
+        domain = domain or []
+        records = model.search(
+            expression.AND(
+                [domain, checkpoint._get_changed_domain(self.incremental_overlap)]
+            ),
+            order="write_date, id",
+            limit=limit,
+        )
+        values = {}
+        if records:
+            last = records[-1]
+            values.update(last_write_date=last.write_date, last_id=last.id)
+        more = bool(limit) and len(records) == limit
+        values["in_progress"] = more
+        if self.incremental_subrecords:
+            since = checkpoint.last_subrecord_date or checkpoint.last_write_date
+            paths = self._get_subrecord_paths()
+            if since and paths:
+                subrecords_domain = expression.OR(
+                    [[(f"{path}.write_date", ">", since)] for path in paths]
+                )
+                records |= model.search(expression.AND([domain, subrecords_domain]))
+            values["last_subrecord_date"] = self.env.cr.now()
+        tombstones = (
+            self.env["ir.exports.tombstone"]
+            .sudo()
+            .search(
+                [
+                    ("res_model", "=", self.resource),
+                    ("id", ">", checkpoint.last_tombstone_id),
+                ]
+            )
+        )
+        if tombstones:
+            values["last_tombstone_id"] = tombstones[-1].id
+        result = {
+            "records": records.jsonify(self.get_json_parser()),
+            "deleted": tombstones.mapped("res_id"),
+            "more": more,
+        }
+        checkpoint.write(values)
+        return result
+
+    def _jsonify_ndjson(self, records):
+        """Return the records JSON-ified as NDJSON, one record per line."""
+        self.ensure_one()
+        return "".join(
+            json.dumps(values, default=json_default) + "\n"
+            for values in records.jsonify(self.get_json_parser())
+        )
+
+    def action_export_in_background(self, domain=None, batch_size=None):
+        """Queue an export job of the records matching ``domain``.
+
+        The job is run by a cron worker, by batches, and stores the result
+        as a compressed NDJSON attachment.
+        """
+        self.ensure_one()
+        values = {"export_id": self.id, "domain": repr(domain or [])}
+        if batch_size:
+            values["batch_size"] = batch_size
+        job = self.env["ir.exports.job"].create(values)
+        return job.get_formview_action()
@@ -0,0 +1,71 @@
+# License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl).
+
+from datetime import timedelta
+
+from odoo import fields, models
+
+
+class IrExportsCheckpoint(models.Model):
+    """High-water mark of an incremental export for one consumer."""
+
+    _name = "ir.exports.checkpoint"
+    _description = "Export Checkpoint"
+    _rec_name = "consumer"
+
+    export_id = fields.Many2one(
+        comodel_name="ir.exports",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    consumer = fields.Char(
+        required=True,
+        help="Identifier of the system consuming the incremental export",
+    )
+    last_write_date = fields.Datetime(
+        help="Modification date of the last exported record",
+    )
+    last_id = fields.Integer(
+        string="Last ID",
+        help="ID of the last exported record, orders records modified "
+        "at the same time",
+    )
+    last_subrecord_date = fields.Datetime(
+        help="Date of the last search of records whose sub-records changed",
+    )
+    last_tombstone_id = fields.Integer(
+        string="Last Tombstone ID",
+        help="ID of the last deletion sent to the consumer",
+    )
+    in_progress = fields.Boolean(
+        help="Set while the changes are exported page by page, the overlap "
+        "only applies to the first page",
+    )
+
+    _sql_constraints = [
+        (
+            "consumer_uniq",
+            "unique(export_id, consumer)",
+            "A consumer can only have one checkpoint per export.",
+        ),
+    ]
+
+    def _get_changed_domain(self, overlap=0):
+        """Domain of the records modified after the checkpoint.
+
+        At the start of a run, the records modified less than ``overlap``
+        seconds before the checkpoint are included again.
+        """
+        self.ensure_one()
+        if not self.last_write_date:
+            return []
+        if overlap and not self.in_progress:
+            since = self.last_write_date - timedelta(seconds=overlap)
+            return [("write_date", ">=", since)]
+        return [
+            "|",
+            ("write_date", ">", self.last_write_date),
+            "&",
+            ("write_date", "=", self.last_write_date),
+            ("id", ">", self.last_id),
+        ]
@@ -0,0 +1,202 @@
+# License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl).
+
+import gzip
+import io
+import logging
+import shutil
+import tempfile
+
+from odoo import api, fields, models
+from odoo.osv import expression
+from odoo.tools.safe_eval import safe_eval
+
+_logger = logging.getLogger(__name__)
+
+PART_SUFFIX = ".ndjson.gz.part"
+
+
+class IrExportsJob(models.Model):
+    """Export run in the background by a cron, by batches of records."""
+
+    _name = "ir.exports.job"
+    _description = "Export Job"
+    _order = "id desc"
+
+    export_id = fields.Many2one(
+        comodel_name="ir.exports",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    resource = fields.Char(related="export_id.resource")
+    domain = fields.Text(default="[]", required=True)
+    user_id = fields.Many2one(
+        comodel_name="res.users",
+        required=True,
+        default=lambda self: self.env.user,
+        help="The records are exported with the access rights of this user",
+    )
+    state = fields.Selection(
+        selection=[
+            ("pending", "Pending"),
+            ("running", "Running"),
+            ("done", "Done"),
+            ("failed", "Failed"),
+        ],
+        default="pending",
+        required=True,
+        readonly=True,
+    )
+    batch_size = fields.Integer(default=1000, required=True)
+    total = fields.Integer(readonly=True)
+    processed = fields.Integer(readonly=True)
+    progress = fields.Float(compute="_compute_progress")
+    last_id = fields.Integer(
+        string="Last ID",
+        readonly=True,
+        help="ID of the last exported record, the next batch starts after it",
+    )
+    attachment_id = fields.Many2one(
+        comodel_name="ir.attachment",
+        string="Result",
+        readonly=True,
+    )
+    error = fields.Text(readonly=True)
+
+    @api.depends("total", "processed", "state")
+    def _compute_progress(self):
+        for job in self:
+            if job.state == "done":
+                job.progress = 100.0
+            elif job.total:
+                job.progress = 100.0 * job.processed / job.total
+            else:
+                job.progress = 0.0
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        jobs = super().create(vals_list)
+        self.env.ref("jsonifier.ir_cron_export_jobs")._trigger()
+        return jobs
+
+    def action_retry(self):
+        """Resume failed jobs after their last exported record.
+
+        Users cannot write on jobs: they can retry the ones they can read,
+        their own ones.
+        """
+        self.check_access("read")
+        self.sudo().filtered(lambda job: job.state == "failed").write(
+            {"state": "running", "error": False}
+        )
+        self.env.ref("jsonifier.ir_cron_export_jobs")._trigger()
+
+    def _get_records_domain(self):
+        self.ensure_one()
+        return safe_eval(self.domain or "[]")
+
+    def _get_parts(self):
+        self.ensure_one()
+        return (
+            self.env["ir.attachment"]
+            .sudo()
+            .search(
+                [
+                    ("res_model", "=", self._name),
+                    ("res_id", "=", self.id),
+                    ("name", "=like", f"%{PART_SUFFIX}"),
+                ],
+                order="id",
+            )
+        )
+
+    @api.model
+    def _cron_run(self, batches=10):
+        """Run up to ``batches`` batches of the pending jobs.
+
+        Each batch is written as a gzip member in a part attachment, the
+        parts are gathered in the result once all the records are
+        exported. The cron is triggered again while jobs remain.
+        """
+        done = 0
+        running = [("state", "in", ("pending", "running"))]
+        for job in self.search(running, order="id"):
+            while batches and job.state in ("pending", "running"):
+                try:
+                    with self.env.cr.savepoint():
+                        done += job._run_batch()
+                except Exception as error:
+                    _logger.exception("Export job %s failed", job.id)
+                    self.env.invalidate_all()
+                    job.write({"state": "failed", "error": str(error)})
+                batches -= 1
+                self.env.invalidate_all()
+        remaining = sum(
+            max(job.total - job.processed, 1) for job in self.search(running)
+        )
+        self.env["ir.cron"]._notify_progress(done=done, remaining=remaining)
+
+    def _run_batch(self):
+        """Export the next batch of records, return their number."""
+        self.ensure_one()
+        model = self.env[self.resource].with_user(self.user_id)
+        domain = self._get_records_domain()
+        if self.state == "pending":
+            self.write({"state": "running", "total": model.search_count(domain)})
+        records = model.search(
+            expression.AND([domain, [("id", ">", self.last_id)]]),
+            order="id",
+            limit=self.batch_size,
+        )
+        if records:
+            data = self.export_id._jsonify_ndjson(records)
+            self.env["ir.attachment"].sudo().create(
+                {
+                    "name": f"{self.id}-{self.processed:012d}{PART_SUFFIX}",
+                    "res_model": self._name,
+                    "res_id": self.id,
+                    "raw": gzip.compress(data.encode()),
+                    "mimetype": "application/gzip",
+                }
+            )
+            self.write(
+                {
+                    "processed": self.processed + len(records),
+                    "last_id": records[-1].id,
+                }
+            )
+        if len(records) < self.batch_size:
+            self._finalize()
+        return len(records)
+
+    def _finalize(self):
+        """Gather the parts in the result attachment.
+
+        The parts are streamed one at a time through a temporary file, only
+        the compressed result is held in memory to create the attachment.
+        """
+        self.ensure_one()
+        parts = self._get_parts()
+        with tempfile.TemporaryFile() as result:
+            with gzip.GzipFile(fileobj=result, mode="wb") as output:
+                for part in parts:
+                    with gzip.GzipFile(fileobj=io.BytesIO(part.raw)) as data:
+                        shutil.copyfileobj(data, output, 2**20)
+                    part.invalidate_recordset(["raw", "datas"])
+            result.seek(0)
+            raw = result.read()
+        attachment = (
+            self.env["ir.attachment"]
+            .sudo()
+            .create(
+                {
+                    "name": f"{self.export_id.name}-{self.id}.ndjson.gz",
+                    "res_model": self._name,
+                    "res_id": self.id,
+                    "raw": raw,
+                    "mimetype": "application/gzip",
+                }
+            )
+        )
+        parts.unlink()
+        self.write({"state": "done", "attachment_id": attachment.id})
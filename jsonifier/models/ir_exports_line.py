@@ -28,6 +28,24 @@ class IrExportsLine(models.Model):
         help="A method defined on the model that takes a record and a field_name",
     )
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records.export_id._bump_parser_version()
+        return records
+
+    def write(self, vals):
+        exports = self.export_id
+        res = super().write(vals)
+        (exports | self.export_id)._bump_parser_version()
+        return res
+
+    def unlink(self):
+        exports = self.export_id
+        res = super().unlink()
+        exports.exists()._bump_parser_version()
+        return res
+
     @api.constrains("resolver_id", "instance_method_name")
     def _check_function_resolver(self):
         for rec in self:
@@ -0,0 +1,30 @@
+# License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl).
+
+from odoo import api, fields, models
+
+
+class IrExportsTombstone(models.Model):
+    """Deleted record of a model having an incremental export."""
+
+    _name = "ir.exports.tombstone"
+    _description = "Export Tombstone"
+    _order = "id"
+
+    res_model = fields.Char(string="Model", required=True, index=True)
+    res_id = fields.Integer(string="Record ID", required=True)
+
+    @api.autovacuum
+    def _gc_tombstones(self):
+        """Delete the tombstones already sent to every consumer."""
+        tracked = self.env["ir.exports"]._get_incremental_models()
+        self.search([("res_model", "not in", list(tracked))]).unlink()
+        sent = {}
+        checkpoints = self.env["ir.exports.checkpoint"].search(
+            [("export_id.resource", "in", list(tracked))]
+        )
+        for checkpoint in checkpoints:
+            res_model = checkpoint.export_id.resource
+            last_id = checkpoint.last_tombstone_id
+            sent[res_model] = min(sent.get(res_model, last_id), last_id)
+        for res_model, last_id in sent.items():
+            self.search([("res_model", "=", res_model), ("id", "<=", last_id)]).unlink()
@@ -0,0 +1,135 @@
+# License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl).
+
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+import psycopg2
+
+from odoo import api, fields, models, tools
+from odoo.tools import SQL
+
+_logger = logging.getLogger(__name__)
+
+# default size of the in-memory cache of each worker, in characters
+DEFAULT_MEMORY_SIZE = 64 * 1024 * 1024
+
+
+class JsonLRU:
+    """Thread-safe LRU of JSON strings bounded by their total length."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        result = {}
+        with self._lock:
+            for key in keys:
+                value = self._data.get(key)
+                if value is not None:
+                    self._data.move_to_end(key)
+                    result[key] = value
+        return result
+
+    def set_many(self, items):
+        with self._lock:
+            for key, value in items.items():
+                if len(value) > self.max_size:
+                    continue
+                old = self._data.pop(key, None)
+                if old is not None:
+                    self.size -= len(old)
+                self._data[key] = value
+                self.size += len(value)
+            while self.size > self.max_size:
+                __, value = self._data.popitem(last=False)
+                self.size -= len(value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+memory_cache = JsonLRU(
+    int(tools.config.get("jsonifier_cache_size") or DEFAULT_MEMORY_SIZE)
+)
+
+
+class JsonifierCache(models.Model):
+    """Serialized records shared between the workers.
+
+    The key of an entry changes as soon as the record or one of its exported
+    sub-records is modified, outdated entries are removed by the autovacuum.
+    """
+
+    _name = "jsonifier.cache"
+    _description = "JSONifier Cache"
+    _log_access = False
+
+    key = fields.Char(required=True, index=True)
+    value = fields.Text(required=True)
+    date = fields.Datetime(required=True, default=fields.Datetime.now)
+
+    _sql_constraints = [
+        ("key_uniq", "unique(key)", "The key of a cache entry must be unique."),
+    ]
+
+    @api.model
+    def _load(self, mode, keys):
+        """Return the cached JSON of the given keys, by key."""
+        if not keys:
+            return {}
+        if mode == "memory":
+            return memory_cache.get_many(keys)
+        self.env.cr.execute(
+            SQL(
+                "SELECT key, value FROM jsonifier_cache WHERE key = ANY(%s)",
+                list(keys),
+            )
+        )
+        return dict(self.env.cr.fetchall())
+
+    @api.model
+    def _store(self, mode, items):
+        """Cache the JSON strings of ``items``, a dictionary by key.
+
+        Nothing is stored in the database by a read-only cursor, the export
+        is not failed for its cache.
+        """
+        if not items:
+            return
+        if mode == "memory":
+            memory_cache.set_many(items)
+            return
+        if getattr(self.env.cr, "readonly", False):
+            return
+        now = fields.Datetime.now()
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env.cr.execute(
+                    SQL(
+                        "INSERT INTO jsonifier_cache (key, value, date) VALUES %s"
+                        " ON CONFLICT (key) DO NOTHING",
+                        SQL(", ").join(
+                            SQL("(%s, %s, %s)", key, value, now)
+                            for key, value in items.items()
+                        ),
+                    )
+                )
+        except psycopg2.errors.ReadOnlySqlTransaction:
+            _logger.debug("Read-only transaction, the JSON is not cached")
+
+    @api.autovacuum
+    def _gc_entries(self):
+        """Remove the entries older than a week, they are likely outdated."""
+        self.env.cr.execute(
+            SQL(
+                "DELETE FROM jsonifier_cache WHERE date < %s",
+                fields.Datetime.now() - timedelta(days=7),
+            )
+        )
@@ -5,11 +5,23 @@
 # Simone Orsi <simahawk@gmail.com>
 # License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl.html).
 
+import hashlib
+import json
 import logging
+import multiprocessing
+import os
+import pickle
+import sys
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 from odoo import api, fields, models, tools
-from odoo.exceptions import UserError
+from odoo.exceptions import AccessError, UserError
+from odoo.modules.registry import Registry
+from odoo.tools import SQL
 from odoo.tools.misc import format_duration
+from odoo.tools.query import Query
 from odoo.tools.translate import _
 
 from ..exceptions import SwallableException
@@ -17,10 +29,152 @@ from .utils import convert_simple_to_full_parser
 
 _logger = logging.getLogger(__name__)
 
+# field types whose jsonified value can be computed by PostgreSQL
+SQL_SCALAR_TYPES = (
+    "boolean",
+    "integer",
+    "char",
+    "text",
+    "html",
+    "selection",
+    "date",
+    "datetime",
+)
+# helpers whose result can be computed by PostgreSQL
+SQL_HELPERS = ("_jsonify_m2o_to_id", "_jsonify_x2m_to_ids")
+
+
+# run by the processes started by jsonify_parallel before they receive any
+# chunk: the addons must be importable to unpickle the chunk function
+PARALLEL_BOOTSTRAP = """\
+import odoo
+odoo.tools.config.options.update(options)
+odoo.modules.module.initialize_sys_path()
+"""
+
+
+def _jsonify_parallel_chunk(
+    db_name, model, ids, parser, uid, su, context, with_fieldname
+):
+    """JSON-ify a chunk of records in a process started by jsonify_parallel."""
+    # the registry is loaded by the first chunk of each process
+    with Registry(db_name).cursor() as cr:
+        env = api.Environment(cr, uid, context, su=su)
+        return env[model].browse(ids).jsonify(parser, with_fieldname=with_fieldname)
+
+
+def _sql_value(values, position, record, field_name):
+    """Parser function returning a value precomputed by the SQL pushdown."""
+    return values[record.id][position]
+
+
+def _copy_json(value):
+    """Return a copy of a JSON-ified value, its dicts and lists included."""
+    if isinstance(value, dict):
+        return {key: _copy_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy_json(item) for item in value]
+    return value
+
+
+def _translated_value(translations, lang, record, field_name):
+    """Parser function returning a value from prefetched translations."""
+    values = translations.get(record.id) or {}
+    for code in (lang, "en_US") if lang else ("en_US",):
+        if values.get(code) is not None:
+            return values[code]
+    return None
+
+
+def _parser_resolver_ids(parser):
+    """Return the ids of the resolvers used by a full parser."""
+    ids = set()
+
+    def collect(resolver):
+        if resolver:
+            ids.add(resolver if isinstance(resolver, int) else resolver.id)
+
+    def walk(fields):
+        for field_key in fields:
+            field_dict, subparser = (
+                field_key if isinstance(field_key, tuple) else (field_key, None)
+            )
+            collect(field_dict.get("resolver"))
+            if subparser:
+                walk(subparser)
+
+    collect(parser.get("resolver"))
+    parsers = {False: parser["fields"]} if "fields" in parser else parser["langs"]
+    for lang_parser in parsers.values():
+        walk(lang_parser)
+    return sorted(ids)
+
+
+def _parser_fingerprint(value):
+    """Return a representation of a parser that is the same in every process.
+
+    Functions are identified by their module and name: raise ValueError for
+    those that cannot be found this way, such as lambdas or closures, whose
+    behavior is not known from their name.
+    """
+    if isinstance(value, dict):
+        return sorted(
+            (repr(key), _parser_fingerprint(item)) for key, item in value.items()
+        )
+    if isinstance(value, list | tuple):
+        return [_parser_fingerprint(item) for item in value]
+    if isinstance(value, partial):
+        return [
+            _parser_fingerprint(value.func),
+            _parser_fingerprint(value.args),
+            _parser_fingerprint(value.keywords),
+        ]
+    if isinstance(value, models.BaseModel):
+        return [value._name, list(value._ids)]
+    if callable(value):
+        name = getattr(value, "__qualname__", None)
+        found = sys.modules.get(getattr(value, "__module__", None))
+        for part in (name or "").split("."):
+            found = getattr(found, part, None)
+        if found is not value:
+            raise ValueError(f"Function {value!r} cannot be identified by its name")
+        return f"{value.__module__}.{name}"
+    return value
+
+
+def _browse_resolvers(resolvers, fields):
+    """Return a copy of the parser fields with the resolver ids browsed.
+
+    Compiled parsers store their resolvers as integers, they are browsed once
+    per export instead of once per record.
+    """
+    result = []
+    for field_key in fields:
+        field_dict, subparser = (
+            field_key if isinstance(field_key, tuple) else (field_key, None)
+        )
+        resolver = field_dict.get("resolver")
+        if resolver and isinstance(resolver, int):
+            field_dict = dict(field_dict, resolver=resolvers.browse(resolver))
+        if isinstance(subparser, list):
+            result.append((field_dict, _browse_resolvers(resolvers, subparser)))
+        elif subparser is not None:
+            result.append((field_dict, subparser))
+        else:
+            result.append(field_dict)
+    return result
+
 
 class Base(models.AbstractModel):
     _inherit = "base"
 
+    def unlink(self):
+        if self and self._name in self.env["ir.exports"]._get_incremental_models():
+            self.env["ir.exports.tombstone"].sudo().create(
+                [{"res_model": self._name, "res_id": id_} for id_ in self.ids]
+            )
+        return super().unlink()
+
     @api.model
     def __parse_field(self, parser_field):
         """Deduct how to handle a field from its parser."""
@@ -31,11 +185,11 @@ class Base(models.AbstractModel):
         raise UserError(_("Wrong parser configuration for field: `%s`") % field_name)
 
     def _function_value(self, record, function, field_name):
-        if function in dir(record):
+        if callable(function):
+            return function(record, field_name)
+        elif function in dir(record):
             method = getattr(record, function, None)
             return method(field_name)
-        elif callable(function):
-            return function(record, field_name)
         else:
             return self._jsonify_bad_parser_error(field_name)
 
@@ -68,8 +222,12 @@ class Base(models.AbstractModel):
             values[key] = value
 
     @api.model
-    def _jsonify_record(self, parser, rec, root):
-        """JSONify one record (rec). Private function called by jsonify."""
+    def _jsonify_record(self, parser, rec, root, memo=None):
+        """JSONify one record (rec). Private function called by jsonify.
+
+        ``memo`` holds the sub-records already serialized by the export, see
+        ``_jsonify_subrecord``.
+        """
         strict = self.env.context.get("jsonify_record_strict", False)
         for field_key in parser:
             field_dict, subparser = rec.__parse_field(field_key)
@@ -93,7 +251,7 @@ class Base(models.AbstractModel):
             elif subparser:
                 try:
                     value = self._jsonify_record_handle_subparser(
-                        rec, field_dict, strict, subparser
+                        rec, field_dict, strict, subparser, memo
                     )
                 except SwallableException:
                     continue
@@ -150,7 +308,9 @@ class Base(models.AbstractModel):
                 )
                 raise SwallableException() from err
 
-    def _jsonify_record_handle_subparser(self, rec, field_dict, strict, subparser):
+    def _jsonify_record_handle_subparser(
+        self, rec, field_dict, strict, subparser, memo=None
+    ):
         field_name = field_dict["name"]
         field = rec._fields[field_name]
         if not (field.relational or field.type == "reference"):
@@ -162,13 +322,29 @@ class Base(models.AbstractModel):
                     {"model": self._name, "fname": field_name},
                 )
                 raise SwallableException()
-        value = [self._jsonify_record(subparser, r, {}) for r in rec[field_name]]
+        value = [self._jsonify_subrecord(subparser, r, memo) for r in rec[field_name]]
 
         if field.type in ("many2one", "reference"):
             value = value[0] if value else None
 
         return value
 
+    def _jsonify_subrecord(self, subparser, rec, memo=None):
+        """JSONify a sub-record, serializing each one only once per call.
+
+        The ``memo`` dictionary is given by ``jsonify``: records reached
+        several times through the same subparser (e.g. the product of many
+        order lines) are serialized the first time only. Each parent gets its
+        own copy of the dictionary, which can be altered without affecting
+        the others.
+        """
+        if memo is None:
+            return self._jsonify_record(subparser, rec, {})
+        key = (rec._name, rec.id, id(subparser), rec.env.context.get("lang"))
+        if key not in memo:
+            memo[key] = self._jsonify_record(subparser, rec, {}, memo)
+        return _copy_json(memo[key])
+
     def _jsonify_record_handle_resolver(self, rec, field, resolver, json_key):
         value = rec._jsonify_value(field, rec[field.name])
         value = resolver.resolve(field, rec)[0] if resolver else value
@@ -179,6 +355,250 @@ class Base(models.AbstractModel):
             value, json_key = value["_value"], value["_json_key"]
         return value, json_key
 
+    def _jsonify_sql_pushdown(self, parser):
+        """Compute the parser entries PostgreSQL can express in one query.
+
+        Stored scalar fields, the ``_jsonify_m2o_to_id`` and
+        ``_jsonify_x2m_to_ids`` helpers and subparsers only made of those are
+        computed by a single query honoring access rules. Return a copy of the
+        parser where these entries are replaced by a function reading the
+        precomputed value, the others being left to the Python implementation.
+        """
+        if (
+            not self
+            or self.env.context.get("jsonify_no_sql")
+            or self.env.context.get("with_fieldname")
+            or not all(isinstance(id_, int) for id_ in self._ids)
+        ):
+            return parser
+        query = self._jsonify_sql_query("jsonify", active_test=False)
+        if query is None:
+            return parser
+        exprs = {}
+        # many2one subparsers by index: comodel and column of the sub-record id
+        references = {}
+        for index, field_key in enumerate(parser):
+            field_dict, subparser = self.__parse_field(field_key)
+            expr = self._jsonify_sql_expr(query, field_dict, subparser)
+            if expr is None:
+                continue
+            exprs[index] = expr
+            field = self._fields[field_dict["name"]]
+            if subparser is not None and field.type == "many2one":
+                references[index] = (
+                    field.comodel_name,
+                    self._field_to_sql(query.table, field.name, query),
+                )
+        if not exprs:
+            return parser
+        ids = list(set(self._ids))
+        query.add_where(SQL("%s = ANY(%s)", SQL.identifier(query.table, "id"), ids))
+        # only the fields used by the query are flushed
+        rows = self.env.execute_query(
+            query.select(
+                SQL.identifier(query.table, "id"),
+                *exprs.values(),
+                *(column for __, column in references.values()),
+            )
+        )
+        values = {row[0]: row[1 : len(exprs) + 1] for row in rows}
+        if len(values) != len(ids):
+            # some records are hidden by record rules: let the ORM raise
+            return parser
+        referenced = defaultdict(set)
+        for row in rows:
+            for (comodel_name, __), sub_id in zip(
+                references.values(), row[len(exprs) + 1 :], strict=True
+            ):
+                if sub_id:
+                    referenced[comodel_name].add(sub_id)
+        for comodel_name, sub_ids in referenced.items():
+            subrecords = self.env[comodel_name].browse(sub_ids)
+            if len(subrecords._filtered_access("read")) != len(subrecords):
+                # the query returns null for the sub-records hidden by record
+                # rules, where the ORM raises
+                return parser
+        parser = list(parser)
+        for position, index in enumerate(exprs):
+            field_dict, __ = self.__parse_field(parser[index])
+            function = partial(_sql_value, values, position)
+            parser[index] = dict(field_dict, function=function)
+        return parser
+
+    @api.model
+    def _jsonify_sql_query(self, alias, active_test=True):
+        """Return a query on the model restricted by its record rules.
+
+        Return None if the current user cannot read the model.
+        """
+        try:
+            allowed = self.with_context(active_test=active_test)._search([])
+        except AccessError:
+            return None
+        query = Query(self.env, alias, SQL.identifier(self._table))
+        query.add_where(
+            SQL("%s IN %s", SQL.identifier(alias, "id"), allowed.subselect())
+        )
+        return query
+
+    @api.model
+    def _jsonify_sql_expr(self, query, field_dict, subparser=None):
+        """Return the SQL expression of a parser entry, None if unsupported."""
+        field = self._fields.get(field_dict["name"])
+        if (
+            field is None
+            or field_dict.get("resolver")
+            or not field.store
+            or field.groups
+            or field.company_dependent
+        ):
+            return None
+        function = field_dict.get("function")
+        if function:
+            return self._jsonify_sql_helper(query, field, function)
+        if subparser is not None:
+            return self._jsonify_sql_subparser(query, field, subparser)
+        if field.type not in SQL_SCALAR_TYPES or not field.column_type:
+            return None
+        column = self._field_to_sql(query.table, field.name, query)
+        if field.type == "boolean":
+            return SQL("COALESCE(%s, FALSE)", column)
+        if field.type == "integer":
+            return SQL("COALESCE(%s, 0)", column)
+        if field.type == "date":
+            return SQL("to_char(%s, 'YYYY-MM-DD')", column)
+        if field.type == "datetime":
+            # same output as datetime.isoformat()
+            return SQL(
+                "to_char(%s, CASE WHEN %s = date_trunc('second', %s)"
+                " THEN 'YYYY-MM-DD\"T\"HH24:MI:SS'"
+                " ELSE 'YYYY-MM-DD\"T\"HH24:MI:SS.US' END)",
+                column,
+                column,
+                column,
+            )
+        return column
+
+    @api.model
+    def _jsonify_sql_helper(self, query, field, function):
+        if (
+            not isinstance(function, str)
+            or function not in SQL_HELPERS
+            # the helper is overridden, its result is unknown
+            or getattr(type(self), function) is not getattr(Base, function)
+        ):
+            return None
+        if function == "_jsonify_m2o_to_id" and field.type == "many2one":
+            column = self._field_to_sql(query.table, field.name, query)
+            return SQL("COALESCE(to_json(%s), 'false'::json)", column)
+        if function == "_jsonify_x2m_to_ids" and field.type in (
+            "one2many",
+            "many2many",
+        ):
+            subquery = self._jsonify_sql_x2many_query(query, field)
+            if subquery is not None:
+                return SQL(
+                    "ARRAY(%s)",
+                    subquery.select(SQL.identifier(subquery.table, "id")),
+                )
+        return None
+
+    @api.model
+    def _jsonify_sql_subparser(self, query, field, subparser):
+        comodel = self.env[field.comodel_name] if field.relational else None
+        if field.type == "many2one":
+            subquery = comodel._jsonify_sql_query(
+                query.make_alias(query.table, field.name), active_test=False
+            )
+            if subquery is not None:
+                subquery.add_where(
+                    SQL(
+                        "%s = %s",
+                        SQL.identifier(subquery.table, "id"),
+                        self._field_to_sql(query.table, field.name, query),
+                    )
+                )
+        elif field.type in ("one2many", "many2many"):
+            subquery = self._jsonify_sql_x2many_query(query, field)
+        else:
+            return None
+        if subquery is None:
+            return None
+        json_object = comodel._jsonify_sql_object(subquery, subparser)
+        if json_object is None:
+            return None
+        if field.type == "many2one":
+            return SQL("(%s)", subquery.select(json_object))
+        return SQL("to_json(ARRAY(%s))", subquery.select(json_object))
+
+    @api.model
+    def _jsonify_sql_x2many_query(self, query, field):
+        """Return a query on the comodel of ``field`` correlated to ``query``.
+
+        The query is ordered like the ORM orders the records of the field.
+        """
+        if field.domain or field.context:
+            return None
+        comodel = self.env[field.comodel_name]
+        subquery = comodel._jsonify_sql_query(
+            query.make_alias(query.table, field.name),
+            active_test=self.env.context.get("active_test", True),
+        )
+        if subquery is None:
+            return None
+        owner = SQL.identifier(query.table, "id")
+        if field.type == "one2many":
+            inverse = comodel._fields.get(field.inverse_name)
+            if not (inverse and inverse.type == "many2one" and inverse.store):
+                return None
+            subquery.add_where(
+                SQL(
+                    "%s = %s",
+                    comodel._field_to_sql(subquery.table, inverse.name, subquery),
+                    owner,
+                )
+            )
+        else:
+            subquery.add_where(
+                SQL(
+                    "%s IN (SELECT %s FROM %s WHERE %s = %s)",
+                    SQL.identifier(subquery.table, "id"),
+                    SQL.identifier(field.column2),
+                    SQL.identifier(field.relation),
+                    SQL.identifier(field.column1),
+                    owner,
+                    to_flush=field,
+                )
+            )
+        subquery.order = comodel._order_to_sql(comodel._order, subquery)
+        return subquery
+
+    @api.model
+    def _jsonify_sql_object(self, query, parser):
+        """Return a ``json_build_object`` expression of a whole subparser.
+
+        Return None if any of its entries cannot be computed in SQL.
+        """
+        args = []
+        for field_key in parser:
+            field_dict, subparser = self.__parse_field(field_key)
+            json_key = field_dict.get("target", field_dict["name"])
+            if "=" in json_key:
+                # marshallers are handled by _add_json_key
+                return None
+            field = self._fields.get(field_dict["name"])
+            if subparser is not None and field and field.type == "many2one":
+                # the access to nested sub-records cannot be checked
+                return None
+            expr = self._jsonify_sql_expr(query, field_dict, subparser)
+            if expr is None:
+                return None
+            args += [SQL("%s", json_key), expr]
+        if not args or len(args) > 100:
+            # json_build_object accepts at most 100 arguments
+            return None
+        return SQL("json_build_object(%s)", SQL(", ").join(args))
+
     def jsonify(self, parser, one=False, with_fieldname=False):
         """Convert the record according to the given parser.
 
@@ -214,8 +634,30 @@ class Base(models.AbstractModel):
         if isinstance(resolver, int):
             # cached versions of the parser are stored as integer
             resolver = self.env["ir.exports.resolver"].browse(resolver)
+        if parser.get("cache"):
+            results = self._jsonify_cached(parser, with_fieldname)
+        else:
+            results = self._jsonify_records(parser, with_fieldname)
+
+        if resolver:
+            results = resolver.resolve(results, self)
+        return results[0] if one else results
+
+    def _jsonify_records(self, parser, with_fieldname=False):
+        """JSONify the records with a full parser, before the global resolver."""
         results = [{} for record in self]
         parsers = {False: parser["fields"]} if "fields" in parser else parser["langs"]
+        if len(parsers) > 1:
+            parsers = self._jsonify_drop_repeated(parsers)
+            parsers = self._jsonify_prefetch_translations(
+                parsers, parser.get("language_agnostic")
+            )
+        resolvers = self.env["ir.exports.resolver"]
+        parsers = {
+            lang: _browse_resolvers(resolvers, lang_parser)
+            for lang, lang_parser in parsers.items()
+        }
+        memo = {}
         for lang in parsers:
             translate = lang or parser.get("language_agnostic")
             new_ctx = {}
@@ -223,13 +665,300 @@ class Base(models.AbstractModel):
                 new_ctx["lang"] = lang
             if with_fieldname:
                 new_ctx["with_fieldname"] = True
-            records = self.with_context(**new_ctx) if new_ctx else self
-            for record, json in zip(records, results, strict=False):
-                self._jsonify_record(parsers[lang], record, json)
+            records = self.with_context(**new_ctx)
+            lang_parser = records._jsonify_sql_pushdown(parsers[lang])
+            for record, values in zip(records, results, strict=False):
+                self._jsonify_record(lang_parser, record, values, memo)
+        return results
+
+    def _jsonify_drop_repeated(self, parsers):
+        """Remove the entries already exported by the parser of another language.
+
+        The entries whose value is the same in every language are serialized
+        in the first language exporting them only, the records of every
+        language being merged into the same dictionaries.
+        """
+        done = []
+        result = {}
+        for lang, lang_parser in parsers.items():
+            result[lang] = []
+            for field_key in lang_parser:
+                if self._jsonify_is_language_independent(field_key):
+                    if field_key in done:
+                        continue
+                    done.append(field_key)
+                result[lang].append(field_key)
+        return result
+
+    def _jsonify_is_language_independent(self, field_key):
+        """Tell whether a parser entry gives the same value in every language."""
+        if (
+            not isinstance(field_key, dict)
+            or field_key.get("function")
+            or field_key.get("resolver")
+            # values marshalled into a list are added by each language
+            or "=" in field_key.get("target", "")
+        ):
+            return False
+        field = self._fields.get(field_key["name"])
+        # the display name of relational fields may be translated
+        return bool(
+            field
+            and field.store
+            and not field.translate
+            and not field.relational
+            and field.type != "reference"
+        )
+
+    def _jsonify_prefetch_translations(self, parsers, language_agnostic=False):
+        """Read the translations needed by all the languages at once.
+
+        Stored translated fields exported by the parsers of each language are
+        fetched with one query per field, reading their JSONB column. Return
+        the parsers where those entries are replaced by a function picking
+        the value of their language, instead of fetching each field again in
+        every language.
+        """
+        if not self or not all(isinstance(id_, int) for id_ in self._ids):
+            return parsers
+        translated = {}
+        for lang_parser in parsers.values():
+            for field_key in lang_parser:
+                if not self._jsonify_is_plain_translated(field_key):
+                    continue
+                translated[field_key["name"]] = self._fields[field_key["name"]]
+        if not translated:
+            return parsers
+        self.check_access("read")
+        self.flush_recordset(list(translated))
+        ids = list(set(self._ids))
+        translations = {}
+        for fname in translated:
+            self.env.cr.execute(
+                SQL(
+                    "SELECT id, %s FROM %s WHERE id = ANY(%s)",
+                    SQL.identifier(fname),
+                    SQL.identifier(self._table),
+                    ids,
+                )
+            )
+            translations[fname] = dict(self.env.cr.fetchall())
+        result = {}
+        for lang, lang_parser in parsers.items():
+            code = lang or (None if language_agnostic else self.env.lang)
+            result[lang] = [
+                dict(
+                    field_key,
+                    function=partial(
+                        _translated_value, translations[field_key["name"]], code
+                    ),
+                )
+                if self._jsonify_is_plain_translated(field_key)
+                else field_key
+                for field_key in lang_parser
+            ]
+        return result
+
+    def _jsonify_is_plain_translated(self, field_key):
+        """Tell whether a parser entry exports a stored translated field as is."""
+        if (
+            not isinstance(field_key, dict)
+            or field_key.get("function")
+            or field_key.get("resolver")
+        ):
+            return False
+        field = self._fields.get(field_key["name"])
+        return bool(
+            field
+            and field.translate
+            and field.store
+            and field.column_type
+            and field.column_type[0] == "jsonb"
+            and not field.groups
+            and not field.company_dependent
+        )
+
+    def _jsonify_cached(self, parser, with_fieldname=False):
+        """Same as ``_jsonify_records``, reusing cached serializations.
+
+        A record is serialized again only if it or one of the sub-records
+        exported by the parser was modified since it was cached.
+        """
+        if not self._log_access or not all(isinstance(id_, int) for id_ in self._ids):
+            return self._jsonify_records(parser, with_fieldname)
+        Cache = self.env["jsonifier.cache"]
+        try:
+            keys = self._jsonify_cache_keys(parser, with_fieldname)
+        except ValueError:
+            _logger.debug("Parser of %s cannot be cached", self._name, exc_info=True)
+            return self._jsonify_records(parser, with_fieldname)
+        cached = Cache._load(parser["cache"], set(keys.values()))
+        todo = self.browse([id_ for id_ in self._ids if keys[id_] not in cached])
+        computed = dict(
+            zip(todo._ids, todo._jsonify_records(parser, with_fieldname), strict=True)
+        )
+        results = []
+        to_store = {}
+        for id_ in self._ids:
+            key = keys[id_]
+            if key not in cached:
+                try:
+                    cached[key] = to_store[key] = json.dumps(computed[id_])
+                except (TypeError, ValueError):
+                    _logger.debug("Cannot cache the JSON of %s(%s)", self._name, id_)
+                    results.append(computed[id_])
+                    continue
+            # the values computed are read back from their JSON as the cached
+            # ones, e.g. tuples become lists in both cases
+            results.append(json.loads(cached[key]))
+        Cache._store(parser["cache"], to_store)
+        return results
+
+    def _jsonify_cache_keys(self, parser, with_fieldname=False):
+        """Return the cache key of each record, by id.
+
+        The key depends on the parser, the language, the resolvers, the
+        access rights of the user and the last modification of the record and
+        of its exported sub-records: users who cannot read the same fields or
+        sub-records never share entries. It is the same in every process, a
+        ValueError is raised when the parser holds functions preventing it.
+        """
+        parsers = {False: parser["fields"]} if "fields" in parser else parser["langs"]
+        resolvers = self.env["ir.exports.resolver"].browse(_parser_resolver_ids(parser))
+        paths = []
+        for lang_parser in parsers.values():
+            paths += self.env["ir.exports"]._collect_subrecord_paths(self, lang_parser)
+        parser_key = hashlib.sha1(
+            repr(
+                (
+                    self.env.cr.dbname,
+                    self._name,
+                    _parser_fingerprint(parser),
+                    resolvers.mapped("write_date"),
+                    self.env.lang,
+                    with_fieldname or bool(self.env.context.get("with_fieldname")),
+                    self.env.uid,
+                    self.env.su,
+                    sorted(self.env.user.groups_id.ids),
+                    self.env.companies.ids,
+                )
+            ).encode()
+        ).hexdigest()
+        keys = {}
+        for record in self:
+            version = [record.write_date]
+            for path in paths:
+                version.append(
+                    sorted((sub.id, sub.write_date) for sub in record.mapped(path))
+                )
+            record_key = hashlib.sha1(repr((record.id, version)).encode())
+            keys[record.id] = f"{parser_key}-{record_key.hexdigest()}"
+        return keys
+
+    def jsonify_parallel(
+        self, parser, workers=None, chunk_size=1000, output=None, with_fieldname=False
+    ):
+        """JSON-ify a large recordset in several processes.
+
+        The records are split in chunks of ``chunk_size`` records, serialized
+        by a pool of ``workers`` processes (one per CPU by default). The
+        processes are started afresh, not forked from the server and its
+        threads, and load their own registry: they only see committed data.
+        They run with the user and the superuser mode of the caller.
+        At most two chunks per process are queued, the others are sent once
+        the results of the first ones are consumed. Results are returned in
+        the order of the recordset or, if ``output`` is given, written to this
+        text file as one JSON document per line, in which case the number of
+        written records is returned.
+
+        The export is done serially by the current process with a single
+        worker or chunk, or when the parser or the context cannot be sent to
+        other processes (e.g. a parser with lambdas).
+        """
+        workers = workers or os.cpu_count() or 1
+        chunks = [
+            self._ids[index : index + chunk_size]
+            for index in range(0, len(self._ids), chunk_size)
+        ]
+        args = (
+            parser,
+            self.env.uid,
+            self.env.su,
+            dict(self.env.context),
+            with_fieldname,
+        )
+        if (
+            workers > 1
+            and len(chunks) > 1
+            and all(isinstance(id_, int) for id_ in self._ids)
+            and self._jsonify_picklable(args)
+        ):
+            results = self._jsonify_parallel_chunks(
+                chunks, min(workers, len(chunks)), parser, with_fieldname
+            )
+        else:
+            results = self._jsonify_serial_chunks(chunks, parser, with_fieldname)
+        if output is None:
+            return [value for chunk in results for value in chunk]
+        count = 0
+        for chunk in results:
+            for value in chunk:
+                output.write(json.dumps(value))
+                output.write("\n")
+                count += 1
+        return count
 
-        if resolver:
-            results = resolver.resolve(results, self)
-        return results[0] if one else results
+    @api.model
+    def _jsonify_picklable(self, args):
+        try:
+            pickle.dumps(args)
+        except Exception:
+            _logger.info("jsonify_parallel: arguments cannot be pickled, serial export")
+            return False
+        return True
+
+    def _jsonify_serial_chunks(self, chunks, parser, with_fieldname=False):
+        for chunk in chunks:
+            records = self.browse(chunk)
+            yield records.jsonify(parser, with_fieldname=with_fieldname)
+            # keep memory bounded, as the chunks of the parallel export
+            records.invalidate_recordset()
+
+    def _jsonify_parallel_chunks(self, chunks, workers, parser, with_fieldname=False):
+        """Yield the JSON of each chunk, in order, computed by other processes."""
+        # the processes must not install or update modules
+        options = {
+            key: value
+            for key, value in tools.config.options.items()
+            if key not in ("init", "update")
+        }
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=exec,
+            initargs=(PARALLEL_BOOTSTRAP, {"options": options}),
+        )
+        context = dict(self.env.context)
+        window = deque()
+        with executor:
+            for chunk in chunks:
+                window.append(
+                    executor.submit(
+                        _jsonify_parallel_chunk,
+                        self.env.cr.dbname,
+                        self._name,
+                        chunk,
+                        parser,
+                        self.env.uid,
+                        self.env.su,
+                        context,
+                        with_fieldname,
+                    )
+                )
+                if len(window) >= 2 * workers:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
 
     # HELPERS
 
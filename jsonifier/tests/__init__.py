@@ -1,3 +1,7 @@
 from . import test_get_parser
 from . import test_helpers
 from . import test_ir_exports_line
+from . import test_ir_exports_delta
+from . import test_ir_exports_job
+from . import test_benchmark
+from . import test_controller
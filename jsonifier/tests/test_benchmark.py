@@ -0,0 +1,38 @@
+# License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl).
+
+import os
+import tempfile
+
+from odoo.tests.common import TransactionCase
+
+from .. import benchmark
+
+
+class TestBenchmark(TransactionCase):
+    def test_run(self):
+        partners = self.env["res.partner"].search_count([])
+        results = benchmark.run(self.env, sizes=(3,), children=1)
+        self.assertEqual(
+            [result["scenario"] for result in results], list(benchmark.SCENARIOS)
+        )
+        for result in results:
+            self.assertEqual(result["records"], 3)
+            self.assertGreater(result["records_per_second"], 0)
+            self.assertGreater(result["peak_memory"], 0)
+        self.assertIn("multi_lang", benchmark.report(results))
+        # the generated data is rolled back
+        self.assertEqual(self.env["res.partner"].search_count([]), partners)
+
+    def test_unknown_scenario(self):
+        with self.assertRaises(ValueError):
+            benchmark.run(self.env, sizes=(1,), scenarios=["nope"])
+
+    def test_measure_profile(self):
+        partners = self.env["res.partner"].search([], limit=3)
+        parser = benchmark.SCENARIOS["flat"](self.env)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profile_path = os.path.join(tmp_dir, "flat.prof")
+            result = benchmark.measure(partners, parser, profile_path=profile_path)
+            self.assertTrue(os.path.getsize(profile_path))
+        self.assertEqual(result["records"], len(partners))
+        self.assertGreater(result["peak_memory"], 0)
@@ -0,0 +1,57 @@
+# License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl).
+
+import json
+
+from odoo.tests import common
+
+
+@common.tagged("post_install", "-at_install")
+class TestJsonifierController(common.HttpCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.categories = cls.env["res.partner.category"].create(
+            [{"name": "Cat 1"}, {"name": "Cat 2"}, {"name": "Cat 3"}]
+        )
+        cls.export = cls.env["ir.exports"].create(
+            {
+                "name": "Categories",
+                "resource": "res.partner.category",
+                "export_fields": [(0, 0, {"name": "id"}), (0, 0, {"name": "name"})],
+            }
+        )
+        cls.domain = json.dumps([["id", "in", cls.categories.ids]])
+
+    def _export(self, **params):
+        response = self.url_open(
+            f"/jsonifier/export/{self.export.id}",
+            data=dict(params, domain=self.domain),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Type"], "application/x-ndjson")
+        return [json.loads(line) for line in response.text.splitlines()]
+
+    def test_stream(self):
+        self.authenticate("admin", "admin")
+        lines = self._export(batch_size=2)
+        self.assertEqual(len(lines), 5)
+        records = [line for line in lines if "_cursor" not in line]
+        self.assertEqual(
+            records, [{"id": cat.id, "name": cat.name} for cat in self.categories]
+        )
+        self.assertIn("_cursor", lines[2])
+        self.assertIn("_cursor", lines[4])
+        # resume after the first batch
+        lines = self._export(batch_size=2, after=lines[2]["_cursor"])
+        self.assertEqual(lines[0], {"id": self.categories[2].id, "name": "Cat 3"})
+        self.assertEqual(len(lines), 2)
+
+    def test_stream_errors(self):
+        self.authenticate("admin", "admin")
+        url = f"/jsonifier/export/{self.export.id}"
+        response = self.url_open(url, data={"domain": "[["})
+        self.assertEqual(response.status_code, 400)
+        response = self.url_open(url, data={"after": "nope"})
+        self.assertEqual(response.status_code, 400)
+        response = self.url_open("/jsonifier/export/0")
+        self.assertEqual(response.status_code, 404)
@@ -3,9 +3,12 @@
 # Simone Orsi <simahawk@gmail.com>
 # License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl).
 
+import io
+import json
+from unittest import mock
 
 from odoo import tools
-from odoo.exceptions import UserError
+from odoo.exceptions import AccessError, UserError
 from odoo.tests.common import TransactionCase
 
 from ..models.utils import convert_simple_to_full_parser
@@ -15,6 +18,19 @@ def jsonify_custom(self, field_name):
     return "yeah!"
 
 
+# records serialized by jsonify_name, a function the cache keys can identify
+jsonify_name_calls = []
+
+
+def jsonify_name(rec, fname):
+    jsonify_name_calls.append(rec.id)
+    return rec[fname]
+
+
+def jsonify_pair(rec, fname):
+    return (rec.id, rec[fname])
+
+
 class TestParser(TransactionCase):
     @classmethod
     def setUpClass(cls):
@@ -118,6 +134,28 @@ class TestParser(TransactionCase):
         expected_full_parser = convert_simple_to_full_parser(expected_parser)
         self.assertEqual(parser, expected_full_parser)
 
+    def test_parser_version(self):
+        exporter = self.env.ref("jsonifier.ir_exp_partner")
+        parser = exporter.get_json_parser()
+        version = exporter.parser_version
+        # unchanged export: the compiled parser is reused
+        self.assertIs(exporter.get_json_parser(), parser)
+        self.env.ref("jsonifier.category_id_name").target = "category_id:cat/name"
+        self.assertGreater(exporter.parser_version, version)
+        new_parser = exporter.get_json_parser()
+        self.assertIsNot(new_parser, parser)
+        self.assertEqual(new_parser["fields"][4][0]["target"], "cat")
+        version = exporter.parser_version
+        exporter.language_agnostic = True
+        self.assertGreater(exporter.parser_version, version)
+        self.assertTrue(exporter.get_json_parser()["language_agnostic"])
+        version = exporter.parser_version
+        exporter.export_fields.filtered(lambda line: line.name == "comment").unlink()
+        self.assertGreater(exporter.parser_version, version)
+        self.assertEqual(
+            len(exporter.get_json_parser()["fields"]), len(parser["fields"]) - 1
+        )
+
     def test_json_export(self):
         # will allow to view large dict diff in case of regression
         self.maxDiff = None
@@ -307,6 +345,199 @@ class TestParser(TransactionCase):
         self.assertDictEqual(json_partner[0], expected_json)
         del self.partner.__class__.jsonify_custom
 
+    def test_json_export_shared_subrecords(self):
+        """Sub-records reached several times are serialized only once."""
+        partners = (self.partner | self.partner.child_ids).with_context(
+            jsonify_no_sql=True
+        )
+        parser = ["name", ("country_id:country", ["code", "name"])]
+        Partner = type(self.env["res.partner"])
+        with mock.patch.object(
+            Partner, "_jsonify_record", autospec=True, wraps=Partner._jsonify_record
+        ) as jsonify_record:
+            json_partners = partners.jsonify(parser)
+        # one call per partner, one for their country
+        self.assertEqual(jsonify_record.call_count, len(partners) + 1)
+        # the memo is given as an argument, not kept in the context
+        for call in jsonify_record.call_args_list:
+            self.assertNotIn("jsonify_memo", call.args[2].env.context)
+        self.assertEqual(json_partners[0]["country"], {"code": "FR", "name": "France"})
+        self.assertEqual(json_partners[0]["country"], json_partners[1]["country"])
+        # each parent can alter its sub-record without affecting the others
+        self.assertIsNot(json_partners[0]["country"], json_partners[1]["country"])
+
+    def test_json_export_sql_pushdown(self):
+        """Entries computed by PostgreSQL give the same result as the ORM."""
+        self.env.cr.execute(
+            "update res_partner set create_date=%s where id=%s",
+            ("2019-10-31 14:39:49.123456", self.partner.id),
+        )
+        self.partner.invalidate_recordset(["create_date"])
+        partners = self.partner | self.partner.child_ids
+        parser = [
+            "id",
+            "name",
+            "color",
+            "active",
+            "comment",
+            "create_date",
+            "partner_latitude",
+            ("country_id:country_id", "_jsonify_m2o_to_id"),
+            ("state_id:state_id", "_jsonify_m2o_to_id"),
+            ("category_id:category_ids", "_jsonify_x2m_to_ids"),
+            ("country_id:country", ["code", "name"]),
+            ("category_id:categories", ["id", "name"]),
+            ("child_ids:children", ["name"]),
+        ]
+        json_sql = partners.jsonify(parser)
+        json_orm = partners.with_context(jsonify_no_sql=True).jsonify(parser)
+        self.assertEqual(json_sql, json_orm)
+        self.assertEqual(json_sql[0]["create_date"], "2019-10-31T14:39:49.123456")
+        self.assertEqual(json_sql[0]["country_id"], self.env.ref("base.fr").id)
+        self.assertIs(json_sql[0]["state_id"], False)
+        self.assertEqual(json_sql[0]["category_ids"], self.partner.category_id.ids)
+        self.assertEqual(json_sql[0]["country"], {"code": "FR", "name": "France"})
+        json_lang = self.category_lang.jsonify(["name"])
+        self.assertEqual(json_lang[0]["name"], self.translated_target)
+
+    def test_json_export_sql_pushdown_access(self):
+        """The SQL pushdown flushes its fields and honors the record rules."""
+        self.partner.comment = "not flushed yet"
+        parser = ["comment", ("country_id:country", ["code"])]
+        self.assertEqual(self.partner.jsonify(parser)[0]["comment"], "not flushed yet")
+        user = self.env["res.users"].create(
+            {
+                "name": "Jsonifier",
+                "login": "jsonifier",
+                "groups_id": [(6, 0, self.env.ref("base.group_user").ids)],
+            }
+        )
+        self.env["ir.rule"].create(
+            {
+                "name": "Hide France",
+                "model_id": self.env["ir.model"]._get_id("res.country"),
+                "domain_force": "[('code', '!=', 'FR')]",
+                "groups": [(6, 0, self.env.ref("base.group_user").ids)],
+            }
+        )
+        # like the ORM, the export fails instead of hiding the country
+        with self.assertRaises(AccessError):
+            self.partner.with_user(user).jsonify(parser)
+
+    def test_json_export_cache(self):
+        calls = jsonify_name_calls
+        for mode in ("memory", "database"):
+            calls.clear()
+            parser = {
+                "cache": mode,
+                "fields": [
+                    {"name": "name", "function": jsonify_name},
+                    ({"name": "parent_id", "target": "parent"}, ["name"]),
+                ],
+            }
+            expected = {"name": "name", "parent": None}
+            self.assertEqual(self.category.jsonify(parser, one=True), expected)
+            self.assertEqual(self.category.jsonify(parser, one=True), expected)
+            self.assertEqual(len(calls), 1)
+            # a new version of the record is serialized again
+            self.env.cr.execute(
+                "UPDATE res_partner_category SET write_date = write_date + "
+                "interval '1 minute' WHERE id = %s",
+                (self.category.id,),
+            )
+            self.category.invalidate_recordset(["write_date"])
+            self.assertEqual(self.category.jsonify(parser, one=True), expected)
+            self.assertEqual(len(calls), 2)
+
+    def test_json_export_cache_identified(self):
+        """Cache keys are the same in every process, hits look like misses."""
+        parser = {
+            "cache": "memory",
+            "fields": [{"name": "name", "function": jsonify_pair}],
+        }
+        key = self.category._jsonify_cache_keys(parser)
+        # built again, as by another process
+        same_parser = {
+            "cache": "memory",
+            "fields": [{"function": jsonify_pair, "name": "name"}],
+        }
+        self.assertEqual(key, self.category._jsonify_cache_keys(same_parser))
+        expected = {"name": [self.category.id, "name"]}
+        self.assertEqual(self.category.jsonify(parser, one=True), expected)
+        self.assertEqual(self.category.jsonify(parser, one=True), expected)
+
+        # a lambda cannot be identified: its records are not cached
+        calls = []
+        parser = {
+            "cache": "database",
+            "fields": [
+                {"name": "name", "function": lambda rec, fname: calls.append(1)}
+            ],
+        }
+        with self.assertRaises(ValueError):
+            self.category._jsonify_cache_keys(parser)
+        self.category.jsonify(parser)
+        self.category.jsonify(parser)
+        self.assertEqual(len(calls), 2)
+
+    def test_json_export_cache_access(self):
+        """Users with other access rights do not share cache entries."""
+        parser = {"cache": "database", "fields": [{"name": "name"}]}
+        user = self.env["res.users"].create(
+            {
+                "name": "Jsonifier",
+                "login": "jsonifier",
+                "groups_id": [(6, 0, self.env.ref("base.group_user").ids)],
+            }
+        )
+        key = self.category._jsonify_cache_keys(parser)
+        self.assertNotEqual(
+            key, self.category.with_user(user)._jsonify_cache_keys(parser)
+        )
+        self.assertNotEqual(
+            key,
+            self.category.with_context(with_fieldname=True)._jsonify_cache_keys(parser),
+        )
+
+    def test_jsonify_parallel(self):
+        # the other processes only see committed records
+        partners = self.env["res.partner"].search(
+            [("id", "not in", (self.partner | self.partner.child_ids).ids)],
+            order="id",
+            limit=5,
+        )
+        parser = ["id", "name", ("country_id", ["code"])]
+        expected = partners.jsonify(parser)
+        with mock.patch.object(
+            type(partners), "_jsonify_serial_chunks"
+        ) as serial_chunks:
+            self.assertEqual(
+                partners.jsonify_parallel(parser, workers=2, chunk_size=2), expected
+            )
+        serial_chunks.assert_not_called()
+        output = io.StringIO()
+        count = partners.jsonify_parallel(
+            parser, workers=1, chunk_size=2, output=output
+        )
+        self.assertEqual(count, len(partners))
+        lines = output.getvalue().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+    def test_jsonify_parallel_sudo(self):
+        """The other processes keep the superuser mode of the caller"""
+        public = self.env.ref("base.public_user")
+        # committed records the public user cannot read
+        params = self.env["ir.config_parameter"].sudo().search([], order="id", limit=4)
+        parser = ["id", "key"]
+        with self.assertRaises(AccessError):
+            params.with_user(public).jsonify(parser)
+        params = params.with_user(public).sudo()
+        expected = params.jsonify(parser)
+        self.assertEqual(len(expected), len(params))
+        self.assertEqual(
+            params.jsonify_parallel(parser, workers=2, chunk_size=2), expected
+        )
+
     def test_full_parser(self):
         parser = self.category_export.get_json_parser()
         json = self.category.jsonify(parser)[0]
@@ -319,6 +550,41 @@ class TestParser(TransactionCase):
         self.assertEqual(json["name_resolved"], "name_pidgin")  # field resolver
         self.assertEqual(json["X"], "X")  # added by global resolver
 
+    def test_full_parser_translations_prefetch(self):
+        """Translations of all languages give the same result as the ORM."""
+        parser = self.category_export.get_json_parser()
+        json_prefetch = self.category._jsonify_records(parser)
+        self.env.invalidate_all()
+        json_orm = {}
+        for lang, lang_parser in parser["langs"].items():
+            json_orm.update(
+                self.category.with_context(lang=lang)._jsonify_records(
+                    {"fields": lang_parser, "language_agnostic": True}
+                )[0]
+            )
+        self.assertEqual(json_prefetch[0], json_orm)
+
+    def test_full_parser_languages_once(self):
+        """Values that do not depend on the language are serialized once."""
+        fields = convert_simple_to_full_parser(["name", "color", "active"])["fields"]
+        parser = {"langs": {"en_US": fields, self.lang.code: fields, False: fields}}
+        category = self.category.with_context(jsonify_no_sql=True)
+        Category = type(category)
+        with mock.patch.object(
+            Category, "_jsonify_value", autospec=True, wraps=Category._jsonify_value
+        ) as jsonify_value:
+            json = category._jsonify_records(parser)[0]
+        # color and active, in the first language only; name is prefetched
+        self.assertEqual(jsonify_value.call_count, 2)
+        self.assertEqual(
+            json,
+            {
+                "name": self.category.name,
+                "color": self.category.color,
+                "active": True,
+            },
+        )
+
     def test_full_parser_resolver_json_key_override(self):
         self.resolver.write(
             {"python_code": """result = {"_json_key": "foo", "_value": record.id}"""}
@@ -0,0 +1,137 @@
+# License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl).
+
+from odoo.exceptions import AccessError, UserError
+from odoo.tests.common import TransactionCase
+
+
+class TestIrExportsDelta(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env = cls.env(context=dict(cls.env.context, tracking_disable=True))
+        cls.categories = cls.env["res.partner.category"].create(
+            [{"name": "Cat 1"}, {"name": "Cat 2"}, {"name": "Cat 3"}]
+        )
+        cls.export = cls.env["ir.exports"].create(
+            {
+                "name": "Incremental categories",
+                "resource": "res.partner.category",
+                "incremental": True,
+                "export_fields": [(0, 0, {"name": "id"}), (0, 0, {"name": "name"})],
+            }
+        )
+        cls.domain = [("id", "in", cls.categories.ids)]
+
+    def _touch(self, records, delay="1 minute"):
+        """Simulate a modification done in a later transaction."""
+        records.flush_recordset()
+        self.env.cr.execute(
+            "UPDATE res_partner_category SET write_date = write_date + %s::interval"
+            " WHERE id IN %s",
+            (delay, tuple(records.ids)),
+        )
+        records.invalidate_recordset(["write_date"])
+
+    def test_delta(self):
+        delta = self.export.jsonify_delta("test", domain=self.domain)
+        self.assertEqual([r["id"] for r in delta["records"]], self.categories.ids)
+        self.assertEqual(delta["deleted"], [])
+        self.assertFalse(delta["more"])
+        # nothing changed since
+        delta = self.export.jsonify_delta("test", domain=self.domain)
+        self.assertEqual(delta["records"], [])
+        # a modified record is exported again
+        self.categories[0].name = "Cat 1 bis"
+        self._touch(self.categories[0])
+        delta = self.export.jsonify_delta("test", domain=self.domain)
+        self.assertEqual(
+            delta["records"], [{"id": self.categories[0].id, "name": "Cat 1 bis"}]
+        )
+        # deletions are sent once
+        deleted_id = self.categories[1].id
+        self.categories[1].unlink()
+        delta = self.export.jsonify_delta("test", domain=self.domain)
+        self.assertEqual(delta["records"], [])
+        self.assertEqual(delta["deleted"], [deleted_id])
+        delta = self.export.jsonify_delta("test", domain=self.domain)
+        self.assertEqual(delta["deleted"], [])
+
+    def test_delta_limit(self):
+        delta = self.export.jsonify_delta("test", domain=self.domain, limit=2)
+        self.assertEqual([r["id"] for r in delta["records"]], self.categories[:2].ids)
+        self.assertTrue(delta["more"])
+        delta = self.export.jsonify_delta("test", domain=self.domain, limit=2)
+        self.assertEqual([r["id"] for r in delta["records"]], self.categories[2:].ids)
+        self.assertFalse(delta["more"])
+        # other consumers have their own checkpoint
+        delta = self.export.jsonify_delta("other", domain=self.domain)
+        self.assertEqual(len(delta["records"]), 3)
+
+    def test_delta_overlap(self):
+        """The changes just before the checkpoint are exported again"""
+        self.export.incremental_overlap = 45
+        self.export.jsonify_delta("test", domain=self.domain)
+        self._touch(self.categories[0], delay="30 seconds")
+        self._touch(self.categories[1], delay="1 minute")
+        delta = self.export.jsonify_delta("test", domain=self.domain, limit=1)
+        self.assertEqual([r["id"] for r in delta["records"]], self.categories[2].ids)
+        self.assertTrue(delta["more"])
+        # the following pages do not go back
+        delta = self.export.jsonify_delta("test", domain=self.domain, limit=1)
+        self.assertEqual([r["id"] for r in delta["records"]], self.categories[0].ids)
+        delta = self.export.jsonify_delta("test", domain=self.domain, limit=1)
+        self.assertEqual([r["id"] for r in delta["records"]], self.categories[1].ids)
+        delta = self.export.jsonify_delta("test", domain=self.domain, limit=1)
+        self.assertEqual(delta["records"], [])
+        self.assertFalse(delta["more"])
+        # a new run goes back by the overlap
+        delta = self.export.jsonify_delta("test", domain=self.domain)
+        self.assertEqual([r["id"] for r in delta["records"]], self.categories[:2].ids)
+
+    def test_delta_not_incremental(self):
+        self.export.incremental = False
+        with self.assertRaises(UserError):
+            self.export.jsonify_delta("test", domain=self.domain)
+
+    def test_delta_access(self):
+        """Only the users managing the checkpoints can move them"""
+        user = self.env["res.users"].create(
+            {
+                "name": "Delta",
+                "login": "delta",
+                "groups_id": [(6, 0, self.env.ref("base.group_user").ids)],
+            }
+        )
+        self.export.jsonify_delta("test", domain=self.domain)
+        checkpoint = self.export.checkpoint_ids
+        last_write_date = checkpoint.last_write_date
+        self._touch(self.categories)
+        with self.assertRaises(AccessError):
+            self.export.with_user(user).jsonify_delta("test", domain=self.domain)
+        self.assertEqual(checkpoint.last_write_date, last_write_date)
+
+    def test_delta_subrecords(self):
+        self.export.write(
+            {
+                "incremental_subrecords": True,
+                "export_fields": [(0, 0, {"name": "parent_id/name"})],
+            }
+        )
+        parent = self.env["res.partner.category"].create({"name": "Parent"})
+        self.categories[2].parent_id = parent
+        self.export.jsonify_delta("test", domain=self.domain)
+        self._touch(parent, delay="1 day")
+        delta = self.export.jsonify_delta("test", domain=self.domain)
+        self.assertEqual([r["id"] for r in delta["records"]], self.categories[2].ids)
+
+    def test_gc_tombstones(self):
+        Tombstone = self.env["ir.exports.tombstone"]
+        self.export.jsonify_delta("test", domain=self.domain)
+        self.categories[0].unlink()
+        tombstone = Tombstone.search([("res_model", "=", "res.partner.category")])
+        self.assertEqual(len(tombstone), 1)
+        Tombstone._gc_tombstones()
+        self.assertTrue(tombstone.exists())
+        self.export.jsonify_delta("test", domain=self.domain)
+        Tombstone._gc_tombstones()
+        self.assertFalse(tombstone.exists())
@@ -0,0 +1,70 @@
+# License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl).
+
+import gzip
+import json
+
+from odoo.tests.common import TransactionCase
+from odoo.tools import mute_logger
+
+
+class TestIrExportsJob(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env = cls.env(context=dict(cls.env.context, tracking_disable=True))
+        cls.categories = cls.env["res.partner.category"].create(
+            [{"name": "Cat 1"}, {"name": "Cat 2"}, {"name": "Cat 3"}]
+        )
+        cls.export = cls.env["ir.exports"].create(
+            {
+                "name": "Categories",
+                "resource": "res.partner.category",
+                "export_fields": [(0, 0, {"name": "id"}), (0, 0, {"name": "name"})],
+            }
+        )
+
+    def _create_job(self, domain):
+        action = self.export.action_export_in_background(domain=domain, batch_size=2)
+        return self.env["ir.exports.job"].browse(action["res_id"])
+
+    def test_job(self):
+        job = self._create_job([("id", "in", self.categories.ids)])
+        self.assertEqual(job.state, "pending")
+        self.env["ir.exports.job"]._cron_run(batches=1)
+        self.assertEqual(job.state, "running")
+        self.assertEqual((job.processed, job.total), (2, 3))
+        self.assertEqual(len(job._get_parts()), 1)
+        self.env["ir.exports.job"]._cron_run()
+        self.assertEqual(job.state, "done")
+        self.assertEqual(job.progress, 100.0)
+        self.assertFalse(job._get_parts())
+        lines = gzip.decompress(job.attachment_id.raw).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            [{"id": cat.id, "name": cat.name} for cat in self.categories],
+        )
+
+    def test_job_failure(self):
+        job = self._create_job([("no_such_field", "=", 1)])
+        with mute_logger("odoo.addons.jsonifier.models.ir_exports_job"):
+            self.env["ir.exports.job"]._cron_run()
+        self.assertEqual(job.state, "failed")
+        self.assertTrue(job.error)
+        self.assertFalse(job.attachment_id)
+
+    def test_job_retry_user(self):
+        """Users retry their own failed jobs, without write access on them"""
+        user = self.env["res.users"].create(
+            {
+                "name": "Exporter",
+                "login": "exporter",
+                "groups_id": [(6, 0, self.env.ref("base.group_user").ids)],
+            }
+        )
+        job = self.env["ir.exports.job"].create(
+            {"export_id": self.export.id, "user_id": user.id}
+        )
+        job.write({"state": "failed", "error": "Boom"})
+        job.with_user(user).action_retry()
+        self.assertEqual(job.state, "running")
+        self.assertFalse(job.error)
@@ -2,9 +2,18 @@
 # @author Nicolas Seinlet
 # Copyright (c) ACSONE SA 2022
 # @author Stéphane Bidoul
+import functools
+import hashlib
 import json
 import logging
 import os
+import queue
+import selectors
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
 
 import psycopg2
 
@@ -14,140 +23,604 @@ from odoo.tools._vendor import sessions
 from odoo.tools.func import lazy_property
 
 _logger = logging.getLogger(__name__)
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+    _logger.debug("Cannot import zstandard")
 
-lock = None
-if odoo.evented:
-    import gevent.lock
+# connections idle for longer than this are checked before being used
+HEALTH_CHECK_INTERVAL = 60
+# number of loaded sessions whose payload digest is kept to skip the
+# writes of unchanged sessions
+LOADED_MAXSIZE = 10000
+# number of expired sessions deleted by each statement of the vacuum
+VACUUM_BATCH_SIZE = 1000
+# channel of the notifications of the written and deleted sessions
+NOTIFY_CHANNEL = "session_db"
+# seconds between two checks of the listener for its stop or its process
+LISTEN_TIMEOUT = 30
+PAYLOAD_FORMATS = ("text", "jsonb", "zlib", "zstd")
+# first byte of the binary payloads, telling how they are compressed
+BINARY_MARKERS = {"zlib": b"\x01", "zstd": b"\x02"}
+# number of writes between two logs of the size of the stored payloads
+PAYLOAD_STATS_INTERVAL = 1000
 
-    lock = gevent.lock.RLock()
-elif odoo.tools.config["workers"] == 0:
-    import threading
 
-    lock = threading.RLock()
+def _touch_interval():
+    """Seconds before the write date of an unchanged session is refreshed."""
+    return int(os.environ.get("SESSION_DB_TOUCH_INTERVAL", 300))
 
 
-def with_lock(func):
-    def wrapper(*args, **kwargs):
-        try:
-            if lock is not None:
-                lock.acquire()
-            return func(*args, **kwargs)
-        finally:
-            if lock is not None:
-                lock.release()
+def _digest(payload):
+    return hashlib.blake2b(payload.encode(), digest_size=16).digest()
 
-    return wrapper
+
+def _payload_format(payload_format=None):
+    """Format of the stored payloads, from ``SESSION_DB_PAYLOAD_FORMAT``."""
+    if payload_format is None:
+        payload_format = os.environ.get("SESSION_DB_PAYLOAD_FORMAT", "text")
+    if payload_format not in PAYLOAD_FORMATS:
+        _logger.warning("Unknown session payload format %r, using text", payload_format)
+        return "text"
+    if payload_format == "zstd" and zstandard is None:
+        _logger.warning("zstandard is not installed, using zlib session payloads")
+        return "zlib"
+    return payload_format
+
+
+def _encode_payload(payload, payload_format):
+    """Return the values of the payload columns of a JSON payload."""
+    values = dict(payload=None, payload_jsonb=None, payload_bytes=None)
+    if payload_format == "text":
+        values["payload"] = payload
+    elif payload_format == "jsonb":
+        values["payload_jsonb"] = payload
+    else:
+        data = payload.encode()
+        if payload_format == "zstd":
+            data = zstandard.ZstdCompressor().compress(data)
+        else:
+            data = zlib.compress(data)
+        values["payload_bytes"] = psycopg2.Binary(BINARY_MARKERS[payload_format] + data)
+    return values
+
+
+def _decode_payload(text, jsonb, binary):
+    """Return the session data of a row, with the format it is stored in."""
+    if binary is not None:
+        binary = bytes(binary)
+        marker, data = binary[:1], binary[1:]
+        if marker == BINARY_MARKERS["zlib"]:
+            return json.loads(zlib.decompress(data)), "zlib"
+        if marker == BINARY_MARKERS["zstd"] and zstandard is not None:
+            return json.loads(zstandard.ZstdDecompressor().decompress(data)), "zstd"
+        raise ValueError(f"Unsupported session payload marker {marker!r}")
+    if jsonb is not None:
+        # psycopg2 parses the jsonb values itself
+        if isinstance(jsonb, str):
+            jsonb = json.loads(jsonb)
+        return jsonb, "jsonb"
+    return json.loads(text), "text"
+
+
+class SessionCache:
+    """Thread safe LRU cache of session payloads, expiring after ``ttl``.
+
+    ``generation`` counts the invalidations: a payload read from the database
+    is only cached when no invalidation happened since before its read.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return self.maxsize > 0
+
+    def get(self, sid):
+        with self._lock:
+            payload, expires = self._entries.get(sid, (None, 0.0))
+            if payload is None:
+                return None
+            if expires < time.monotonic():
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return payload
+
+    def set(self, sid, payload, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                # invalidated meanwhile, the payload may be outdated
+                return
+            self._entries[sid] = (payload, time.monotonic() + self.ttl)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, sid):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(sid, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+def _default_maxconn():
+    """Number of connections of the pool, one per thread serving requests."""
+    maxconn = os.environ.get("SESSION_DB_MAXCONN")
+    if maxconn:
+        return int(maxconn)
+    if odoo.tools.config["workers"] and not odoo.evented:
+        # a worker process serves one request at a time
+        return 1
+    max_http_threads = os.environ.get("ODOO_MAX_HTTP_THREADS")
+    if max_http_threads:
+        return int(max_http_threads)
+    config = odoo.tools.config
+    return max((config["db_maxconn"] - config["max_cron_threads"]) // 2, 1)
 
 
 def with_cursor(func):
+    """Run the operation with a cursor checked out of the pool of the store.
+
+    The cursor is passed after ``self``. When its connection turns out to be
+    broken, the operation is run once more on a new connection. The cursor
+    of an operation failing otherwise is closed, freeing its slot.
+    """
+
+    @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
-        tries = 0
-        while True:
-            tries += 1
+        for attempt in (1, 2):
+            cr = self._checkout()
             try:
-                self._ensure_connection()
-                return func(self, *args, **kwargs)
+                result = func(self, cr, *args, **kwargs)
             except (psycopg2.InterfaceError, psycopg2.OperationalError):
-                self._close_connection()
-                if tries > 4:
-                    _logger.warning(
-                        "session_db operation try %s/5 failed, aborting", tries
-                    )
+                broken = cr._cnx.closed
+                self._discard(cr)
+                if not broken or attempt == 2:
+                    _logger.warning("session_db operation failed, aborting")
                     raise
-                _logger.info("session_db operation try %s/5 failed, retrying", tries)
+                _logger.info("session_db connection lost, retrying")
+            except BaseException:
+                self._discard(cr)
+                raise
+            else:
+                self._checkin(cr)
+                return result
 
     return wrapper
 
 
 class PGSessionStore(sessions.SessionStore):
-    def __init__(self, uri, session_class=None):
+    """Session store in a PostgreSQL table.
+
+    Each operation checks a cursor out of a pool of up to ``maxconn``
+    autocommit connections, the threads serving requests do not wait for
+    each other as long as there are enough connections.
+    """
+
+    def __init__(
+        self,
+        uri,
+        session_class=None,
+        maxconn=None,
+        cache_size=None,
+        cache_ttl=None,
+        payload_format=None,
+    ):
         super().__init__(session_class)
         self._uri = uri
-        self._cr = None
-        self._open_connection()
+        self._maxconn = maxconn or _default_maxconn()
+        self._slots = threading.BoundedSemaphore(self._maxconn)
+        # idle cursors with the time they were checked in, the most recently
+        # used first so the others can be closed by the database when unused
+        self._idle = queue.LifoQueue()
+        self._touch_interval = _touch_interval()
+        # sid: (digest of the payload, time of its last write), for the
+        # sessions loaded or saved by this process, least recently used first
+        self._loaded = OrderedDict()
+        self._loaded_lock = threading.Lock()
+        if cache_size is None:
+            cache_size = int(os.environ.get("SESSION_DB_CACHE_SIZE", 0))
+        if cache_ttl is None:
+            cache_ttl = int(os.environ.get("SESSION_DB_CACHE_TTL", 60))
+        self._cache = SessionCache(cache_size, cache_ttl)
+        # identifies the notifications of this store, not to invalidate the
+        # entries it just wrote; renewed in each process using the store
+        self._token = uuid.uuid4().hex
+        self._listener = None
+        self._listener_pid = None
+        self._listener_stop = threading.Event()
+        self._payload_format = _payload_format(payload_format)
+        # bytes of the JSON payloads written and of their stored values
+        self._payload_stats = dict(writes=0, json_bytes=0, stored_bytes=0)
+        self._payload_stats_lock = threading.Lock()
         self._setup_db()
 
     def __del__(self):
-        self._close_connection()
+        self._listener_stop.set()
+        self._close_connections()
+
+    def close(self):
+        """Stop the listener and close the idle connections."""
+        self._listener_stop.set()
+        if self._listener is not None and self._listener.is_alive():
+            try:
+                self._wake_listener()
+            except Exception:
+                _logger.debug("Cannot wake the session_db listener", exc_info=True)
+            self._listener.join(LISTEN_TIMEOUT)
+        self._close_connections()
+
+    @with_cursor
+    def _wake_listener(self, cr):
+        cr.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, f"{self._token} "))
 
-    @with_lock
-    def _ensure_connection(self):
-        if self._cr is None:
-            self._open_connection()
+    def _ensure_listener(self):
+        """Start the thread invalidating the cache, once per process."""
+        if self._listener_pid == os.getpid() and self._listener.is_alive():
+            return
+        with self._loaded_lock:
+            if self._listener_pid == os.getpid() and self._listener.is_alive():
+                return
+            # the entries cached by the parent of a forked process are stale
+            self._cache.clear()
+            if self._listener_pid != os.getpid():
+                # the processes forked from one parent would otherwise share
+                # its token and ignore the notifications of each other
+                self._token = uuid.uuid4().hex
+            self._listener_pid = os.getpid()
+            self._listener = threading.Thread(
+                target=self._listen, name="session_db.listener", daemon=True
+            )
+            self._listener.start()
 
-    @with_lock
-    def _open_connection(self):
-        self._close_connection()
+    def _listen(self):
+        """Invalidate the sessions written or deleted by other processes."""
+        pid = os.getpid()
+        while not self._listener_stop.is_set() and os.getpid() == pid:
+            try:
+                self._listen_connection(pid)
+            except Exception:
+                _logger.warning(
+                    "session_db listener failed, clearing the cache", exc_info=True
+                )
+                # the notifications sent meanwhile are lost
+                self._cache.clear()
+                self._listener_stop.wait(LISTEN_TIMEOUT)
+
+    def _listen_connection(self, pid):
+        with (
+            self._open_cursor() as cr,
+            selectors.DefaultSelector() as selector,
+        ):
+            cr.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            # entries cached while not listening may have missed notifications
+            self._cache.clear()
+            cnx = cr._cnx
+            selector.register(cnx, selectors.EVENT_READ)
+            try:
+                while not self._listener_stop.is_set() and os.getpid() == pid:
+                    if not selector.select(LISTEN_TIMEOUT):
+                        continue
+                    cnx.poll()
+                    while cnx.notifies:
+                        notify = cnx.notifies.pop()
+                        token, _sep, sid = notify.payload.partition(" ")
+                        if token != self._token:
+                            self._cache.pop(sid)
+            finally:
+                # the connection goes back to the Odoo pool
+                try:
+                    cr.execute(f"UNLISTEN {NOTIFY_CHANNEL}")
+                except Exception:  # pylint: disable=except-pass
+                    pass
+
+    def _open_cursor(self):
         cnx = odoo.sql_db.db_connect(self._uri, allow_uri=True)
-        self._cr = cnx.cursor()
-        self._cr._cnx.autocommit = True
+        cr = cnx.cursor()
+        cr._cnx.autocommit = True
+        return cr
+
+    def _is_healthy(self, cr, idle_since):
+        """Check the connection of an idle cursor can still be used."""
+        if cr._cnx.closed:
+            return False
+        if time.monotonic() - idle_since < HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            cr.execute("SELECT 1")
+        except (psycopg2.InterfaceError, psycopg2.OperationalError):
+            return False
+        return True
+
+    def _checkout(self):
+        """Return a healthy cursor, waiting for one if all are in use."""
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    cr, idle_since = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._open_cursor()
+                if self._is_healthy(cr, idle_since):
+                    return cr
+                _logger.info("session_db connection lost, reconnecting")
+                self._close_cursor(cr)
+        except BaseException:
+            self._slots.release()
+            raise
 
-    @with_lock
-    def _close_connection(self):
-        """Return cursor to the pool."""
-        if self._cr is not None:
+    def _checkin(self, cr):
+        self._idle.put((cr, time.monotonic()))
+        self._slots.release()
+
+    def _discard(self, cr):
+        self._close_cursor(cr)
+        self._slots.release()
+
+    @staticmethod
+    def _close_cursor(cr):
+        """Close the cursor, giving its connection back to the Odoo pool."""
+        try:
+            cr.close()
+        except Exception:  # pylint: disable=except-pass
+            pass
+
+    def _close_connections(self):
+        """Close the idle cursors."""
+        while True:
             try:
-                self._cr.close()
-            except Exception:  # pylint: disable=except-pass
-                pass
-            self._cr = None
+                cr, _idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close_cursor(cr)
+
+    def _remember(self, sid, digest, written):
+        with self._loaded_lock:
+            self._loaded[sid] = (digest, written)
+            self._loaded.move_to_end(sid)
+            while len(self._loaded) > LOADED_MAXSIZE:
+                self._loaded.popitem(last=False)
+
+    def _forget(self, sid):
+        with self._loaded_lock:
+            self._loaded.pop(sid, None)
 
-    @with_lock
     @with_cursor
-    def _setup_db(self):
-        self._cr.execute(
+    def _setup_db(self, cr):
+        cr.execute(
             """
                 CREATE TABLE IF NOT EXISTS http_sessions (
                     sid varchar PRIMARY KEY,
                     write_date timestamp without time zone NOT NULL,
-                    payload text NOT NULL
+                    payload text,
+                    payload_jsonb jsonb,
+                    payload_bytes bytea
                 )
             """
         )
+        # built without blocking the session writes of a large table, in a
+        # statement of its own as it cannot run in a transaction block
+        try:
+            cr.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS "
+                "http_sessions_write_date_index ON http_sessions (write_date)"
+            )
+        except (psycopg2.errors.DuplicateTable, psycopg2.errors.UniqueViolation):
+            _logger.info("Index of the sessions created by another process")
+        # table of a previous version, storing the payloads as text; a no-op
+        # for the processes starting along the one upgrading it
+        cr.execute(
+            """
+                ALTER TABLE http_sessions
+                    ADD COLUMN IF NOT EXISTS payload_jsonb jsonb,
+                    ADD COLUMN IF NOT EXISTS payload_bytes bytea,
+                    ALTER COLUMN payload DROP NOT NULL
+            """
+        )
 
-    @with_lock
-    @with_cursor
     def save(self, session):
+        """Write the session, unless it did not change since it was loaded.
+
+        The write date of an unchanged session is only refreshed once it is
+        older than ``SESSION_DB_TOUCH_INTERVAL`` seconds.
+        """
         payload = json.dumps(dict(session))
-        self._cr.execute(
-            """
-                INSERT INTO http_sessions(sid, write_date, payload)
-                    VALUES (%(sid)s, now() at time zone 'UTC', %(payload)s)
+        digest = _digest(payload)
+        with self._loaded_lock:
+            loaded_digest, written = self._loaded.get(session.sid, (None, 0.0))
+        now = time.time()
+        if digest != loaded_digest:
+            generation = self._cache.generation
+            self._write(session.sid, payload)
+            if self._cache:
+                self._cache.set(session.sid, payload, generation)
+        elif now - written >= self._touch_interval:
+            self._touch(session.sid)
+        else:
+            return
+        self._remember(session.sid, digest, now)
+
+    @with_cursor
+    def _write(self, cr, sid, payload):
+        values = _encode_payload(payload, self._payload_format)
+        cr.execute(
+            self._notify_query()
+            + """
+                INSERT INTO http_sessions(
+                    sid, write_date, payload, payload_jsonb, payload_bytes
+                ) VALUES (
+                    %(sid)s,
+                    now() at time zone 'UTC',
+                    %(payload)s,
+                    %(payload_jsonb)s::jsonb,
+                    %(payload_bytes)s
+                )
                 ON CONFLICT (sid)
-                DO UPDATE SET payload = %(payload)s,
-                              write_date = now() at time zone 'UTC'
+                DO UPDATE SET payload = EXCLUDED.payload,
+                              payload_jsonb = EXCLUDED.payload_jsonb,
+                              payload_bytes = EXCLUDED.payload_bytes,
+                              write_date = EXCLUDED.write_date
+                RETURNING COALESCE(
+                    pg_column_size(payload),
+                    pg_column_size(payload_jsonb),
+                    pg_column_size(payload_bytes)
+                )
             """,
-            dict(sid=session.sid, payload=payload),
+            dict(
+                values,
+                sid=sid,
+                channel=NOTIFY_CHANNEL,
+                notification=f"{self._token} {sid}",
+            ),
+        )
+        self._count_payload(len(payload), cr.fetchone()[0])
+
+    def _count_payload(self, json_bytes, stored_bytes):
+        """Account for a written payload, logging the totals now and then."""
+        with self._payload_stats_lock:
+            stats = self._payload_stats
+            stats["writes"] += 1
+            stats["json_bytes"] += json_bytes
+            stats["stored_bytes"] += stored_bytes
+            if stats["writes"] % PAYLOAD_STATS_INTERVAL:
+                return
+            stats = dict(stats)
+        _logger.info(
+            "%d session payloads of %d bytes of JSON stored as %s in %d bytes "
+            "(%.1f%% smaller)",
+            stats["writes"],
+            stats["json_bytes"],
+            self._payload_format,
+            stats["stored_bytes"],
+            100 * (1 - stats["stored_bytes"] / max(stats["json_bytes"], 1)),
         )
 
-    @with_lock
     @with_cursor
-    def delete(self, session):
-        self._cr.execute("DELETE FROM http_sessions WHERE sid=%s", (session.sid,))
+    def _touch(self, cr, sid):
+        cr.execute(
+            "UPDATE http_sessions SET write_date = now() at time zone 'UTC' "
+            "WHERE sid=%s",
+            (sid,),
+        )
 
-    @with_lock
     @with_cursor
+    def delete(self, cr, session):
+        self._forget(session.sid)
+        self._cache.pop(session.sid)
+        cr.execute(
+            self._notify_query() + "DELETE FROM http_sessions WHERE sid=%(sid)s",
+            dict(
+                sid=session.sid,
+                channel=NOTIFY_CHANNEL,
+                notification=f"{self._token} {session.sid}",
+            ),
+        )
+
+    def _notify_query(self):
+        """Statement notifying the other processes of a written session.
+
+        Only sent by the stores caching the sessions: the notification takes
+        a lock of the whole cluster at commit, serializing the writes.
+        """
+        if not self._cache:
+            return ""
+        return "SELECT pg_notify(%(channel)s, %(notification)s);"
+
     def get(self, sid):
-        self._cr.execute("SELECT payload FROM http_sessions WHERE sid=%s", (sid,))
+        """Return the session, from the cache of the process if possible.
+
+        The entries of the cache are invalidated when other processes write
+        or delete their session, and expire after ``SESSION_DB_CACHE_TTL``
+        seconds in any case.
+        """
+        if self._cache:
+            self._ensure_listener()
+            payload = self._cache.get(sid)
+            if payload is not None:
+                return self.session_class(json.loads(payload), sid, False)
+        # read before the query, an invalidation during it is not missed
+        return self._get(sid, self._cache.generation)
+
+    @with_cursor
+    def _get(self, cr, sid, generation=None):
+        cr.execute(
+            "SELECT payload, payload_jsonb, payload_bytes, "
+            "EXTRACT(EPOCH FROM now() at time zone 'UTC' - write_date) "
+            "FROM http_sessions WHERE sid=%s",
+            (sid,),
+        )
         try:
-            data = json.loads(self._cr.fetchone()[0])
+            text, jsonb, binary, age = cr.fetchone()
+            data, payload_format = _decode_payload(text, jsonb, binary)
         except Exception:
             return self.new()
 
+        payload = json.dumps(data)
+        if payload_format != self._payload_format:
+            self._migrate(cr, sid, payload)
+        self._remember(sid, _digest(payload), time.time() - float(age))
+        if self._cache:
+            self._cache.set(sid, payload, generation)
         return self.session_class(data, sid, False)
 
+    def _migrate(self, cr, sid, payload):
+        """Store the payload in the configured format, keeping its write date."""
+        values = _encode_payload(payload, self._payload_format)
+        cr.execute(
+            """
+                UPDATE http_sessions
+                SET payload = %(payload)s,
+                    payload_jsonb = %(payload_jsonb)s::jsonb,
+                    payload_bytes = %(payload_bytes)s
+                WHERE sid = %(sid)s
+            """,
+            dict(values, sid=sid),
+        )
+
     # This method is not part of the Session interface but is called nevertheless,
     # so let's get it from FilesystemSessionStore.
     rotate = http.FilesystemSessionStore.rotate
 
-    @with_lock
     @with_cursor
-    def vacuum(self, max_lifetime=http.SESSION_LIFETIME):
-        self._cr.execute(
-            "DELETE FROM http_sessions "
-            "WHERE now() at time zone 'UTC' - write_date > %s",
-            (f"{max_lifetime} seconds",),
-        )
+    def vacuum(
+        self, cr, max_lifetime=http.SESSION_LIFETIME, batch_size=VACUUM_BATCH_SIZE
+    ):
+        """Delete the expired sessions, by batches of ``batch_size``.
+
+        Each batch is committed on its own and skips the sessions locked by
+        the requests being served, so the vacuum never makes them wait.
+        Return the number of deleted sessions.
+        """
+        deleted = batches = 0
+        while True:
+            cr.execute(
+                """
+                    DELETE FROM http_sessions WHERE ctid = ANY(ARRAY(
+                        SELECT ctid FROM http_sessions
+                        WHERE write_date < now() at time zone 'UTC' - %s::interval
+                        ORDER BY write_date
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    ))
+                """,
+                (f"{max_lifetime} seconds", batch_size),
+            )
+            deleted += cr.rowcount
+            batches += 1
+            if cr.rowcount < batch_size:
+                break
+        _logger.info("Vacuumed %d sessions in %d batches", deleted, batches)
+        return deleted
 
 
 _original_session_store = http.root.__class__.session_store
@@ -1,14 +1,21 @@
 import logging
+import threading
+import time
 from unittest import mock
 
 import psycopg2
 
+import odoo
 from odoo import http
 from odoo.sql_db import connection_info_for
 from odoo.tests.common import TransactionCase
 from odoo.tools import config
 
-from odoo.addons.session_db.pg_session_store import PGSessionStore
+from odoo.addons.session_db.pg_session_store import (
+    PGSessionStore,
+    SessionCache,
+    zstandard,
+)
 
 
 def _make_postgres_uri(
@@ -34,9 +41,22 @@ class TestPGSessionStore(TransactionCase):
     def setUp(self):
         super().setUp()
         _, connection_info = connection_info_for(config["db_name"])
-        self.session_store = PGSessionStore(
-            _make_postgres_uri(**connection_info), session_class=http.Session
+        self.uri = _make_postgres_uri(**connection_info)
+        self.session_store = self._new_store()
+
+    def _new_store(self, cache_size=0, **kwargs):
+        store = PGSessionStore(
+            self.uri, session_class=http.Session, cache_size=cache_size, **kwargs
         )
+        self.addCleanup(store.close)
+        return store
+
+    def _wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                raise AssertionError("timeout")
+            time.sleep(0.05)
 
     def test_session_crud(self):
         session = self.session_store.new()
@@ -47,8 +67,149 @@ class TestPGSessionStore(TransactionCase):
         self.session_store.delete(session)
         assert self.session_store.get(session.sid).get("test") is None
 
-    def test_retry(self):
-        """Test that session operations are retried before failing"""
+    def test_save_unchanged(self):
+        """Unchanged sessions are not written, only touched once in a while"""
+        store = self.session_store
+        session = store.new()
+        session["test"] = "test"
+        store.save(session)
+        loaded = store.get(session.sid)
+        with (
+            mock.patch.object(store, "_write", wraps=store._write) as write,
+            mock.patch.object(store, "_touch", wraps=store._touch) as touch,
+        ):
+            store.save(loaded)
+            write.assert_not_called()
+            touch.assert_not_called()
+            loaded["test"] = "changed"
+            store.save(loaded)
+            write.assert_called_once()
+            # unchanged, but not written for longer than the touch interval
+            store._touch_interval = 0
+            store.save(loaded)
+            touch.assert_called_once()
+            write.assert_called_once()
+        self.assertEqual(store.get(session.sid)["test"], "changed")
+        store.delete(session)
+
+    def test_vacuum(self):
+        """Expired sessions are deleted by batches"""
+        store = self.session_store
+        sessions = [store.new() for _i in range(4)]
+        for session in sessions:
+            session["test"] = "test"
+            store.save(session)
+        cr = store._checkout()
+        try:
+            cr.execute(
+                "UPDATE http_sessions SET write_date = write_date - interval '8 days' "
+                "WHERE sid IN %s",
+                (tuple(session.sid for session in sessions[:3]),),
+            )
+        finally:
+            store._checkin(cr)
+        self.assertGreaterEqual(store.vacuum(7 * 24 * 3600, batch_size=2), 3)
+        for session in sessions[:3]:
+            self.assertIsNone(store.get(session.sid).get("test"))
+        self.assertEqual(store.get(sessions[3].sid)["test"], "test")
+        store.delete(sessions[3])
+
+    def test_write_date_index(self):
+        """The index of the vacuum is built concurrently, on its own"""
+        execute = odoo.sql_db.Cursor.execute
+        queries = []
+
+        def execute_logged(cr, query, *args, **kwargs):
+            queries.append(query)
+            return execute(cr, query, *args, **kwargs)
+
+        with mock.patch("odoo.sql_db.Cursor.execute", execute_logged):
+            store = self._new_store()
+        create_index = [query for query in queries if "CREATE INDEX" in query]
+        self.assertEqual(len(create_index), 1)
+        self.assertTrue(create_index[0].startswith("CREATE INDEX CONCURRENTLY"))
+        cr = store._checkout()
+        try:
+            cr.execute(
+                "SELECT indisvalid FROM pg_index "
+                "WHERE indexrelid = 'http_sessions_write_date_index'::regclass"
+            )
+            self.assertTrue(cr.fetchone()[0])
+        finally:
+            store._checkin(cr)
+
+    def test_setup_concurrent(self):
+        """Stores starting together set the table up without failing"""
+        errors = []
+
+        def setup():
+            try:
+                self._new_store()
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=setup) for _i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        self.assertEqual(errors, [])
+
+    def _stored_columns(self, store, sid):
+        cr = store._checkout()
+        try:
+            cr.execute(
+                "SELECT payload, payload_jsonb, payload_bytes, write_date "
+                "FROM http_sessions WHERE sid = %s",
+                (sid,),
+            )
+            return cr.fetchone()
+        finally:
+            store._checkin(cr)
+
+    def test_payload_formats(self):
+        """Payloads are stored in the configured format"""
+        formats = ["text", "jsonb", "zlib"]
+        if zstandard is not None:
+            formats.append("zstd")
+        for payload_format in formats:
+            with self.subTest(payload_format=payload_format):
+                store = self._new_store(payload_format=payload_format)
+                session = store.new()
+                session["test"] = "x" * 10000
+                store.save(session)
+                text, jsonb, binary, _date = self._stored_columns(store, session.sid)
+                self.assertEqual(text is not None, payload_format == "text")
+                self.assertEqual(jsonb is not None, payload_format == "jsonb")
+                self.assertEqual(binary is not None, payload_format in ("zlib", "zstd"))
+                self.assertEqual(store.get(session.sid)["test"], "x" * 10000)
+                stats = store._payload_stats
+                self.assertEqual(stats["writes"], 1)
+                if binary is not None:
+                    self.assertLess(stats["stored_bytes"], stats["json_bytes"] / 10)
+                store.delete(session)
+
+    def test_payload_migration(self):
+        """Payloads in another format are converted when they are read"""
+        session = self.session_store.new()
+        session["test"] = "test"
+        self.session_store.save(session)
+        _text, _jsonb, _binary, date = self._stored_columns(
+            self.session_store, session.sid
+        )
+        store = self._new_store(payload_format="zlib")
+        self.assertEqual(store.get(session.sid)["test"], "test")
+        text, jsonb, binary, new_date = self._stored_columns(store, session.sid)
+        self.assertIsNone(text)
+        self.assertIsNone(jsonb)
+        self.assertEqual(bytes(binary)[:1], b"\x01")
+        self.assertEqual(new_date, date)
+        # still readable by the stores configured with another format
+        self.assertEqual(self.session_store.get(session.sid)["test"], "test")
+        self.session_store.delete(session)
+
+    def test_error_not_retried(self):
+        """Errors on a healthy connection are raised at once"""
         with (
             mock.patch("odoo.sql_db.Cursor.execute") as mock_execute,
             self.assertLogs(level=logging.WARNING) as logs,
@@ -62,33 +223,185 @@ class TestPGSessionStore(TransactionCase):
                 # We don't use self.assertRaises because Odoo is overriding
                 # in a way that interferes with the Cursor.execute mock
                 raise AssertionError("expected psycopg2.OperationalError")
-            assert mock_execute.call_count == 5
+            assert mock_execute.call_count == 1
             self.assertEqual(len(logs.records), 1)
             self.assertEqual(logs.records[0].levelno, logging.WARNING)
-            self.assertIn("operation try 5/5 failed, aborting", logs.output[0])
+            self.assertIn("operation failed, aborting", logs.output[0])
         # when the error is resolved, it works again
         self.session_store.get("abc")
 
-    def test_retry_connect_fail(self):
-        with (
-            mock.patch("odoo.sql_db.Cursor.execute") as mock_execute,
-            mock.patch("odoo.sql_db.db_connect") as mock_db_connect,
+    def test_error_frees_connection(self):
+        """The slot of an operation failing otherwise is given back"""
+        store = self._new_store(maxconn=1)
+        with mock.patch("odoo.sql_db.Cursor.execute") as mock_execute:
+            mock_execute.side_effect = psycopg2.DataError()
+            try:
+                store.get("abc")
+            except psycopg2.DataError:  # pylint: disable=except-pass
+                pass
+            else:
+                raise AssertionError("expected psycopg2.DataError")
+        # a leaked slot would block the next operation forever
+        self.assertTrue(store._slots.acquire(timeout=5))
+        store._slots.release()
+        store.get("abc")
+
+    def test_connection_lost(self):
+        """An operation whose connection is lost is run on a new connection"""
+        execute = odoo.sql_db.Cursor.execute
+        broken = []
+
+        def execute_once_broken(cr, *args, **kwargs):
+            if not broken:
+                broken.append(cr)
+                cr._cnx.close()
+                raise psycopg2.OperationalError()
+            return execute(cr, *args, **kwargs)
+
+        session = self.session_store.new()
+        session["test"] = "test"
+        with mock.patch("odoo.sql_db.Cursor.execute", execute_once_broken):
+            self.session_store.save(session)
+        self.assertEqual(len(broken), 1)
+        self.assertEqual(self.session_store.get(session.sid)["test"], "test")
+        self.session_store.delete(session)
+
+    def test_health_check(self):
+        """Idle connections closed meanwhile are replaced on checkout"""
+        cr = self.session_store._checkout()
+        cr._cnx.close()
+        self.session_store._checkin(cr)
+        self.session_store.get("abc")
+        # a connection idle for long is checked before being used
+        cr = self.session_store._checkout()
+        self.session_store._checkin(cr)
+        with mock.patch(
+            "odoo.addons.session_db.pg_session_store.HEALTH_CHECK_INTERVAL", 0
         ):
-            mock_execute.side_effect = psycopg2.OperationalError()
+            with mock.patch("odoo.sql_db.Cursor.execute") as mock_execute:
+                self.session_store._checkin(self.session_store._checkout())
+        mock_execute.assert_called_once_with("SELECT 1")
+
+    def test_reconnect_fail(self):
+        cr = self.session_store._checkout()
+        cr._cnx.close()
+        self.session_store._checkin(cr)
+        with mock.patch("odoo.sql_db.db_connect") as mock_db_connect:
             mock_db_connect.side_effect = RuntimeError("connection failed")
-            # get fails, and a RuntimeError is raised when trying to reconnect
+            # the idle connection is closed, and reconnecting fails
             try:
                 self.session_store.get("abc")
             except RuntimeError:  # pylint: disable=except-pass
                 pass
             else:
-                # We don't use self.assertRaises because Odoo is overriding
-                # in a way that interferes with the Cursor.execute mock
                 raise AssertionError("expected RuntimeError")
-            assert mock_execute.call_count == 1
         # when the error is resolved, it works again
         self.session_store.get("abc")
 
+    def test_pool(self):
+        """Each thread checks out its own connection, up to maxconn"""
+        store = self._new_store(maxconn=2)
+        first = store._checkout()
+        second = store._checkout()
+        self.assertIsNot(first._cnx, second._cnx)
+        waiting = threading.Thread(target=lambda: store._checkin(store._checkout()))
+        waiting.start()
+        waiting.join(0.2)
+        self.assertTrue(waiting.is_alive())
+        store._checkin(first)
+        waiting.join(5)
+        self.assertFalse(waiting.is_alive())
+        # the most recently used connection is reused first
+        self.assertIs(store._checkout(), first)
+        store._checkin(first)
+        store._checkin(second)
+
+    def test_cache(self):
+        """Sessions are read from the cache, invalidated by the other stores"""
+        store = self._new_store(cache_size=10)
+        other = self._new_store(cache_size=10)
+        session = store.new()
+        session["test"] = "test"
+        store.save(session)
+        with mock.patch.object(store, "_get") as get:
+            self.assertEqual(store.get(session.sid)["test"], "test")
+            get.assert_not_called()
+        self.assertEqual(other.get(session.sid)["test"], "test")
+        session["test"] = "changed"
+        store.save(session)
+        self._wait_for(lambda: other.get(session.sid).get("test") == "changed")
+        store.delete(session)
+        self._wait_for(lambda: other.get(session.sid).get("test") is None)
+        self.assertIsNone(store.get(session.sid).get("test"))
+
+    def test_no_cache_no_notify(self):
+        """The stores without a cache do not notify their writes"""
+        execute = odoo.sql_db.Cursor.execute
+        queries = []
+
+        def execute_logged(cr, query, *args, **kwargs):
+            queries.append(query)
+            return execute(cr, query, *args, **kwargs)
+
+        session = self.session_store.new()
+        session["test"] = "test"
+        with mock.patch("odoo.sql_db.Cursor.execute", execute_logged):
+            self.session_store.save(session)
+            self.session_store.delete(session)
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn("pg_notify", "".join(queries))
+
+    def test_cache_forked(self):
+        """The processes forked from one store invalidate the cache of each other"""
+        store = self._new_store(cache_size=10)
+        other = self._new_store(cache_size=10)
+        session = store.new()
+        session["test"] = "test"
+        store.save(session)
+        # as if both were forked from the same store, sharing its token
+        other._token = store._token
+        self.assertEqual(other.get(session.sid)["test"], "test")
+        self.assertNotEqual(other._token, store._token)
+        session["test"] = "changed"
+        store.save(session)
+        self._wait_for(lambda: other.get(session.sid).get("test") == "changed")
+        store.delete(session)
+
+    def test_cache_invalidated_during_get(self):
+        """A session invalidated while it is read is not cached"""
+        store = self._new_store(cache_size=10)
+        session = store.new()
+        session["test"] = "test"
+        self.session_store.save(session)
+        execute = odoo.sql_db.Cursor.execute
+
+        def execute_invalidated(cr, query, *args, **kwargs):
+            if query.startswith("SELECT payload"):
+                # as notified by another process writing the session
+                store._cache.pop(session.sid)
+            return execute(cr, query, *args, **kwargs)
+
+        with mock.patch("odoo.sql_db.Cursor.execute", execute_invalidated):
+            self.assertEqual(store.get(session.sid)["test"], "test")
+        self.assertIsNone(store._cache.get(session.sid))
+        self.session_store.delete(session)
+
+    def test_cache_lru(self):
+        cache = SessionCache(2, 60)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "1")
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get("a"))
+        self.assertFalse(SessionCache(0, 60))
+        generation = cache.generation
+        cache.pop("a")
+        cache.set("a", "1", generation)
+        self.assertIsNone(cache.get("a"))
+
     def test_make_postgres_uri(self):
         connection_info = {
             "host": "localhost",